@@ -1,36 +1,473 @@
-"""Lightweight ANN wrapper (cosine) stored at /data/hnsw.idx."""
+"""Lightweight ANN wrapper (cosine) over versioned index artifacts.
 
-import hnswlib, numpy as np, os
-from typing import Dict, Tuple
+Builds are published under ``$HNSW_DIR/<version>/`` (see ``index_versions``).
+A new version is loaded alongside the live one and swapped in atomically;
+the old index is released once no in-flight query still holds it.
+
+Pages written after a build are ingested online: each batch is appended to
+the version's write-ahead log (``index_wal``) and then inserted into the live
+index, growing its capacity geometrically.  Loading a version replays its log,
+so a crash never needs a full rebuild, and a large log is checkpointed into a
+new published version.  A version's manifest records how far into the previous
+version's log its snapshot reaches (``wal_tail``); loading it replays the rest,
+so pages other workers logged while it was being published are not lost.
+
+Each version may also carry reduced-width Matryoshka graphs
+(``hnsw.p256.idx`` ...) over the same labels.  A ``prefix_dim`` search walks
+the small graph for a few multiples of k candidates, then re-ranks them on the
+full vectors.
+"""
+
+import hnswlib, numpy as np, os, logging, threading, time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, cast
+
+import index_versions
+from index_wal import WriteAheadLog
+from labels import LabelTable
+from vector_store import truncate
 
 DIM = 1536
-PATH = "/data/hnsw.idx"
+HNSW_DIR = os.getenv("HNSW_DIR", "/data/hnsw")
+# Pre-versioning single-file index, still loaded when nothing is published
+LEGACY_PATH = "/data/hnsw.idx"
+INITIAL_CAPACITY = int(os.getenv("HNSW_INITIAL_CAPACITY", "1024"))
+RELOAD_INTERVAL = float(os.getenv("HNSW_RELOAD_INTERVAL", "30"))
+FLUSH_INTERVAL = float(os.getenv("HNSW_FLUSH_INTERVAL", "1"))
+INGEST_BATCH = int(os.getenv("HNSW_INGEST_BATCH", "64"))
+CHECKPOINT_RECORDS = int(os.getenv("HNSW_CHECKPOINT_RECORDS", "5000"))
+WAL_FILE = "wal.log"
+# Prefix graphs kept per version, and candidates fetched from them per result
+PREFIX_DIMS = tuple(int(d) for d in os.getenv("HNSW_PREFIX_DIMS", "256").split(",") if d)
+PREFIX_CANDIDATES = int(os.getenv("HNSW_PREFIX_CANDIDATES", "4"))
 
-idx = hnswlib.Index(space="cosine", dim=DIM)
-if os.path.exists(PATH):
-    idx.load_index(PATH)
-else:
-    idx.init_index(max_elements=20000, ef_construction=200, M=16)
+logger = logging.getLogger("ann_hnsw")
+
+
+class _RWLock:
+    """Any number of readers (queries) or one writer (graph mutation); waiting writers go first."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+class IndexHandle:
+    """One loaded index version: hnswlib index, label table and manifest."""
+
+    def __init__(
+        self,
+        version: Optional[str],
+        index: Any,
+        labels: LabelTable,
+        manifest: Optional[Dict[str, Any]] = None,
+        prefixes: Optional[Dict[int, Any]] = None,
+    ):
+        self.version = version
+        self.index = index
+        # prefix width -> reduced hnswlib index with the same labels
+        self.prefixes: Dict[int, Any] = prefixes or {}
+        self.labels = labels
+        self.manifest = manifest or {}
+        self.wal: Optional[WriteAheadLog] = _wal_for(version)
+        # Logged but not yet inserted records, applied in batches
+        self.pending: List[Tuple[str, int, Any]] = []
+        # Serialises writers (ingest, flush, publish) on this version
+        self.lock = threading.RLock()
+        # Queries share the graphs; only add/resize excludes them (not publish's save_index)
+        self.graph = _RWLock()
+        self._refs = 0
+        self._retired = False
+        self._ref_lock = threading.Lock()
+
+    def _acquire(self) -> None:
+        with self._ref_lock:
+            self._refs += 1
+
+    def _release(self) -> None:
+        with self._ref_lock:
+            self._refs -= 1
+            if self._retired and self._refs == 0:
+                self._free()
+
+    def _retire(self) -> None:
+        with self._ref_lock:
+            self._retired = True
+            if self._refs == 0:
+                self._free()
+
+    def _free(self) -> None:
+        # Dropping the last reference lets hnswlib release the native graph
+        self.index = None
+        self.prefixes = {}
+
+
+def _wal_for(version: Optional[str], offset: int = 0) -> Optional[WriteAheadLog]:
+    if version is None:
+        return None
+    wal = WriteAheadLog(os.path.join(index_versions.version_dir(HNSW_DIR, version), WAL_FILE))
+    wal.offset = offset
+    return wal
+
+
+def _prefix_path(path: str, dim: int) -> str:
+    base, ext = os.path.splitext(str(path))
+    return f"{base}.p{dim}{ext}"
+
+
+def _new_index(dim: int, capacity: int) -> Any:
+    index = hnswlib.Index(space="cosine", dim=dim)
+    index.init_index(max_elements=capacity, ef_construction=200, M=16)
+    return index
+
+
+def _add_items(h: IndexHandle, vecs: np.ndarray, labels: np.ndarray) -> None:
+    # Full graph and every prefix graph grow together and share labels
+    needed = int(labels.max()) + 1
+    for dim, index in [(DIM, h.index), *h.prefixes.items()]:
+        capacity = index.get_max_elements()
+        if needed > capacity:
+            index.resize_index(max(needed, 2 * capacity))
+        # Existing labels are updated in place, so stale vectors never linger
+        index.add_items(vecs if dim == DIM else truncate(vecs, dim), labels)
+
+
+def _apply(h: IndexHandle, records: Sequence[Tuple[str, int, Any]]) -> None:
+    """Insert or replace pages in one ``add_items`` call, growing capacity as needed."""
+    if not records:
+        return
+    with h.lock, h.graph.write():
+        # Last write wins for a page updated twice in one batch
+        latest = {h.labels.label_for(s, p): v for s, p, v in records}
+        labels = np.fromiter(latest.keys(), dtype=np.int64, count=len(latest))
+        vecs = np.asarray(list(latest.values()), dtype=np.float32)
+        _add_items(h, vecs, labels)
+
+
+def _empty_handle() -> IndexHandle:
+    prefixes = {dim: _new_index(dim, INITIAL_CAPACITY) for dim in PREFIX_DIMS}
+    return IndexHandle(None, _new_index(DIM, INITIAL_CAPACITY), LabelTable(), prefixes=prefixes)
+
+
+def _load_file(path: str, version: Optional[str], manifest: Optional[Dict[str, Any]] = None) -> IndexHandle:
+    index = hnswlib.Index(space="cosine", dim=DIM)
+    index.load_index(path)
+    prefixes = {}
+    for dim in PREFIX_DIMS:
+        # Versions built before prefix graphs existed simply search at full width
+        if os.path.exists(_prefix_path(path, dim)):
+            prefixes[dim] = hnswlib.Index(space="cosine", dim=dim)
+            prefixes[dim].load_index(_prefix_path(path, dim))
+    handle = IndexHandle(version, index, LabelTable.load_or_empty(path), manifest, prefixes)
+    tail = handle.manifest.get("wal_tail")
+    if tail:
+        # Logged against the previous version after this snapshot was taken
+        previous = cast(WriteAheadLog, _wal_for(tail["version"], tail["offset"]))
+        _apply(handle, previous.read_new())
+    if handle.wal is not None:
+        _apply(handle, handle.wal.read_new())
+    return handle
+
+
+def load_handle(version: Optional[str] = None) -> IndexHandle:
+    """Load ``version`` (default: the published CURRENT one) from disk and replay its log."""
+    version = version or index_versions.read_current(HNSW_DIR)
+    if version:
+        path = index_versions.index_path(HNSW_DIR, version)
+        return _load_file(path, version, index_versions.read_manifest(HNSW_DIR, version))
+    if os.path.exists(LEGACY_PATH):
+        return _load_file(LEGACY_PATH, None)
+    return _empty_handle()
 
-def add(vec: list[float], id_: int):
-    idx.add_items(np.asarray([vec], dtype=np.float32), [id_])
 
-# id map for reverse lookup of HNSW integer IDs
-_id_map: Dict[int, Tuple[str, int]] = {}
+# ── Live version ────────────────────────────────────────
+_current: Optional[IndexHandle] = None
+_swap_lock = threading.Lock()
+
+
+@contextmanager
+def acquire() -> Iterator[IndexHandle]:
+    """Pin the live index for the duration of one operation."""
+    global _current
+    with _swap_lock:
+        if _current is None:
+            _current = load_handle()
+        handle = _current
+        handle._acquire()
+    try:
+        yield handle
+    finally:
+        handle._release()
+
+
+def current_version() -> Optional[str]:
+    return _current.version if _current is not None else None
+
+
+def reload(version: Optional[str] = None) -> IndexHandle:
+    """Load a version next to the live one, then swap it in atomically."""
+    global _current
+    new = load_handle(version)
+    with _swap_lock:
+        old, _current = _current, new
+    if old is not None:
+        with old.lock:
+            # Pages this worker queued (or others logged) against the old version
+            carried = _drain(old)
+        if carried:
+            with new.lock:
+                # Logged again against the new version, so a restart or another worker sees them too
+                others = new.wal.append(carried) if new.wal is not None else []
+                new.pending[:0] = carried
+                new.pending.extend(others)
+        old._retire()
+    logger.info(f"HNSW index now at version {new.version}")
+    return new
+
+
+def publish(version: Optional[str] = None) -> str:
+    """Checkpoint the live index (pending pages included) as a new version."""
+    version = version or index_versions.new_version()
+    with acquire() as h:
+        with h.lock:
+            # Everything logged against the outgoing version goes into the snapshot
+            _apply(h, _drain(h))
+            old_wal = h.wal
+            tail = {"version": h.version, "offset": old_wal.offset} if old_wal is not None else None
+            os.makedirs(index_versions.version_dir(HNSW_DIR, version), exist_ok=True)
+            path = index_versions.index_path(HNSW_DIR, version)
+            h.index.save_index(path)
+            for dim, index in h.prefixes.items():
+                index.save_index(_prefix_path(path, dim))
+            h.labels.save(path)
+            index_versions.write_manifest(
+                HNSW_DIR, version, count=h.index.get_current_count(), dim=DIM, stories=h.labels.stories,
+                prefix_dims=sorted(h.prefixes), wal_tail=tail,
+            )
+            # Later writes go to the new version's (empty) log
+            h.version = version
+            h.wal = _wal_for(version)
+        index_versions.write_current(HNSW_DIR, version)
+        if old_wal is not None:
+            with h.lock:
+                # Logged by workers that had not seen the new version yet (replayed from wal_tail on a reload)
+                h.pending.extend(old_wal.read_new())
+    return version
+
+
+# ── Online ingestion ────────────────────────────────────
+def _drain(h: IndexHandle) -> List[Tuple[str, int, Any]]:
+    """Queued pages plus whatever other workers logged since; caller holds ``h.lock``."""
+    batch: List[Tuple[str, int, Any]] = h.pending + (h.wal.read_new() if h.wal is not None else [])
+    h.pending = []
+    return batch
+
+
+def ingest(records: Sequence[Tuple[str, int, Any]]) -> None:
+    """
+    Log new or updated ``(story_id, page_num, embedding)`` records, then queue
+    them for a batched insert into the live index.
+    """
+    if not records:
+        return
+    records = [(s, p, np.asarray(v, dtype=np.float32)) for s, p, v in records]
+    while True:
+        published = index_versions.read_current(HNSW_DIR)
+        if published and published != current_version():
+            reload(published)
+        with acquire() as h:
+            if h.wal is None:
+                # Nothing published yet: give the log a version to belong to
+                publish()
+            # publish() always attaches a log to the handle
+            wal = cast(WriteAheadLog, h.wal)
+            with h.lock:
+                # Swapped out, or published elsewhere, since the check above: its log is retired
+                if h is not _current or index_versions.read_current(HNSW_DIR) not in (None, h.version):
+                    continue
+                others = wal.append(records)
+                h.pending.extend(others)
+                h.pending.extend(records)
+                backlog, logged = len(h.pending), wal.records
+        break
+    if backlog >= INGEST_BATCH:
+        flush()
+    if logged >= CHECKPOINT_RECORDS:
+        publish()
+
+
+def flush() -> None:
+    """Insert queued pages and anything other workers logged since last time."""
+    with acquire() as h:
+        if h.wal is None:
+            return
+        with h.lock:
+            _apply(h, _drain(h))
+
+
+class _Watcher(threading.Thread):
+    """Flush ingested pages and hot-swap when another process publishes a version."""
+
+    def __init__(self, interval: float, flush_interval: float):
+        super().__init__(name="hnsw-watcher", daemon=True)
+        self.interval = interval
+        self.flush_interval = min(flush_interval, interval)
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        last_check = 0.0
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                if time.monotonic() - last_check >= self.interval:
+                    last_check = time.monotonic()
+                    published = index_versions.read_current(HNSW_DIR)
+                    if published and published != current_version():
+                        reload(published)
+                flush()
+            except Exception as e:
+                logger.warning(f"HNSW background update failed: {e}")
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+
+_watcher: Optional[_Watcher] = None
+
+
+def start_watcher(interval: float = RELOAD_INTERVAL, flush_interval: float = FLUSH_INTERVAL) -> None:
+    global _watcher
+    if interval > 0 and _watcher is None:
+        _watcher = _Watcher(interval, flush_interval)
+        _watcher.start()
+
+
+def stop_watcher() -> None:
+    global _watcher
+    if _watcher is not None:
+        _watcher.stop()
+        _watcher = None
+
+
+# ── Index operations (all on one pinned version) ────────
+def add(vec: list[float], id_: int):
+    with acquire() as h, h.lock, h.graph.write():
+        _add_items(h, np.asarray([vec], dtype=np.float32), np.asarray([id_], dtype=np.int64))
 
 def pack_id(story_id: str, page_num: int) -> int:
-    """Pack a (story_id, page_num) into an integer and store mapping."""
-    i = abs(hash(f"{story_id}|{page_num}")) % (2**31)
-    _id_map[i] = (story_id, page_num)
-    return i
+    """Return the stable label for (story_id, page_num), assigning one if new."""
+    with acquire() as h, h.lock:
+        label: int = h.labels.label_for(story_id, page_num)
+        return label
 
 def unpack_id(i: int) -> Tuple[str, int]:
-    """Unpack an integer ID back into (story_id, page_num)."""
-    return _id_map.get(i, ("unknown", 0))
+    """Unpack an integer label back into (story_id, page_num)."""
+    with acquire() as h:
+        page: Tuple[str, int] = h.labels.lookup(i)
+        return page
 
 def query(vec: np.ndarray, k: int):
-    lbls, dists = idx.knn_query(vec.reshape(1, -1), k=k)
+    with acquire() as h, h.graph.read():
+        lbls, dists = h.index.knn_query(vec.reshape(1, -1), k=k)
     return list(zip(lbls[0].tolist(), dists[0].tolist()))
 
+def _exact(h: IndexHandle, vec: np.ndarray, k: int, labels: np.ndarray):
+    """Full-width cosine distances for ``labels``; the ``k`` nearest, knn_query-shaped."""
+    items = np.asarray(h.index.get_items(labels.tolist()), dtype=np.float32)
+    q = vec / (np.linalg.norm(vec) + 1e-9)
+    dists = 1 - items @ q
+    order = np.argsort(dists)[:k]
+    return labels[order].reshape(1, -1), dists[order].reshape(1, -1)
+
+def search(
+    vec: np.ndarray,
+    k: int,
+    ef: Optional[int] = None,
+    story_id: Optional[str] = None,
+    page_from: Optional[int] = None,
+    page_to: Optional[int] = None,
+    prefix_dim: Optional[int] = None,
+) -> List[Tuple[str, int, float]]:
+    """
+    Top-k as ``(story_id, page_num, distance)``, resolved against the same version.
+
+    ``story_id``/``page_from``/``page_to`` restrict the walk itself through a
+    label filter, so a scoped query needs no over-fetching.  ``prefix_dim``
+    walks that prefix graph (when the version has one) and re-ranks its
+    candidates at full width.
+    """
+    vec = np.asarray(vec, dtype=np.float32).reshape(1, -1)
+    with acquire() as h, h.graph.read():
+        prefix = h.prefixes.get(prefix_dim) if prefix_dim else None
+        graph = prefix if prefix is not None else h.index
+        if ef is not None:
+            graph.set_ef(ef)
+        filt, allowed = None, None
+        if story_id is not None or page_from is not None or page_to is not None:
+            mask = h.labels.mask(story_id, page_from, page_to)
+            allowed = np.flatnonzero(mask)
+            if len(allowed) == 0:
+                return []
+            k = min(k, len(allowed))
+            filt = lambda label: label < len(mask) and bool(mask[label])
+        try:
+            if prefix is None:
+                lbls, dists = h.index.knn_query(vec, k=k, filter=filt)
+            else:
+                m = max(k, min(PREFIX_CANDIDATES * k, prefix.get_current_count()))
+                if allowed is not None:
+                    m = min(m, len(allowed))
+                cand, _ = prefix.knn_query(truncate(vec, prefix_dim), k=m, filter=filt)
+                lbls, dists = _exact(h, vec[0], k, cand[0])
+        except RuntimeError:
+            # Very selective filters can starve the graph walk; score the few allowed labels directly
+            if allowed is None:
+                raise
+            lbls, dists = _exact(h, vec[0], k, allowed)
+        ids = h.labels.lookup_many(lbls[0].tolist())
+    return [(story_id, page_num, dist) for (story_id, page_num), dist in zip(ids, dists[0].tolist())]
+
+def search_many(vecs: np.ndarray, k: int, ef: Optional[int] = None) -> List[List[Tuple[str, int, float]]]:
+    """One multi-row ``knn_query`` (parallel over rows in hnswlib) for a batch of queries."""
+    with acquire() as h, h.graph.read():
+        if ef is not None:
+            h.index.set_ef(ef)
+        lbls, dists = h.index.knn_query(np.asarray(vecs, dtype=np.float32), k=k)
+        rows = [h.labels.lookup_many(row) for row in lbls.tolist()]
+    return [
+        [(story_id, page_num, dist) for (story_id, page_num), dist in zip(ids, row_dists)]
+        for ids, row_dists in zip(rows, dists.tolist())
+    ]
+
 def save():
-    idx.save_index(PATH) 
\ No newline at end of file
+    return publish()
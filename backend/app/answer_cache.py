@@ -0,0 +1,145 @@
+"""
+Semantic answer cache for ``/chat`` and ``/chat/stream``.
+
+Each entry is (normalised query embedding, context page ids, answer).  A new
+question is scored against every cached query vector in one mat-vec over a
+small fixed-size matrix; the nearest entries with cosine similarity of at
+least ``ANSWER_CACHE_THRESHOLD`` are served only if they were answered from
+the same context pages.  Entries expire after ``ANSWER_CACHE_TTL`` seconds,
+the oldest slot is reused once ``ANSWER_CACHE_SIZE`` is reached, and writing
+a page drops every entry that was answered from it.  Entries are indexed by
+the same page tags as the shared cache (``retrieval.page_tag``), so a page
+write invalidated through ``cache.cache_invalidate_tags`` reaches the answer
+cache of every worker.
+"""
+import os
+import time
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+
+from retrieval import page_tag
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "3600"))
+# Near neighbours checked for a matching context before giving up
+ANSWER_CACHE_PROBES = 8
+
+logger = logging.getLogger("answer_cache")
+
+PageId = Tuple[str, int]
+
+
+class _Entry(NamedTuple):
+    pages: Tuple[PageId, ...]
+    answer: str
+    expires: float
+
+
+def page_ids(pages: Iterable[Dict[str, Any]]) -> Tuple[PageId, ...]:
+    """Context identity of a packed page list (order is part of the prompt)."""
+    return tuple((p["story_id"], int(p["page_num"])) for p in pages)
+
+
+class AnswerCache:
+    """Fixed-size ring of query vectors with their answers, searched exactly."""
+
+    def __init__(self, maxsize: int = ANSWER_CACHE_SIZE, threshold: float = ANSWER_CACHE_THRESHOLD, ttl: int = ANSWER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._vecs: Optional[np.ndarray] = None
+            self._entries: List[Optional[_Entry]] = [None] * self.maxsize
+            # page tag -> slots answered from that page
+            self._by_tag: Dict[str, Set[int]] = {}
+            self._next = 0
+
+    def __len__(self) -> int:
+        return sum(e is not None for e in self._entries)
+
+    @staticmethod
+    def _unit(q_vec: Any) -> np.ndarray:
+        vec = np.asarray(q_vec, dtype=np.float32).ravel()
+        return vec / (np.linalg.norm(vec) + 1e-12)
+
+    def get(self, q_vec: Any, pages: Tuple[PageId, ...]) -> Optional[str]:
+        """Cached answer for a query this similar, answered from these ``pages``."""
+        if self._vecs is None or self.maxsize == 0:
+            return None
+        q = self._unit(q_vec)
+        now = time.time()
+        with self._lock:
+            sims = self._vecs @ q
+            probes = min(ANSWER_CACHE_PROBES, len(sims))
+            nearest = np.argpartition(-sims, probes - 1)[:probes]
+            for slot in nearest[np.argsort(-sims[nearest])]:
+                if sims[slot] < self.threshold:
+                    break
+                entry = self._entries[int(slot)]
+                if entry is None:
+                    continue
+                if entry.expires <= now:
+                    self._drop(int(slot))
+                    continue
+                if entry.pages == pages:
+                    return entry.answer
+        return None
+
+    def put(self, q_vec: Any, pages: Tuple[PageId, ...], answer: str) -> None:
+        if self.maxsize == 0:
+            return
+        q = self._unit(q_vec)
+        with self._lock:
+            if self._vecs is None:
+                self._vecs = np.zeros((self.maxsize, q.shape[0]), dtype=np.float32)
+            slot = self._next
+            self._next = (slot + 1) % self.maxsize
+            self._drop(slot)
+            self._vecs[slot] = q
+            self._entries[slot] = _Entry(pages, answer, time.time() + self.ttl)
+            for pid in pages:
+                self._by_tag.setdefault(page_tag(*pid), set()).add(slot)
+
+    def invalidate_page(self, story_id: str, page_num: int) -> int:
+        """Drop every answer whose context included this page; returns how many."""
+        return self.invalidate_tags([page_tag(story_id, int(page_num))])
+
+    def invalidate_tags(self, tags: Iterable[str]) -> int:
+        """Drop every answer built from a page with one of these tags; returns how many."""
+        with self._lock:
+            slots = {slot for tag in tags for slot in self._by_tag.get(tag, ())}
+            for slot in slots:
+                self._drop(slot)
+        if slots:
+            logger.info(f"Invalidated {len(slots)} cached answers")
+        return len(slots)
+
+    def _drop(self, slot: int) -> None:
+        # Caller holds the lock; a zero vector never reaches the threshold
+        entry = self._entries[slot]
+        if entry is None or self._vecs is None:
+            return
+        self._entries[slot] = None
+        self._vecs[slot] = 0.0
+        for pid in entry.pages:
+            tag = page_tag(*pid)
+            owners = self._by_tag.get(tag)
+            if owners is not None:
+                owners.discard(slot)
+                if not owners:
+                    del self._by_tag[tag]
+
+
+_cache = AnswerCache()
+
+
+def get_cache() -> AnswerCache:
+    return _cache
@@ -1,11 +1,20 @@
 import os
 import time
+import hashlib
+import threading
 import httpx
 import jwt
 import logging
+from collections import OrderedDict
+from typing import Optional, Tuple
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None  # type: ignore[assignment]
+
 # Settings
 ENV = os.getenv("ENV", "dev")
 # HS256 secret for dev and CI (fallback)
@@ -14,9 +23,71 @@ DEV_JWT_SECRET = os.getenv("DEV_JWT_SECRET", "dev-only-secret")
 JWKS_URL = os.getenv("SUPABASE_JWKS_URL", f"https://{os.getenv('SUPABASE_PROJECT')}.supabase.co/auth/v1/keys")
 # Required scopes for Gibsey API
 REQUIRED_SCOPES = {"gibsey.vault.read", "gibsey.chat", "gibsey.search"}
+# Verified-claims cache: tokens are reused for their whole life, so verify each once
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+# Upper bound on how long a verification is trusted; never past the token's exp
+AUTH_TOKEN_CACHE_TTL = int(os.getenv("AUTH_TOKEN_CACHE_TTL", "900"))
 # Logger
 logger = logging.getLogger("auth")
 
+# Hit rate = hit / (hit + miss)
+TOKEN_CACHE_COUNT = (
+    prometheus_client.Counter('auth_token_cache_total', 'Verified token cache lookups', labelnames=['result'])
+    if prometheus_client is not None else None
+)
+
+
+class VerifiedTokens:
+    """LRU of verified claims keyed by a SHA-256 of the token; each entry expires with its token."""
+
+    def __init__(self, maxsize: int = AUTH_TOKEN_CACHE_SIZE, ttl: int = AUTH_TOKEN_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # digest -> (claims, expires at); oldest first
+        self._entries: "OrderedDict[str, Tuple[dict, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: str, claims: dict) -> None:
+        # Never trusted past the token's own exp
+        expires = min(time.time() + self.ttl, float(claims["exp"]))
+        if self.maxsize <= 0 or expires <= time.time():
+            return
+        with self._lock:
+            self._entries[key] = (claims, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_verified = VerifiedTokens()
+
+
+def _count(result: str) -> None:
+    if TOKEN_CACHE_COUNT is not None:
+        TOKEN_CACHE_COUNT.labels(result=result).inc()
+
 # testing helper (HS256)
 TEST_SECRET = os.getenv("JWT_SECRET", "dev_secret")
 def _issue_dev_token():
@@ -56,6 +127,12 @@ async def verify_token(auth: HTTPAuthorizationCredentials = Depends(security)) -
         detail="Missing required scope",
     )
     now = int(time.time())
+    key = VerifiedTokens.key(token)
+    cached = _verified.get(key)
+    if cached is not None:
+        _count("hit")
+        return _check_scopes(dict(cached), forbidden_exception)
+    _count("miss")
     # Dev/CI HS256 fallback
     if ENV in ("dev", "ci"):
         try:
@@ -79,6 +156,10 @@ async def verify_token(auth: HTTPAuthorizationCredentials = Depends(security)) -
     exp = payload.get("exp")
     if not exp or exp < now - 30:
         raise credentials_exception
+    _verified.put(key, payload)
+    return _check_scopes(dict(payload), forbidden_exception)
+
+def _check_scopes(payload: dict, forbidden_exception: HTTPException) -> dict:
     # Scope enforcement
     scopes = set(payload.get("scope", "").split())
     if not REQUIRED_SCOPES.intersection(scopes):
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Backfill pages.embedding_blob from the legacy ``list<float>`` embedding column.
+
+Adds the column if needed, pages through the table and writes each
+un-migrated row's vector as packed little-endian bytes.  By default the list
+is cleared in the same write, so later scans no longer decode it.  Safe to
+re-run: rows that already have a blob are skipped.
+
+    python backfill_embeddings.py [--dtype float16] [--keep-list] [--dry-run]
+"""
+import argparse
+import os
+import sys
+
+from dotenv import load_dotenv
+from cassandra.cluster import Cluster
+from cassandra.concurrent import execute_concurrent_with_args
+from cassandra.query import SimpleStatement
+
+from db import ensure_embedding_blob, pack_embedding
+
+SCAN_CQL = "SELECT story_id, page_num, embedding, embedding_blob FROM pages"
+# Dry run on a keyspace without the blob column yet: every listed row would migrate
+LEGACY_SCAN_CQL = "SELECT story_id, page_num, embedding FROM pages"
+UPDATE_CQL = "UPDATE pages SET embedding_blob = ? WHERE story_id = ? AND page_num = ?"
+UPDATE_CLEAR_CQL = "UPDATE pages SET embedding_blob = ?, embedding = null WHERE story_id = ? AND page_num = ?"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill pages.embedding_blob")
+    parser.add_argument('--dtype', choices=['float32', 'float16'], default=os.getenv('EMBED_BLOB_DTYPE', 'float32'))
+    parser.add_argument('--keep-list', action='store_true', help='leave the list<float> column populated')
+    parser.add_argument('--fetch-size', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--dry-run', action='store_true', help='count rows to migrate; no writes')
+    args = parser.parse_args()
+
+    load_dotenv()
+    cass_host = os.getenv('CASS_HOST', 'localhost')
+    cass_keyspace = os.getenv('CASS_KEYSPACE', 'gibsey')
+    cluster = Cluster([h.strip() for h in cass_host.split(',')])
+    try:
+        session = cluster.connect(cass_keyspace)
+        if args.dry_run:
+            # No schema change and nothing prepared against a column that may not exist
+            has_blob = 'embedding_blob' in cluster.metadata.keyspaces[cass_keyspace].tables['pages'].columns
+            update = None
+        else:
+            ensure_embedding_blob(session)
+            has_blob = True
+            update = session.prepare(UPDATE_CQL if args.keep_list else UPDATE_CLEAR_CQL)
+
+        scanned = migrated = 0
+        params = []
+        scan = SCAN_CQL if has_blob else LEGACY_SCAN_CQL
+        for row in session.execute(SimpleStatement(scan, fetch_size=args.fetch_size)):
+            scanned += 1
+            if (has_blob and row.embedding_blob is not None) or row.embedding is None:
+                continue
+            params.append((pack_embedding(row.embedding, args.dtype), row.story_id, row.page_num))
+            if len(params) >= args.fetch_size:
+                migrated += write(session, update, params, args)
+                params = []
+        migrated += write(session, update, params, args)
+        verb = 'would migrate' if args.dry_run else 'migrated'
+        print(f'[backfill] scanned {scanned} pages, {verb} {migrated} ({args.dtype})')
+    finally:
+        cluster.shutdown()
+
+
+def write(session, update, params, args):
+    if args.dry_run or not params:
+        return len(params)
+    results = execute_concurrent_with_args(session, update, params, concurrency=args.concurrency, raise_on_first_error=False)
+    failed = [(p[1], p[2], r) for p, (ok, r) in zip(params, results) if not ok]
+    for story_id, page_num, err in failed:
+        print(f'[backfill] {story_id}/{page_num} failed: {err}', file=sys.stderr)
+    return len(params) - len(failed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Backfill pages.token_count / paragraph_tokens for rows loaded before they existed.
+
+Adds the columns if needed, pages through the table and stores the chat-model
+token counts of every row that has text but no counts, so its context is
+budgeted from counts rather than estimated from its length.  Safe to re-run:
+rows that already have counts are skipped unless ``--recount`` is given
+(e.g. after ``CHAT_MODEL`` moves to another tokenizer).
+
+    python backfill_token_counts.py [--recount] [--dry-run]
+"""
+import argparse
+import os
+import sys
+
+from dotenv import load_dotenv
+from cassandra.cluster import Cluster
+from cassandra.concurrent import execute_concurrent_with_args
+from cassandra.query import SimpleStatement
+
+from context import page_token_counts
+from db import ensure_token_counts
+
+SCAN_CQL = "SELECT story_id, page_num, html, token_count FROM pages"
+# Dry run on a keyspace without the columns yet: every page with text would be counted
+LEGACY_SCAN_CQL = "SELECT story_id, page_num, html FROM pages"
+UPDATE_CQL = "UPDATE pages SET token_count = ?, paragraph_tokens = ? WHERE story_id = ? AND page_num = ?"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill pages.token_count and pages.paragraph_tokens")
+    parser.add_argument('--recount', action='store_true', help='recount rows that already have counts')
+    parser.add_argument('--fetch-size', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--dry-run', action='store_true', help='count rows to backfill; no writes')
+    args = parser.parse_args()
+
+    load_dotenv()
+    cass_host = os.getenv('CASS_HOST', 'localhost')
+    cass_keyspace = os.getenv('CASS_KEYSPACE', 'gibsey')
+    cluster = Cluster([h.strip() for h in cass_host.split(',')])
+    try:
+        session = cluster.connect(cass_keyspace)
+        if args.dry_run:
+            # No schema change and nothing prepared against columns that may not exist
+            has_counts = 'token_count' in cluster.metadata.keyspaces[cass_keyspace].tables['pages'].columns
+            update = None
+        else:
+            ensure_token_counts(session)
+            has_counts = True
+            update = session.prepare(UPDATE_CQL)
+
+        scanned = counted = 0
+        params = []
+        scan = SCAN_CQL if has_counts else LEGACY_SCAN_CQL
+        for row in session.execute(SimpleStatement(scan, fetch_size=args.fetch_size)):
+            scanned += 1
+            if row.html is None or (has_counts and row.token_count is not None and not args.recount):
+                continue
+            token_count, paragraph_tokens = page_token_counts(row.html)
+            params.append((token_count, paragraph_tokens, row.story_id, row.page_num))
+            if len(params) >= args.fetch_size:
+                counted += write(session, update, params, args)
+                params = []
+        counted += write(session, update, params, args)
+        verb = 'would count' if args.dry_run else 'counted'
+        print(f'[backfill] scanned {scanned} pages, {verb} {counted}')
+    finally:
+        cluster.shutdown()
+
+
+def write(session, update, params, args):
+    if args.dry_run or not params:
+        return len(params)
+    results = execute_concurrent_with_args(session, update, params, concurrency=args.concurrency, raise_on_first_error=False)
+    failed = [(p[2], p[3], r) for p, (ok, r) in zip(params, results) if not ok]
+    for story_id, page_num, err in failed:
+        print(f'[backfill] {story_id}/{page_num} failed: {err}', file=sys.stderr)
+    return len(params) - len(failed)
+
+
+if __name__ == '__main__':
+    main()
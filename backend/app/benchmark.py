@@ -3,6 +3,8 @@ import math
 import numpy as np
 import random
 
+from vector_store import QuantizedVectorStore, VectorStore, recall_at_k
+
 # Create a mock dataset
 def generate_mock_data(num_rows=1000, dim=1536):
     data = []
@@ -48,13 +50,37 @@ def numpy_search(rows, q_vec, k=5):
     top = sorted(scored, key=lambda x: x[0], reverse=True)[:k]
     return [{"story_id": sid, "page_num": pn, "score": s} for s, sid, pn in top]
 
+# Int8 quantized store: integer dot-product scan, float32 re-rank of a shortlist
+def build_int8_store(rows):
+    ids = [(r["story_id"], r["page_num"]) for r in rows]
+    return QuantizedVectorStore(ids, np.asarray([r["embedding"] for r in rows], dtype=np.float32))
+
+def int8_search(store, q_vec, k=5):
+    return store.search(q_vec, k)
+
+# Matryoshka: shortlist on a 256-d prefix, re-rank at full dimension.
+# Uniform random vectors have no Matryoshka ordering, so this recall is a floor.
+PREFIX_DIM = 256
+
+def build_store(rows):
+    ids = [(r["story_id"], r["page_num"]) for r in rows]
+    return VectorStore(ids, np.asarray([r["embedding"] for r in rows], dtype=np.float32))
+
+def prefix_search(store, q_vec, k=5):
+    return store.search(q_vec, k, prefix_dim=PREFIX_DIM)
+
 def run_benchmark(num_rows=100, dim=1536, k=5, iterations=5):
     data = generate_mock_data(num_rows, dim)
     q_vec = generate_query_vector(dim)
     
+    int8_store = build_int8_store(data)
+    store = build_store(data)
+    
     # Warm-up
     pure_python_search(data, q_vec, k)
-    numpy_search(data, q_vec, k)
+    exact = numpy_search(data, q_vec, k)
+    int8_recall = recall_at_k(exact, int8_search(int8_store, q_vec, k))
+    prefix_recall = recall_at_k(exact, prefix_search(store, q_vec, k))
     
     # Benchmark pure Python
     start = time.time()
@@ -68,9 +94,27 @@ def run_benchmark(num_rows=100, dim=1536, k=5, iterations=5):
         numpy_search(data, q_vec, k)
     numpy_time = (time.time() - start) / iterations
     
+    # Benchmark int8
+    start = time.time()
+    for _ in range(iterations):
+        int8_search(int8_store, q_vec, k)
+    int8_time = (time.time() - start) / iterations
+    
+    # Benchmark prefix first pass
+    start = time.time()
+    for _ in range(iterations):
+        prefix_search(store, q_vec, k)
+    prefix_time = (time.time() - start) / iterations
+    
     return {
         "python_time": python_time,
         "numpy_time": numpy_time,
+        "int8_time": int8_time,
+        "int8_recall": int8_recall,
+        "int8_bytes": int8_store.nbytes,
+        "float32_bytes": num_rows * dim * 4,
+        "prefix_time": prefix_time,
+        "prefix_recall": prefix_recall,
         "speedup": python_time / numpy_time if numpy_time > 0 else float('inf')
     }
 
@@ -80,16 +124,22 @@ if __name__ == "__main__":
     print(f"Small dataset (100 rows):")
     print(f"  Pure Python: {small_result['python_time']:.6f} seconds")
     print(f"  NumPy:       {small_result['numpy_time']:.6f} seconds")
+    print(f"  Int8:        {small_result['int8_time']:.6f} seconds (recall@5 {small_result['int8_recall']:.2f}, {small_result['int8_bytes']} vs {small_result['float32_bytes']} bytes)")
+    print(f"  Prefix-{PREFIX_DIM}:  {small_result['prefix_time']:.6f} seconds (recall@5 {small_result['prefix_recall']:.2f})")
     print(f"  Speedup:     {small_result['speedup']:.2f}x\n")
     
     medium_result = run_benchmark(num_rows=1000, iterations=5)
     print(f"Medium dataset (1000 rows):")
     print(f"  Pure Python: {medium_result['python_time']:.6f} seconds")
     print(f"  NumPy:       {medium_result['numpy_time']:.6f} seconds")
+    print(f"  Int8:        {medium_result['int8_time']:.6f} seconds (recall@5 {medium_result['int8_recall']:.2f}, {medium_result['int8_bytes']} vs {medium_result['float32_bytes']} bytes)")
+    print(f"  Prefix-{PREFIX_DIM}:  {medium_result['prefix_time']:.6f} seconds (recall@5 {medium_result['prefix_recall']:.2f})")
     print(f"  Speedup:     {medium_result['speedup']:.2f}x\n")
     
     large_result = run_benchmark(num_rows=5000, iterations=2)
     print(f"Large dataset (5000 rows):")
     print(f"  Pure Python: {large_result['python_time']:.6f} seconds")
     print(f"  NumPy:       {large_result['numpy_time']:.6f} seconds")
+    print(f"  Int8:        {large_result['int8_time']:.6f} seconds (recall@5 {large_result['int8_recall']:.2f}, {large_result['int8_bytes']} vs {large_result['float32_bytes']} bytes)")
+    print(f"  Prefix-{PREFIX_DIM}:  {large_result['prefix_time']:.6f} seconds (recall@5 {large_result['prefix_recall']:.2f})")
     print(f"  Speedup:     {large_result['speedup']:.2f}x") 
\ No newline at end of file
@@ -1,22 +1,65 @@
 """
 Caching module for FastAPI server.
-Provides Redis caching with a memory fallback for development.
+Two tiers: a bounded in-process L1 (LRU by entry count and bytes, per-namespace
+limits and TTLs, swept by a background thread) in front of Redis as L2.
+Without Redis the L1 is the only tier.  L1 hits return the stored object
+itself, so callers must not mutate cached values.
+
+Request handlers use the async functions (``acache_get``, ``cache_get_many``,
+...), which talk to Redis through ``redis.asyncio`` on a shared connection
+pool and read or write many keys in one MGET / pipelined round trip.  The
+synchronous functions remain for scripts and tests.
+
+Values are stored in Redis through a codec recorded in a 3-byte header
+(``\\x00``, codec id, compression id): msgpack for structured values (JSON
+when msgpack is not installed), raw little-endian float32 for 1-D float
+arrays, and zlib over ``CACHE_COMPRESS_MIN_BYTES``.  Headerless entries are
+the JSON written before codecs existed and still decode.
+
+``cache_get_or_compute`` wraps a computation so that a miss runs it once:
+concurrent callers in the worker share one task, and other workers wait on a
+short Redis lease and pick up the result.  Entries record how long they took
+to compute, and are refreshed in the background ahead of expiry (XFetch
+probabilistic early refresh) or while served stale for up to
+``CACHE_STALE_SECONDS`` after it.
+
+Clearing a namespace bumps a generation counter embedded in its Redis keys
+instead of scanning or flushing, and entries can carry tags (e.g. the pages
+a search result ranked) so ``cache_invalidate_tags`` drops exactly those.
+Invalidations are also published on ``CACHE_INVALIDATION_CHANNEL`` so every
+worker drops its L1 copies at once rather than when they expire.
 """
 import os
 import json
+import math
 import time
-from typing import Any, Dict, Optional, Union
+import uuid
+import random
+import asyncio
+import zlib
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple, TypeGuard, Union, cast
+
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 # Try to import Redis, use in-memory cache if not available
+_REDIS_KWARGS: Dict[str, Any] = dict(
+    host=os.getenv("REDIS_HOST", "localhost"),
+    port=int(os.getenv("REDIS_PORT", "6379")),
+    db=int(os.getenv("REDIS_DB", "0")),
+    password=os.getenv("REDIS_PASSWORD", None),
+)
 try:
     import redis
-    _redis = redis.Redis(
-        host=os.getenv("REDIS_HOST", "localhost"),
-        port=int(os.getenv("REDIS_PORT", "6379")),
-        db=int(os.getenv("REDIS_DB", "0")),
-        password=os.getenv("REDIS_PASSWORD", None),
-        decode_responses=True
-    )
+    _redis = redis.Redis(**_REDIS_KWARGS, decode_responses=True)
+    # Binary-safe client for raw byte values (e.g. float32 vectors)
+    _redis_bytes = redis.Redis(**_REDIS_KWARGS)
     # Test connection
     try:
         _redis.ping()
@@ -25,10 +68,351 @@ try:
         _HAVE_REDIS = False
 except (ImportError, redis.exceptions.ConnectionError):
     _HAVE_REDIS = False
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None  # type: ignore[assignment]
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "64"))
+
+# ── Codecs ──────────────────────────────────────────────
+# JSON never starts with a NUL byte, so headerless (legacy JSON) entries are unambiguous
+_CODEC_MAGIC = b"\x00"
+CACHE_CODEC = os.getenv("CACHE_CODEC", "msgpack" if msgpack is not None else "json")
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", "1024"))
+CACHE_COMPRESS_LEVEL = int(os.getenv("CACHE_COMPRESS_LEVEL", "1"))
+
+
+class Codec(NamedTuple):
+    id: bytes
+    encode: Callable[[Any], bytes]
+    decode: Callable[[bytes], Any]
+
+
+def _plain(value: Any) -> Any:
+    # NumPy scalars/arrays that slip into structured values
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} is not serialisable")
+
+
+def _float32_decode(blob: bytes) -> np.ndarray:
+    vec = np.frombuffer(blob, dtype="<f4")
+    vec.setflags(write=False)
+    return vec
+
+
+CODECS: Dict[str, Codec] = {
+    "json": Codec(b"j", lambda v: json.dumps(v, default=_plain).encode("utf-8"), json.loads),
+    "float32": Codec(b"f", lambda v: np.ascontiguousarray(v, dtype="<f4").tobytes(), _float32_decode),
+}
+if msgpack is not None:
+    CODECS["msgpack"] = Codec(
+        b"m",
+        lambda v: msgpack.packb(v, default=_plain, use_bin_type=True),
+        lambda b: msgpack.unpackb(b, raw=False, strict_map_key=False),
+    )
+# Compression ids; "n" is stored uncompressed
+COMPRESSORS: Dict[bytes, Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {
+    b"z": (lambda b: zlib.compress(b, CACHE_COMPRESS_LEVEL), zlib.decompress),
+}
+_CODECS_BY_ID: Dict[bytes, Codec] = {}
+
+
+def register_codec(name: str, codec: Codec) -> None:
+    """Add (or replace) a codec; ids are one byte and must stay stable once written."""
+    CODECS[name] = codec
+    _CODECS_BY_ID[codec.id] = codec
+
+
+for _name, _codec in list(CODECS.items()):
+    register_codec(_name, _codec)
+
+
+def _codec_for(value: Any) -> Codec:
+    if isinstance(value, np.ndarray) and value.ndim == 1 and value.dtype.kind == "f":
+        return CODECS["float32"]
+    return CODECS.get(CACHE_CODEC, CODECS["json"])
+
+
+def encode_value(value: Any) -> bytes:
+    """Header + payload, compressed when that makes a large payload smaller."""
+    codec = _codec_for(value)
+    payload = codec.encode(value)
+    compression = b"n"
+    if len(payload) >= CACHE_COMPRESS_MIN_BYTES:
+        packed = COMPRESSORS[b"z"][0](payload)
+        if len(packed) < len(payload):
+            payload, compression = packed, b"z"
+    return _CODEC_MAGIC + codec.id + compression + payload
+
+
+def decode_value(blob: Union[bytes, str]) -> Any:
+    """Inverse of ``encode_value``; headerless entries are legacy JSON."""
+    if isinstance(blob, str) or not blob.startswith(_CODEC_MAGIC):
+        return json.loads(blob)
+    codec_id, compression, payload = blob[1:2], blob[2:3], blob[3:]
+    if compression != b"n":
+        payload = COMPRESSORS[compression][1](payload)
+    return _CODECS_BY_ID[codec_id].decode(payload)
+
+
+# ── L1: bounded in-process tier ─────────────────────────
+# Per-namespace bounds; an entry past its L1 TTL is re-read from Redis, which
+# bounds how stale a worker can be.  Without Redis the L1 is the only tier and
+# entries live for their full ``expires``.
+L1_MAX_ENTRIES = int(os.getenv("CACHE_L1_MAX_ENTRIES", "4096"))
+L1_MAX_BYTES = int(os.getenv("CACHE_L1_MAX_BYTES", str(32 * 1024 * 1024)))
+L1_TTL = int(os.getenv("CACHE_L1_TTL", "60"))
+L1_SWEEP_SECONDS = float(os.getenv("CACHE_L1_SWEEP_SECONDS", "30"))
+
+
+class L1Limits(NamedTuple):
+    max_entries: int
+    max_bytes: int
+    ttl: int
+
+
+def _parse_limits(spec: str) -> Dict[str, L1Limits]:
+    """``"page:2048:67108864:300,embed:..."`` -> per-namespace limits."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, entries, size, ttl = item.split(":")
+        limits[name] = L1Limits(int(entries), int(size), int(ttl))
+    return limits
+
+
+L1_NAMESPACE_LIMITS: Dict[str, L1Limits] = {
+    # Page rows and query vectors are hot and rarely change
+    "page": L1Limits(2048, 64 * 1024 * 1024, 300),
+    "embed": L1Limits(8192, 64 * 1024 * 1024, 3600),
+    **_parse_limits(os.getenv("CACHE_L1_LIMITS", "")),
+}
+
+
+class L1Cache:
+    """LRU per namespace, bounded by entry count and (estimated) bytes, with TTLs."""
+
+    def __init__(self, limits: Optional[Dict[str, L1Limits]] = None):
+        self.limits = limits if limits is not None else L1_NAMESPACE_LIMITS
+        self.default = L1Limits(L1_MAX_ENTRIES, L1_MAX_BYTES, L1_TTL)
+        # namespace -> key -> (value, expires_at, size, tags); oldest first
+        self._data: Dict[str, "OrderedDict[str, Tuple[Any, float, int, Tuple[str, ...]]]"] = {}
+        self._bytes: Dict[str, int] = {}
+        # tag -> (namespace, key) of the entries carrying it
+        self._tags: Dict[str, Set[Tuple[str, str]]] = {}
+        self._lock = threading.Lock()
+
+    def limits_for(self, namespace: str) -> L1Limits:
+        return self.limits.get(namespace, self.default)
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        with self._lock:
+            entries = self._data.get(namespace)
+            if not entries:
+                return None
+            item = entries.get(key)
+            if item is None:
+                return None
+            if item[1] <= time.time():
+                self._pop(namespace, key)
+                return None
+            entries.move_to_end(key)
+            return item[0]
+
+    def set(self, namespace: str, key: str, value: Any, ttl: float, size: int, tags: Iterable[str] = ()) -> None:
+        limits = self.limits_for(namespace)
+        tags = tuple(tags)
+        with self._lock:
+            # The old value goes even when the new one is too big to keep
+            self._pop(namespace, key)
+            if limits.max_entries <= 0 or size > limits.max_bytes:
+                return
+            entries = self._data.setdefault(namespace, OrderedDict())
+            entries[key] = (value, time.time() + ttl, size, tags)
+            self._bytes[namespace] = self._bytes.get(namespace, 0) + size
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add((namespace, key))
+            while len(entries) > limits.max_entries or self._bytes[namespace] > limits.max_bytes:
+                self._pop(namespace, next(iter(entries)))
+
+    def delete(self, namespace: str, key: str) -> None:
+        with self._lock:
+            self._pop(namespace, key)
+
+    def invalidate_tags(self, tags: Iterable[str]) -> int:
+        """Drop every entry carrying any of ``tags``; returns how many."""
+        removed = 0
+        with self._lock:
+            for tag in tags:
+                for namespace, key in list(self._tags.get(tag, ())):
+                    self._pop(namespace, key)
+                    removed += 1
+        return removed
+
+    def clear(self, namespace: Optional[str] = None) -> None:
+        with self._lock:
+            if namespace is None:
+                self._data.clear()
+                self._bytes.clear()
+                self._tags.clear()
+            else:
+                for key in list(self._data.get(namespace, ())):
+                    self._pop(namespace, key)
+
+    def sweep(self) -> int:
+        """Drop every expired entry; returns how many were removed."""
+        now = time.time()
+        removed = 0
+        with self._lock:
+            for namespace, entries in list(self._data.items()):
+                for key in [k for k, item in entries.items() if item[1] <= now]:
+                    self._pop(namespace, key)
+                    removed += 1
+        return removed
+
+    def size(self, namespace: str) -> Tuple[int, int]:
+        """``(entries, bytes)`` currently held for ``namespace``."""
+        with self._lock:
+            return len(self._data.get(namespace, ())), self._bytes.get(namespace, 0)
+
+    def _pop(self, namespace: str, key: str) -> None:
+        # Caller holds the lock
+        entries = self._data.get(namespace)
+        item = entries.pop(key, None) if entries else None
+        if item is not None:
+            self._bytes[namespace] -= item[2]
+            for tag in item[3]:
+                owners = self._tags.get(tag)
+                if owners is not None:
+                    owners.discard((namespace, key))
+                    if not owners:
+                        del self._tags[tag]
+
+
+_l1 = L1Cache()
+_sweeper: Optional[threading.Thread] = None
+_sweeper_stop = threading.Event()
+
+
+def _sweep_loop() -> None:
+    while not _sweeper_stop.wait(L1_SWEEP_SECONDS):
+        _l1.sweep()
+
+
+def start_sweeper() -> None:
+    """Start the background thread that evicts expired L1 entries (idempotent)."""
+    global _sweeper
+    if _sweeper is not None and _sweeper.is_alive():
+        return
+    _sweeper_stop.clear()
+    _sweeper = threading.Thread(target=_sweep_loop, name="cache-l1-sweeper", daemon=True)
+    _sweeper.start()
+
+
+def stop_sweeper() -> None:
+    global _sweeper
+    _sweeper_stop.set()
+    if _sweeper is not None:
+        _sweeper.join(timeout=1)
+    _sweeper = None
+
+
+def _l1_ttl(namespace: str, expires: int, shared: bool) -> float:
+    # With Redis behind it the L1 copy is capped so other workers' writes show up
+    return min(expires, _l1.limits_for(namespace).ttl) if shared else expires
+
 
-# In-memory cache for development/testing
-_mem_cache: Dict[str, Dict[str, Dict[str, Any]]] = {}
-_mem_expiry: Dict[str, Dict[str, float]] = {}
+# ── Namespace generations and tags ──────────────────────
+# Redis keys are "<namespace>:g<generation>:<key>"; clearing a namespace bumps
+# its generation (one INCR) and the old keys age out on their TTLs.  Workers
+# re-read a namespace's generation at most every CACHE_GEN_REFRESH_SECONDS
+# and drop their L1 copy of it when it moved.
+CACHE_GEN_REFRESH_SECONDS = float(os.getenv("CACHE_GEN_REFRESH_SECONDS", "1"))
+# Tags are sorted sets of Redis keys scored by the entry's expiry; members past
+# it are pruned on every write, so a hot tag holds only live entries.  The tag
+# key itself lives at least this long (or as long as its newest entry).
+CACHE_TAG_TTL = int(os.getenv("CACHE_TAG_TTL", str(24 * 3600)))
+_GEN_KEY = "cache:gen:{}"
+_TAG_KEY = "cache:tag:{}"
+# Every namespace that has been used, so cache_clear() can bump them all
+_NAMESPACES_KEY = "cache:namespaces"
+
+_generations: Dict[str, Tuple[int, float]] = {}
+
+
+def _known_generation(namespace: str) -> Optional[int]:
+    item = _generations.get(namespace)
+    if item is not None and time.time() - item[1] < CACHE_GEN_REFRESH_SECONDS:
+        return item[0]
+    return None
+
+
+def _note_generation(namespace: str, generation: int) -> int:
+    previous = _generations.get(namespace)
+    if previous is not None and previous[0] != generation:
+        # Cleared elsewhere: our L1 copies belong to the old generation
+        _l1.clear(namespace)
+    _generations[namespace] = (generation, time.time())
+    return generation
+
+
+def _generation(namespace: str) -> int:
+    """Current generation of ``namespace`` (synchronous client)."""
+    generation = _known_generation(namespace)
+    if generation is not None or not _HAVE_REDIS:
+        return generation or 0
+    try:
+        pipe = _redis.pipeline(transaction=False)
+        pipe.get(_GEN_KEY.format(namespace))
+        pipe.sadd(_NAMESPACES_KEY, namespace)
+        raw, _ = pipe.execute()
+    except Exception:
+        return _generations.get(namespace, (0, 0.0))[0]
+    return _note_generation(namespace, int(raw or 0))
+
+
+def _redis_key(namespace: str, key: str, generation: int) -> str:
+    return f"{namespace}:g{generation}:{key}"
+
+
+def _add_tags(pipe: Any, redis_key: str, tags: Iterable[str], expires: int) -> None:
+    now = time.time()
+    for tag in tags:
+        tag_key = _TAG_KEY.format(tag)
+        pipe.zadd(tag_key, {redis_key: now + expires})
+        pipe.zremrangebyscore(tag_key, "-inf", now)
+        pipe.expire(tag_key, max(expires, CACHE_TAG_TTL))
+
+
+def _split_redis_key(redis_key: Union[bytes, str]) -> Tuple[str, str]:
+    if isinstance(redis_key, bytes):
+        redis_key = redis_key.decode("utf-8")
+    namespace, _, key = redis_key.split(":", 2)
+    return namespace, key
+
+
+def _mem_get(namespace: str, key: str) -> Optional[Any]:
+    """Get a value from the in-process tier only."""
+    return _l1.get(namespace, key)
+
+def _mem_set(
+    namespace: str,
+    key: str,
+    value: Any,
+    expires: int = 3600,
+    size: Optional[int] = None,
+    shared: bool = False,
+    tags: Iterable[str] = (),
+) -> bool:
+    """Set a value in the in-process tier only."""
+    if size is None:
+        size = len(value) if isinstance(value, bytes) else len(encode_value(value))
+    if _sweeper is None:
+        start_sweeper()
+    _l1.set(namespace, key, value, _l1_ttl(namespace, expires, shared), size, tags)
+    return True
 
 def cache_get(namespace: str, key: str) -> Optional[Any]:
     """
@@ -41,64 +425,109 @@ def cache_get(namespace: str, key: str) -> Optional[Any]:
     Returns:
         The cached value if found, None otherwise
     """
+    generation = _generation(namespace)
+    value = _mem_get(namespace, key)
+    if value is not None:
+        return value
     if _HAVE_REDIS:
         try:
-            redis_key = f"{namespace}:{key}"
-            value = _redis.get(redis_key)
-            if value:
-                return json.loads(value)
+            redis_key = _redis_key(namespace, key, generation)
+            raw = cast(Optional[bytes], _redis_bytes.get(redis_key))
+            if raw:
+                value = decode_value(raw)
+                _mem_set(namespace, key, value, _l1.limits_for(namespace).ttl, size=len(raw), shared=True)
+                return value
         except Exception:
             # Fall back to memory cache on Redis error
             pass
-    
-    # Use memory cache
-    if namespace in _mem_cache and key in _mem_cache[namespace]:
-        # Check expiry
-        if namespace in _mem_expiry and key in _mem_expiry[namespace]:
-            if _mem_expiry[namespace][key] > time.time():
-                return _mem_cache[namespace][key]
-            # Expired
-            del _mem_cache[namespace][key]
-            del _mem_expiry[namespace][key]
-    
     return None
 
-def cache_set(namespace: str, key: str, value: Any, expires: int = 3600) -> bool:
+def cache_set(namespace: str, key: str, value: Any, expires: int = 3600, tags: Iterable[str] = ()) -> bool:
     """
     Set a value in the cache.
     
     Args:
         namespace: The namespace for the key (e.g., "search", "page")
         key: The cache key
-        value: The value to store (must be JSON serializable)
+        value: The value to store (JSON-like, or a 1-D float array)
         expires: Expiry time in seconds (default: 1 hour)
+        tags: Tags to invalidate the entry by (``cache_invalidate_tags``)
         
     Returns:
         True if successful, False otherwise
     """
+    encoded = encode_value(value)
+    tags = tuple(tags)
     if _HAVE_REDIS:
         try:
-            redis_key = f"{namespace}:{key}"
-            _redis.setex(redis_key, expires, json.dumps(value))
-            return True
+            redis_key = _redis_key(namespace, key, _generation(namespace))
+            pipe = _redis_bytes.pipeline(transaction=False)
+            pipe.setex(redis_key, expires, encoded)
+            _add_tags(pipe, redis_key, tags, expires)
+            pipe.execute()
+            return _mem_set(namespace, key, value, expires, size=len(encoded), shared=True, tags=tags)
         except Exception:
             # Fall back to memory cache on Redis error
             pass
     
     # Use memory cache
-    if namespace not in _mem_cache:
-        _mem_cache[namespace] = {}
-    if namespace not in _mem_expiry:
-        _mem_expiry[namespace] = {}
-    
-    _mem_cache[namespace][key] = value
-    _mem_expiry[namespace][key] = time.time() + expires
-    return True
+    return _mem_set(namespace, key, value, expires, size=len(encoded), tags=tags)
+
+def cache_get_bytes(namespace: str, key: str) -> Optional[bytes]:
+    """
+    Get a raw bytes value from the cache.
+
+    Args:
+        namespace: The namespace for the key (e.g., "embed")
+        key: The cache key
+
+    Returns:
+        The cached bytes if found, None otherwise
+    """
+    generation = _generation(namespace)
+    value = _mem_get(namespace, key)
+    if isinstance(value, bytes):
+        return value
+    if _HAVE_REDIS:
+        try:
+            value = cast(Optional[bytes], _redis_bytes.get(_redis_key(namespace, key, generation)))
+            if value:
+                _mem_set(namespace, key, value, _l1.limits_for(namespace).ttl, shared=True)
+                return value
+        except Exception:
+            # Fall back to memory cache on Redis error
+            pass
+    return None
+
+def cache_set_bytes(namespace: str, key: str, value: bytes, expires: int = 3600) -> bool:
+    """
+    Set a raw bytes value in the cache, stored as-is without JSON encoding.
+
+    Args:
+        namespace: The namespace for the key (e.g., "embed")
+        key: The cache key
+        value: The bytes to store
+        expires: Expiry time in seconds (default: 1 hour)
+
+    Returns:
+        True if successful, False otherwise
+    """
+    if _HAVE_REDIS:
+        try:
+            _redis_bytes.setex(_redis_key(namespace, key, _generation(namespace)), expires, value)
+            return _mem_set(namespace, key, value, expires, shared=True)
+        except Exception:
+            # Fall back to memory cache on Redis error
+            pass
+    return _mem_set(namespace, key, value, expires)
 
 def cache_clear(namespace: Optional[str] = None, key: Optional[str] = None) -> bool:
     """
     Clear cache entries.
     
+    Namespaces are cleared by bumping their generation, never by scanning
+    or flushing Redis; the superseded entries expire on their own.
+
     Args:
         namespace: If provided, only clear this namespace
         key: If provided with namespace, only clear this specific key
@@ -107,42 +536,436 @@ def cache_clear(namespace: Optional[str] = None, key: Optional[str] = None) -> b
         True if successful, False otherwise
     """
     if namespace is None:
-        # Clear all
+        # Clear every namespace this cache has written
         if _HAVE_REDIS:
             try:
-                _redis.flushdb()
+                namespaces = cast(Set[str], _redis.smembers(_NAMESPACES_KEY)) | set(_generations)
+                pipe = _redis.pipeline(transaction=False)
+                for ns in namespaces:
+                    pipe.incr(_GEN_KEY.format(ns))
+                for ns, generation in zip(namespaces, pipe.execute()):
+                    _note_generation(ns, generation)
             except Exception:
                 pass
         
-        _mem_cache.clear()
-        _mem_expiry.clear()
+        _l1.clear()
+        _publish_sync({"all": True})
         return True
     
     if key is None:
         # Clear namespace
         if _HAVE_REDIS:
             try:
-                for k in _redis.scan_iter(f"{namespace}:*"):
-                    _redis.delete(k)
+                pipe = _redis.pipeline(transaction=False)
+                pipe.incr(_GEN_KEY.format(namespace))
+                pipe.sadd(_NAMESPACES_KEY, namespace)
+                _note_generation(namespace, pipe.execute()[0])
             except Exception:
                 pass
         
-        if namespace in _mem_cache:
-            _mem_cache[namespace].clear()
-        if namespace in _mem_expiry:
-            _mem_expiry[namespace].clear()
+        _l1.clear(namespace)
+        _publish_sync({"namespace": namespace})
         return True
     
     # Clear specific key
     if _HAVE_REDIS:
         try:
-            redis_key = f"{namespace}:{key}"
+            redis_key = _redis_key(namespace, key, _generation(namespace))
             _redis.delete(redis_key)
+            _publish_sync({"keys": [redis_key]})
         except Exception:
             pass
     
-    if namespace in _mem_cache and key in _mem_cache[namespace]:
-        del _mem_cache[namespace][key]
-    if namespace in _mem_expiry and key in _mem_expiry[namespace]:
-        del _mem_expiry[namespace][key]
-    return True
\ No newline at end of file
+    _l1.delete(namespace, key)
+    return True
+
+
+# ── Async API for request handlers ──────────────────────
+_aredis: Optional[Any] = None
+_aredis_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _get_aredis() -> Any:
+    """Shared asyncio client; its pool is bound to the loop that created it."""
+    global _aredis, _aredis_loop
+    loop = asyncio.get_running_loop()
+    if _aredis is None or _aredis_loop is not loop:
+        pool = aioredis.ConnectionPool(**_REDIS_KWARGS, max_connections=REDIS_MAX_CONNECTIONS)
+        _aredis, _aredis_loop = aioredis.Redis(connection_pool=pool), loop
+    return _aredis
+
+
+def _async_redis() -> bool:
+    return _HAVE_REDIS and aioredis is not None
+
+
+async def close_async() -> None:
+    """Release the async connection pool (worker shutdown)."""
+    global _aredis, _aredis_loop
+    if _aredis is not None:
+        try:
+            await _aredis.aclose()
+        except Exception:
+            pass
+    _aredis, _aredis_loop = None, None
+
+
+async def _ageneration(namespace: str) -> int:
+    """Current generation of ``namespace`` (async client)."""
+    generation = _known_generation(namespace)
+    if generation is not None or not _async_redis():
+        return generation or 0
+    try:
+        async with _get_aredis().pipeline(transaction=False) as pipe:
+            pipe.get(_GEN_KEY.format(namespace))
+            pipe.sadd(_NAMESPACES_KEY, namespace)
+            raw, _ = await pipe.execute()
+    except Exception:
+        return _generations.get(namespace, (0, 0.0))[0]
+    return _note_generation(namespace, int(raw or 0))
+
+
+async def cache_get_many(namespace: str, keys: Iterable[str], raw: bool = False) -> Dict[str, Any]:
+    """
+    Get many values from the cache in one Redis round trip.
+
+    Args:
+        namespace: The namespace for the keys (e.g., "page", "embed")
+        keys: The cache keys
+        raw: Values are bytes stored as-is (``cache_set_bytes``) rather than JSON
+
+    Returns:
+        The cached values by key; keys that missed are left out
+    """
+    generation = await _ageneration(namespace)
+    found: Dict[str, Any] = {}
+    misses = []
+    for key in keys:
+        value = _mem_get(namespace, key)
+        if value is not None and (not raw or isinstance(value, bytes)):
+            found[key] = value
+        else:
+            misses.append(key)
+    if misses and _async_redis():
+        try:
+            blobs = await _get_aredis().mget([_redis_key(namespace, key, generation) for key in misses])
+        except Exception:
+            # Misses stay misses on Redis error
+            blobs = []
+        ttl = _l1.limits_for(namespace).ttl
+        for key, blob in zip(misses, blobs):
+            if not blob:
+                continue
+            value = blob if raw else decode_value(blob)
+            _mem_set(namespace, key, value, ttl, size=len(blob), shared=True)
+            found[key] = value
+    return found
+
+
+async def cache_set_many(
+    namespace: str,
+    items: Dict[str, Any],
+    expires: int = 3600,
+    raw: bool = False,
+    tags: Optional[Dict[str, Iterable[str]]] = None,
+) -> bool:
+    """
+    Set many values in the cache with one pipelined Redis round trip.
+
+    Args:
+        namespace: The namespace for the keys (e.g., "page", "embed")
+        items: Values by cache key (JSON-like or 1-D float arrays, or bytes when ``raw``)
+        expires: Expiry time in seconds (default: 1 hour)
+        raw: Store bytes as-is instead of JSON encoding
+        tags: Tags per cache key to invalidate entries by (``cache_invalidate_tags``)
+
+    Returns:
+        True if successful, False otherwise
+    """
+    encoded = {key: value if raw else encode_value(value) for key, value in items.items()}
+    tags = {key: tuple(tags.get(key, ())) for key in items} if tags else {}
+    shared = False
+    if encoded and _async_redis():
+        generation = await _ageneration(namespace)
+        try:
+            async with _get_aredis().pipeline(transaction=False) as pipe:
+                for key, blob in encoded.items():
+                    redis_key = _redis_key(namespace, key, generation)
+                    pipe.setex(redis_key, expires, blob)
+                    _add_tags(pipe, redis_key, tags.get(key, ()), expires)
+                await pipe.execute()
+            shared = True
+        except Exception:
+            # Fall back to memory cache on Redis error
+            pass
+    for key, value in items.items():
+        _mem_set(namespace, key, value, expires, size=len(encoded[key]), shared=shared, tags=tags.get(key, ()))
+    return True
+
+
+async def cache_invalidate_tags(tags: Iterable[str]) -> int:
+    """
+    Delete every entry stored with any of ``tags``, in any namespace.
+
+    Args:
+        tags: The tags to invalidate (e.g., "page:<story_id>:<page_num>")
+
+    Returns:
+        How many entries were dropped from Redis (or from L1 without Redis)
+    """
+    tags = list(tags)
+    removed = _l1.invalidate_tags(tags)
+    _notify_tags(tags)
+    if not tags or not _async_redis():
+        return removed
+    tag_keys = [_TAG_KEY.format(tag) for tag in tags]
+    try:
+        redis_ = _get_aredis()
+        async with redis_.pipeline(transaction=False) as pipe:
+            for tag_key in tag_keys:
+                pipe.zrange(tag_key, 0, -1)
+            members = set().union(*await pipe.execute())
+        if members:
+            await redis_.delete(*members, *tag_keys)
+        else:
+            await redis_.delete(*tag_keys)
+    except Exception:
+        return removed
+    for redis_key in members:
+        _l1.delete(*_split_redis_key(redis_key))
+    # Other workers' L1 copies read from Redis carry no tags, so name the keys too
+    await _publish({"tags": tags, "keys": [k.decode("utf-8") if isinstance(k, bytes) else k for k in members]})
+    return len(members)
+
+
+async def acache_get(namespace: str, key: str) -> Optional[Any]:
+    """Async ``cache_get``."""
+    return (await cache_get_many(namespace, [key])).get(key)
+
+
+async def acache_set(namespace: str, key: str, value: Any, expires: int = 3600, tags: Iterable[str] = ()) -> bool:
+    """Async ``cache_set``."""
+    return await cache_set_many(namespace, {key: value}, expires, tags={key: tags})
+
+
+async def acache_get_bytes(namespace: str, key: str) -> Optional[bytes]:
+    """Async ``cache_get_bytes``."""
+    return (await cache_get_many(namespace, [key], raw=True)).get(key)
+
+
+async def acache_set_bytes(namespace: str, key: str, value: bytes, expires: int = 3600) -> bool:
+    """Async ``cache_set_bytes``."""
+    return await cache_set_many(namespace, {key: value}, expires, raw=True)
+
+
+# ── Cross-worker L1 invalidation ────────────────────────
+CACHE_INVALIDATION_CHANNEL = os.getenv("CACHE_INVALIDATION_CHANNEL", "cache:invalidate")
+# Tags our own messages, which were applied locally before publishing
+_WORKER_ID = uuid.uuid4().hex
+_listener: Optional["asyncio.Task[None]"] = None
+# Other in-process caches keyed by the same tags (e.g. the chat answer cache)
+_tag_listeners: List[Callable[[List[str]], Any]] = []
+
+
+def add_tag_listener(listener: Callable[[List[str]], Any]) -> None:
+    """Call ``listener(tags)`` whenever tags are invalidated, here or in another worker."""
+    _tag_listeners.append(listener)
+
+
+def _notify_tags(tags: List[str]) -> None:
+    for listener in _tag_listeners:
+        listener(tags)
+
+
+def _message(fields: Dict[str, Any]) -> str:
+    return json.dumps({**fields, "from": _WORKER_ID})
+
+
+def _publish_sync(fields: Dict[str, Any]) -> None:
+    if _HAVE_REDIS:
+        try:
+            _redis.publish(CACHE_INVALIDATION_CHANNEL, _message(fields))
+        except Exception:
+            pass
+
+
+async def _publish(fields: Dict[str, Any]) -> None:
+    if _async_redis():
+        try:
+            await _get_aredis().publish(CACHE_INVALIDATION_CHANNEL, _message(fields))
+        except Exception:
+            pass
+
+
+def _apply_invalidation(payload: Union[bytes, str]) -> None:
+    """Drop the L1 entries named by an invalidation message from another worker."""
+    message = json.loads(payload)
+    if message.get("from") == _WORKER_ID:
+        return
+    if message.get("all"):
+        _l1.clear()
+        _generations.clear()
+    if message.get("namespace"):
+        _l1.clear(message["namespace"])
+        # Re-read the bumped generation on next use
+        _generations.pop(message["namespace"], None)
+    _l1.invalidate_tags(message.get("tags", ()))
+    _notify_tags(message.get("tags", []))
+    for redis_key in message.get("keys", ()):
+        _l1.delete(*_split_redis_key(redis_key))
+
+
+async def _listen_invalidations() -> None:
+    while True:
+        pubsub = _get_aredis().pubsub()
+        try:
+            await pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+            async for message in pubsub.listen():
+                if message.get("type") == "message":
+                    _apply_invalidation(message["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Messages may have been missed while disconnected
+            _l1.clear()
+            await asyncio.sleep(1)
+        finally:
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
+
+
+def start_invalidation_listener() -> None:
+    """Subscribe this worker's L1 to invalidations published by the others."""
+    global _listener
+    if _listener is None and _async_redis():
+        _listener = asyncio.get_running_loop().create_task(_listen_invalidations())
+
+
+async def stop_invalidation_listener() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.cancel()
+        try:
+            await _listener
+        except (asyncio.CancelledError, Exception):
+            pass
+    _listener = None
+
+
+# ── Single flight and early refresh ─────────────────────
+CACHE_LEASE_MS = int(os.getenv("CACHE_LEASE_MS", "5000"))
+CACHE_LEASE_POLL_MS = 25
+# XFetch beta: above 1 refreshes earlier, 0 disables early refresh
+CACHE_EARLY_REFRESH_BETA = float(os.getenv("CACHE_EARLY_REFRESH_BETA", "1.0"))
+# Past its expiry an entry is still served (and refreshed) for this long
+CACHE_STALE_SECONDS = int(os.getenv("CACHE_STALE_SECONDS", "60"))
+# Deletes the lease only if we still hold it
+_RELEASE_LUA = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+_flights: Dict[Tuple[str, str], "asyncio.Task[Any]"] = {}
+_flights_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _envelope(entry: Any) -> TypeGuard[Dict[str, Any]]:
+    # Entries written by cache_get_or_compute: {"v": value, "d": compute seconds, "x": expires at}
+    return isinstance(entry, dict) and entry.keys() == {"v", "d", "x"}
+
+
+def _should_refresh(entry: Dict[str, Any], beta: float) -> bool:
+    """XFetch: refresh with probability rising as expiry nears, sooner for slow computations."""
+    now = time.time()
+    if now >= entry["x"]:
+        return True
+    return beta > 0 and now - entry["d"] * beta * math.log(1.0 - random.random()) >= entry["x"]
+
+
+TagsFor = Optional[Callable[[Any], Iterable[str]]]
+
+
+async def _compute_and_store(namespace: str, key: str, compute: Callable[[], Awaitable[Any]], expires: int, tags: TagsFor) -> Any:
+    start = time.time()
+    value = await compute()
+    entry = {"v": value, "d": time.time() - start, "x": time.time() + expires}
+    await acache_set(namespace, key, entry, expires + CACHE_STALE_SECONDS, tags=tags(value) if tags else ())
+    return value
+
+
+async def _compute_with_lease(namespace: str, key: str, compute: Callable[[], Awaitable[Any]], expires: int, tags: TagsFor) -> Any:
+    """Compute under a cross-worker lease; without it, wait for the holder's result."""
+    if not _async_redis():
+        return await _compute_and_store(namespace, key, compute, expires, tags)
+    lease_key, token = f"lease:{namespace}:{key}", uuid.uuid4().hex
+    try:
+        leased = bool(await _get_aredis().set(lease_key, token, nx=True, px=CACHE_LEASE_MS))
+    except Exception:
+        # No lease service; compute locally
+        leased = None
+    if leased is False:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + CACHE_LEASE_MS / 1000.0
+        while loop.time() < deadline:
+            await asyncio.sleep(CACHE_LEASE_POLL_MS / 1000.0)
+            entry = await acache_get(namespace, key)
+            if _envelope(entry):
+                return entry["v"]
+        # The holder died or is slow: compute anyway
+    try:
+        return await _compute_and_store(namespace, key, compute, expires, tags)
+    finally:
+        if leased:
+            try:
+                await _get_aredis().eval(_RELEASE_LUA, 1, lease_key, token)
+            except Exception:
+                pass
+
+
+def _flight(namespace: str, key: str, compute: Callable[[], Awaitable[Any]], expires: int, tags: TagsFor) -> "asyncio.Task[Any]":
+    """The worker's one in-flight computation for ``key``, started if needed."""
+    global _flights, _flights_loop
+    loop = asyncio.get_running_loop()
+    if _flights_loop is not loop:
+        # Tasks of a loop that is gone (e.g. between test clients)
+        _flights, _flights_loop = {}, loop
+    flight_key = (namespace, key)
+    task = _flights.get(flight_key)
+    if task is None:
+        # A task of its own, so a cancelled caller does not cancel the other waiters
+        task = loop.create_task(_compute_with_lease(namespace, key, compute, expires, tags))
+        flights = _flights
+        flights[flight_key] = task
+        task.add_done_callback(lambda t: flights.pop(flight_key, None))
+        # Background refreshes may have no awaiter; retrieve their error here
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    return task
+
+
+async def cache_get_or_compute(
+    namespace: str,
+    key: str,
+    compute: Callable[[], Awaitable[Any]],
+    expires: int = 3600,
+    beta: float = CACHE_EARLY_REFRESH_BETA,
+    tags: TagsFor = None,
+) -> Tuple[Any, bool]:
+    """
+    Cached value for ``key``, computing it on a miss with stampede protection.
+
+    Args:
+        namespace: The namespace for the key (e.g., "retrieval")
+        key: The cache key
+        compute: Coroutine function producing the value (cacheable by ``cache_set``)
+        expires: Freshness in seconds; entries are served stale a little longer
+        beta: XFetch early-refresh aggressiveness (0 disables it)
+        tags: Maps a computed value to the tags it is stored with
+
+    Returns:
+        ``(value, cached)``; ``cached`` is False when this call waited on a computation
+    """
+    entry = await acache_get(namespace, key)
+    if _envelope(entry):
+        if _should_refresh(entry, beta) and (namespace, key) not in _flights:
+            _flight(namespace, key, compute, expires, tags)
+        return entry["v"], True
+    return await asyncio.shield(_flight(namespace, key, compute, expires, tags)), False
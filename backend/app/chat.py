@@ -0,0 +1,162 @@
+"""
+Chat completions for ``/chat`` and ``/chat/stream``.
+Completions go through the openai client's async ``acreate`` (aiohttp), so a
+streaming answer never holds the event loop.  Streamed deltas are coalesced
+into frames of at most ``STREAM_COALESCE_MS`` milliseconds or
+``STREAM_COALESCE_CHARS`` characters, and each frame is one JSON-encoded SSE
+``data:`` line.  Closing the frame generator (client disconnect) closes the
+upstream completion stream, which stops generation.
+"""
+import os
+import json
+import asyncio
+import logging
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Dict, List, Optional
+
+import numpy as np
+
+try:
+    import openai
+except ImportError:
+    openai = None  # type: ignore[assignment]
+
+from context import CHAT_MODEL
+
+STREAM_COALESCE_MS = float(os.getenv("STREAM_COALESCE_MS", "50"))
+STREAM_COALESCE_CHARS = int(os.getenv("STREAM_COALESCE_CHARS", "64"))
+SYSTEM_PROMPT = "You are a helpful assistant."
+
+logger = logging.getLogger("chat")
+
+
+def messages_for(prompt: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+
+async def complete(prompt: str) -> str:
+    """Whole answer for ``prompt`` without blocking the loop."""
+    resp = await openai.ChatCompletion.acreate(model=CHAT_MODEL, messages=messages_for(prompt))
+    content: str = resp.choices[0].message.content
+    return content
+
+
+async def stream_completion(prompt: str) -> AsyncGenerator[str, None]:
+    """Answer text deltas as they arrive; closing this generator ends the completion."""
+    response = await openai.ChatCompletion.acreate(model=CHAT_MODEL, messages=messages_for(prompt), stream=True)
+    try:
+        async for chunk in response:
+            if not chunk.choices:
+                continue
+            content = getattr(chunk.choices[0].delta, "content", None)
+            if content:
+                yield content
+    finally:
+        # Drops the upstream HTTP stream when we stop early (client went away)
+        aclose = getattr(response, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+async def coalesce(
+    deltas: AsyncIterator[str],
+    window_ms: float = STREAM_COALESCE_MS,
+    max_chars: int = STREAM_COALESCE_CHARS,
+) -> AsyncGenerator[str, None]:
+    """
+    Join ``deltas`` into larger pieces: a piece is emitted once ``max_chars``
+    are buffered or ``window_ms`` has passed since its first delta.
+    """
+    loop = asyncio.get_running_loop()
+    buffer: List[str] = []
+    size = 0
+    deadline: Optional[float] = None
+    pending: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(deltas.__anext__())
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            # asyncio.wait leaves ``pending`` running on timeout, so no delta is lost
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if done:
+                try:
+                    delta = pending.result()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    pending = None
+                if deadline is None:
+                    # First delta of a piece opens its window
+                    deadline = loop.time() + window_ms / 1000.0
+                buffer.append(delta)
+                size += len(delta)
+                if size < max_chars and loop.time() < deadline:
+                    continue
+            yield "".join(buffer)
+            buffer, size, deadline = [], 0, None
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if pending is not None:
+            # The generator is still running its __anext__; it must stop before aclose()
+            pending.cancel()
+            try:
+                await pending
+            except (asyncio.CancelledError, StopAsyncIteration):
+                pass
+        aclose = getattr(deltas, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} is not JSON serialisable")
+
+
+def sse(event: str, data: Any) -> str:
+    """One SSE frame carrying ``{"event": ..., "data": ...}`` as JSON."""
+    payload = json.dumps({"event": event, "data": data}, default=_json_default, separators=(",", ":"))
+    return f"data: {payload}\n\n"
+
+
+async def replay(answer: str, size: int = STREAM_COALESCE_CHARS) -> AsyncGenerator[str, None]:
+    """A cached answer as stream pieces, so clients see the same frames as a live one."""
+    for start in range(0, len(answer), size):
+        yield answer[start:start + size]
+
+
+async def stream_answer(
+    prompt: str,
+    sources: List[Dict[str, Any]],
+    request: Any = None,
+    answer: Optional[str] = None,
+    on_complete: Optional[Callable[[str], None]] = None,
+) -> AsyncGenerator[str, None]:
+    """
+    SSE frames: ``sources``, coalesced ``token`` pieces, then ``complete``.
+    A given ``answer`` is replayed instead of calling the model;
+    ``on_complete`` gets the full text of a generation that ran to the end.
+    """
+    yield sse("sources", sources)
+    collected: List[str] = []
+    pieces = replay(answer) if answer is not None else coalesce(stream_completion(prompt))
+    try:
+        async for piece in pieces:
+            if request is not None and await request.is_disconnected():
+                logger.info("Client disconnected; cancelling completion")
+                return
+            collected.append(piece)
+            yield sse("token", piece)
+    finally:
+        await pieces.aclose()
+    full = "".join(collected)
+    if on_complete is not None and answer is None:
+        on_complete(full)
+    yield sse("complete", full)
@@ -0,0 +1,133 @@
+"""Token-budgeted chat context.
+
+Token counts are computed once, when a page is written (``scripts/seed.py``,
+``embed_load.py``), and stored with it: ``pages.token_count`` for the whole
+page and ``pages.paragraph_tokens`` for its blank-line separated paragraphs.
+``pack_context`` then fills the prompt greedily, best page first, until
+``CHAT_CONTEXT_TOKENS`` is spent, using only those stored counts.  A page
+written before the counts existed is costed at ``CHARS_PER_TOKEN`` instead.
+
+With ``CHAT_CONTEXT_TRIM`` a page that no longer fits whole is cut down to
+its paragraphs with the most query terms that still fit, in page order.
+"""
+import logging
+import math
+import os
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import tiktoken
+except ImportError:  # counts fall back to the character estimate
+    tiktoken = None
+
+try:
+    from lexical import tokenize
+except ImportError:  # imported as backend.app.context by scripts/seed.py
+    from .lexical import tokenize
+
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4o")
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "3000"))
+CHAT_CONTEXT_TRIM = os.getenv("CHAT_CONTEXT_TRIM", "false").lower() == "true"
+# Rough cost of text without a stored count (English prose averages ~4)
+CHARS_PER_TOKEN = 4
+# Per-page framing ("Page n: " and the joining newline)
+PAGE_OVERHEAD_TOKENS = 6
+
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+
+logger = logging.getLogger("context")
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.encoding_for_model(CHAT_MODEL)
+        except KeyError:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+    return _encoding
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    return math.ceil(len(text or "") / CHARS_PER_TOKEN)
+
+
+def count_tokens(text: Optional[str]) -> int:
+    """Tokens in ``text`` for ``CHAT_MODEL``; an estimate when tiktoken is missing."""
+    encoding = _get_encoding()
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text or "", disallowed_special=()))
+
+
+def split_paragraphs(text: Optional[str]) -> List[str]:
+    return [p.strip() for p in _PARAGRAPH_RE.split(text or "") if p.strip()]
+
+
+def page_token_counts(text: Optional[str]) -> Tuple[int, List[int]]:
+    """``(token_count, paragraph_tokens)`` as stored with a page at ingest."""
+    return count_tokens(text), [count_tokens(p) for p in split_paragraphs(text)]
+
+
+def _trim(query_terms: set, text: str, paragraph_tokens: Sequence[int], budget: int) -> Optional[Tuple[str, int]]:
+    paragraphs = split_paragraphs(text)
+    if len(paragraphs) != len(paragraph_tokens):
+        # Page changed since its counts were stored
+        return None
+    # Most query terms first, then earlier paragraphs
+    order = sorted(
+        range(len(paragraphs)),
+        key=lambda i: (-len(query_terms.intersection(tokenize(paragraphs[i]))), i),
+    )
+    keep, used = [], 0
+    for i in order:
+        if used + paragraph_tokens[i] <= budget:
+            keep.append(i)
+            used += paragraph_tokens[i]
+    if not keep:
+        return None
+    return "\n\n".join(paragraphs[i] for i in sorted(keep)), used
+
+
+def pack_context(
+    q: str,
+    pages: Sequence[Dict[str, Any]],
+    budget: int = CHAT_CONTEXT_TOKENS,
+    trim: bool = CHAT_CONTEXT_TRIM,
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Pages (best first) that fit in ``budget`` tokens, with the text to send.
+
+    Returns copies of the packed pages with ``html`` replaced by the text
+    actually used (whole, or trimmed to paragraphs) and the tokens spent.
+    Pages that do not fit are skipped, so a smaller later page can still go in.
+    """
+    query_terms = set(tokenize(q))
+    packed, used = [], 0
+    for page in pages:
+        text = page.get("html")
+        if not text:
+            continue
+        tokens = page.get("tokens")
+        if tokens is None:
+            tokens = estimate_tokens(text)
+        room = budget - used - PAGE_OVERHEAD_TOKENS
+        if tokens <= room:
+            packed.append(dict(page))
+            used += tokens + PAGE_OVERHEAD_TOKENS
+            continue
+        if trim and page.get("paragraph_tokens") and room > 0:
+            trimmed = _trim(query_terms, text, page["paragraph_tokens"], room)
+            if trimmed is not None:
+                packed.append({**page, "html": trimmed[0], "tokens": trimmed[1], "trimmed": True})
+                used += trimmed[1] + PAGE_OVERHEAD_TOKENS
+    logger.debug(f"Packed {len(packed)}/{len(pages)} pages into {used}/{budget} tokens")
+    return packed, used
+
+
+def build_prompt(q: str, pages: Sequence[Dict[str, Any]]) -> str:
+    docs = "\n".join(f"Page {p['page_num']}: {p['html']}" for p in pages)
+    return f"Answer question: {q}\n\nContext:\n{docs}"
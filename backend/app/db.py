@@ -0,0 +1,206 @@
+"""
+Cassandra access for the FastAPI server.
+Holds one process-wide Cluster/Session and a registry of prepared statements,
+so handlers never reconnect or re-prepare CQL per request, plus an asyncio
+bridge over the driver's ``execute_async`` so queries never block the loop.
+
+Page embeddings are stored packed in ``pages.embedding_blob`` (little-endian
+float32, or float16 after a one-byte marker with ``EMBED_BLOB_DTYPE=float16``)
+rather than as a
+``list<float>`` whose 1536 elements each carry a length prefix and decode one
+by one.  The session's row factory turns the blob straight into a NumPy array
+and exposes it as ``row.embedding``; rows not yet backfilled keep their list.
+Pages written with text also carry their chat-model token counts
+(``token_count``, ``paragraph_tokens``) so prompts are budgeted without
+tokenizing at request time.
+"""
+import os
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Sequence, cast
+
+import numpy as np
+
+try:
+    from cassandra.cluster import Cluster
+    from cassandra.query import named_tuple_factory
+except ImportError:
+    Cluster = None
+    named_tuple_factory = None
+
+logger = logging.getLogger("db")
+
+# Every CQL statement the API runs, prepared once per session by name
+STATEMENTS: Dict[str, str] = {
+    "page_by_id": "SELECT * FROM pages WHERE story_id = ? AND page_num = ?",
+    # Hydrates only the top-k pages of a ranking, one round trip per story
+    "pages_by_story": "SELECT * FROM pages WHERE story_id = ? AND page_num IN ?",
+    "story_by_id": "SELECT * FROM stories WHERE story_id = ?",
+    "bot_by_id": "SELECT * FROM bots WHERE bot_id = ?",
+    "vault_by_user": "SELECT * FROM vault WHERE user_id = ?",
+    "insert_page": "INSERT INTO pages (story_id, page_num, embedding_blob) VALUES (?, ?, ?)",
+    "insert_story": "INSERT INTO stories (story_id) VALUES (?)",
+    "insert_bot": "INSERT INTO bots (bot_id) VALUES (?)",
+    "insert_vault": "INSERT INTO vault (user_id, ts) VALUES (?, ?)",
+}
+
+EMBED_DIM = 1536
+EMBED_BLOB_DTYPE = os.getenv("EMBED_BLOB_DTYPE", "float32")
+_BLOB_DTYPES = {"float32": "<f4", "float16": "<f2"}
+# float16 blobs start with this byte; their odd length never matches a float32 blob
+_FLOAT16_MARK = b"h"
+
+
+def pack_embedding(vec: Any, dtype: str = EMBED_BLOB_DTYPE) -> bytes:
+    """Pack a vector as the little-endian bytes stored in ``embedding_blob``."""
+    data = np.asarray(vec, dtype=_BLOB_DTYPES[dtype]).tobytes()
+    return _FLOAT16_MARK + data if dtype == "float16" else data
+
+
+def unpack_embedding(blob: bytes) -> np.ndarray:
+    """Decode an ``embedding_blob`` into float32, whatever its dimension."""
+    if len(blob) % 2 and blob[:1] == _FLOAT16_MARK:
+        return np.frombuffer(blob, dtype="<f2", offset=1).astype(np.float32)
+    return np.frombuffer(blob, dtype="<f4")
+
+
+def page_row_factory(colnames: List[str], rows: List[Sequence[Any]]) -> List[Any]:
+    """
+    Named-tuple rows where a selected ``embedding_blob`` is decoded with
+    ``frombuffer`` and takes the place of ``embedding``.
+    """
+    if "embedding_blob" not in colnames:
+        return cast(List[Any], named_tuple_factory(colnames, rows))
+    blob_at = colnames.index("embedding_blob")
+    list_at = colnames.index("embedding") if "embedding" in colnames else None
+    names = [c for i, c in enumerate(colnames) if i != blob_at]
+    if list_at is None:
+        names.insert(blob_at, "embedding")
+    out = []
+    for row in rows:
+        row = list(row)
+        blob = row.pop(blob_at)
+        if list_at is None:
+            row.insert(blob_at, unpack_embedding(blob) if blob is not None else None)
+        elif blob is not None:
+            row[list_at if list_at < blob_at else list_at - 1] = unpack_embedding(blob)
+        out.append(row)
+    return cast(List[Any], named_tuple_factory(names, out))
+
+
+def _add_column(session: Any, column: str, cql_type: str) -> bool:
+    try:
+        session.execute(f"ALTER TABLE pages ADD {column} {cql_type}")
+    except Exception as e:
+        # Cassandra rejects re-adding an existing column; anything else is real
+        if "conflicts with an existing column" in str(e) or "already exists" in str(e):
+            return False
+        raise
+    logger.info(f"Added pages.{column} column")
+    return True
+
+
+def ensure_embedding_blob(session: Any) -> bool:
+    """Add ``pages.embedding_blob`` if missing; True when it was created."""
+    return _add_column(session, "embedding_blob", "blob")
+
+
+def ensure_token_counts(session: Any) -> bool:
+    """Add ``pages.token_count``/``paragraph_tokens`` if missing; True when created."""
+    created = _add_column(session, "token_count", "int")
+    return _add_column(session, "paragraph_tokens", "list<int>") or created
+
+
+_cluster: Optional[Any] = None
+_session: Optional[Any] = None
+_prepared: Dict[str, Any] = {}
+_lock = threading.Lock()
+
+
+def get_cassandra_session():
+    """Return the shared session, connecting on first use."""
+    global _cluster, _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                if Cluster is None:
+                    raise RuntimeError("cassandra-driver not installed")
+                cass_host = os.getenv("CASS_HOST", "localhost")
+                cass_keyspace = os.getenv("CASS_KEYSPACE", "gibsey")
+                _cluster = Cluster([h.strip() for h in cass_host.split(",")])
+                _session = _cluster.connect(cass_keyspace)
+                _session.row_factory = page_row_factory
+    return _session
+
+
+def prepared(name: str, session: Any = None):
+    """Look up a prepared statement by name, preparing it on first use."""
+    stmt = _prepared.get(name)
+    if stmt is None:
+        session = session if session is not None else get_cassandra_session()
+        stmt = session.prepare(STATEMENTS[name])
+        _prepared[name] = stmt
+    return stmt
+
+
+def prepare_all(session: Any = None) -> None:
+    """Prepare the whole registry up front (called from the app lifespan)."""
+    for name in STATEMENTS:
+        prepared(name, session)
+
+
+def shutdown() -> None:
+    """Close the shared session and cluster and forget prepared statements."""
+    global _cluster, _session
+    with _lock:
+        _prepared.clear()
+        if _session is not None:
+            try:
+                _session.shutdown()
+            except Exception:
+                pass
+        if _cluster is not None:
+            try:
+                _cluster.shutdown()
+            except Exception:
+                pass
+        _cluster = None
+        _session = None
+
+
+def _resolve(fut: "asyncio.Future", result: Any = None, exc: Optional[BaseException] = None) -> None:
+    # The awaiting request may have been cancelled while the driver was working
+    if fut.done():
+        return
+    if exc is not None:
+        fut.set_exception(exc)
+    else:
+        fut.set_result(result)
+
+
+async def execute_async(session: Any, query: Any, params: Optional[Sequence[Any]] = None) -> List[Any]:
+    """
+    Run ``query`` without blocking the event loop and return all rows.
+
+    The driver calls back on its own I/O thread; results are handed to the
+    loop with ``call_soon_threadsafe``.  Paged results are fetched page by
+    page until exhausted.
+    """
+    loop = asyncio.get_running_loop()
+    done: "asyncio.Future[List[Any]]" = loop.create_future()
+    rows: List[Any] = []
+    response_future = session.execute_async(query, params)
+
+    def on_page(page):
+        rows.extend(page)
+        if response_future.has_more_pages:
+            response_future.start_fetching_next_page()
+        else:
+            loop.call_soon_threadsafe(_resolve, done, rows)
+
+    def on_error(exc):
+        loop.call_soon_threadsafe(_resolve, done, None, exc)
+
+    response_future.add_callbacks(on_page, on_error)
+    return await done
@@ -13,6 +13,9 @@ import openai
 from cassandra.cluster import Cluster
 from cassandra.query import BatchStatement, ConsistencyLevel
 
+from context import page_token_counts
+from db import ensure_embedding_blob, ensure_token_counts, pack_embedding
+
 # Regex to split pages: captures page number, allow optional whitespace
 PAGE_SPLIT_REGEX = re.compile(r"###Page\s*(\d+)###")
 STORY_ID = 'an_author_preface'
@@ -67,15 +70,20 @@ def main():
     try:
         session = cluster.connect()
         session.set_keyspace(cass_keyspace)
+        ensure_embedding_blob(session)
+        ensure_token_counts(session)
         insert_stmt = session.prepare(
-            'INSERT INTO pages (story_id, page_num, html, embedding) VALUES (?, ?, ?, ?)'
+            'INSERT INTO pages (story_id, page_num, html, embedding_blob, token_count, paragraph_tokens) VALUES (?, ?, ?, ?, ?, ?)'
         )
 
+        import ann_hnsw
+
         # Process in batches of 25
         batch_size = 25
         for start in range(0, total, batch_size):
             chunk = pages[start:start + batch_size]
             batch = BatchStatement(consistency_level=ConsistencyLevel.LOCAL_QUORUM)
+            indexed = []
             for page_num, content in chunk:
                 # Generate embedding
                 resp = openai.Embedding.create(
@@ -84,17 +92,17 @@ def main():
                 )
                 # Extract embedding from legacy response
                 embedding = resp['data'][0]['embedding']
-                batch.add(insert_stmt, (STORY_ID, page_num, content, embedding))
-                # Add to HNSW index
-                import ann_hnsw
-                int_id = ann_hnsw.pack_id(STORY_ID, page_num)
-                ann_hnsw.add(embedding, int_id)
+                # Token counts are stored so chat never tokenizes at request time
+                token_count, paragraph_tokens = page_token_counts(content)
+                batch.add(insert_stmt, (STORY_ID, page_num, content, pack_embedding(embedding), token_count, paragraph_tokens))
+                indexed.append((STORY_ID, page_num, embedding))
             session.execute(batch)
+            # Add the chunk to the HNSW index in one logged batch
+            ann_hnsw.ingest(indexed)
             print(f'Inserted batch {start+1}-{start+len(chunk)} of {total} pages')
 
-        import ann_hnsw
-        ann_hnsw.save()
-        print(f'Done: inserted {total} pages + hnsw index saved')
+        version = ann_hnsw.publish()
+        print(f'Done: inserted {total} pages + hnsw index published as {version}')
     finally:
         if session:
             try:
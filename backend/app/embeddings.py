@@ -0,0 +1,177 @@
+"""
+Query embeddings for the search and chat endpoints.
+Vectors are cached by normalised query text and model as raw float32 bytes in
+the ``embed`` namespace of ``cache.py`` (its in-process L1, then Redis).  Cache
+misses that arrive within a few milliseconds of each other are coalesced into
+one batched embedding request.
+"""
+import os
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+import numpy as np
+
+try:
+    import openai
+except ImportError:
+    openai = None  # type: ignore[assignment]
+
+from cache import acache_set_bytes, cache_clear, cache_get_many
+
+EMBED_MODEL = "text-embedding-3-small"
+EMBED_CACHE_TTL = int(os.getenv("EMBED_CACHE_TTL", str(7 * 24 * 3600)))
+EMBED_MAX_ATTEMPTS = 3
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "5"))
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "64"))
+
+
+def normalise_query(text: str) -> str:
+    """Collapse whitespace and case so trivially different queries share a vector."""
+    return " ".join(text.split()).lower()
+
+
+class EmbeddingCache:
+    """
+    Query vectors as raw float32 in the shared ``embed`` cache namespace: the
+    bounded in-process L1 of ``cache.py`` first, then Redis.
+    """
+
+    namespace = "embed"
+
+    def __init__(self, ttl: int = EMBED_CACHE_TTL):
+        self.ttl = ttl
+
+    @staticmethod
+    def key(text: str, model: str = EMBED_MODEL) -> str:
+        digest = hashlib.sha256(normalise_query(text).encode("utf-8")).hexdigest()
+        return f"{model}:{digest}"
+
+    async def aget_many(self, texts: List[str], model: str = EMBED_MODEL) -> Dict[str, np.ndarray]:
+        """Cached vectors by text, in one multi-get."""
+        keys = {text: self.key(text, model) for text in texts}
+        found = await cache_get_many(self.namespace, list(dict.fromkeys(keys.values())), raw=True)
+        # frombuffer over bytes is a read-only view, so cached vectors cannot be mutated
+        return {text: np.frombuffer(found[key], dtype="<f4") for text, key in keys.items() if key in found}
+
+    async def aput(self, text: str, model: str, vec) -> np.ndarray:
+        raw = np.ascontiguousarray(vec, dtype="<f4").tobytes()
+        await acache_set_bytes(self.namespace, self.key(text, model), raw, self.ttl)
+        return np.frombuffer(raw, dtype="<f4")
+
+    def clear(self) -> None:
+        cache_clear(self.namespace)
+
+
+embedding_cache = EmbeddingCache()
+
+
+async def _embed_remote(texts: List[str], model: str) -> List[List[float]]:
+    """One batched embedding request with exponential backoff on rate limits."""
+    if openai is None:
+        raise RuntimeError("openai package not installed")
+    delay = 1
+    attempt = 0
+    while True:
+        try:
+            resp = await asyncio.to_thread(openai.Embedding.create, model=model, input=texts)
+            data = sorted(resp["data"], key=lambda d: d.get("index", 0))
+            return [d["embedding"] for d in data]
+        except openai.error.RateLimitError:
+            attempt += 1
+            if attempt >= EMBED_MAX_ATTEMPTS:
+                raise
+            await asyncio.sleep(delay)
+            delay *= 2
+
+
+class EmbeddingBatcher:
+    """
+    Collect single-query embeddings for up to ``window_ms`` (or ``max_batch``
+    distinct texts) and send them as one request, as ``scripts/seed.py``
+    does for ingestion, then fan the vectors back out to every waiter.
+    """
+
+    def __init__(
+        self,
+        embed_batch: Callable[[List[str], str], Awaitable[List[Any]]] = _embed_remote,
+        window_ms: float = EMBED_BATCH_WINDOW_MS,
+        max_batch: int = EMBED_BATCH_MAX,
+    ):
+        self.embed_batch = embed_batch
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending: Dict[str, Dict[str, List[asyncio.Future]]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def embed(self, text: str, model: str = EMBED_MODEL):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Pending work belongs to a loop that is gone (e.g. between test clients)
+            self._loop = loop
+            self._pending, self._timers, self._tasks = {}, {}, set()
+        fut = loop.create_future()
+        batch = self._pending.setdefault(model, {})
+        batch.setdefault(text, []).append(fut)
+        if len(batch) >= self.max_batch:
+            self._flush(model)
+        elif model not in self._timers:
+            self._timers[model] = loop.call_later(self.window, self._flush, model)
+        return await fut
+
+    def _flush(self, model: str) -> None:
+        timer = self._timers.pop(model, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(model, None)
+        if not batch:
+            return
+        task = asyncio.get_running_loop().create_task(self._run(model, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, model: str, batch: Dict[str, List[asyncio.Future]]) -> None:
+        texts = list(batch)
+        try:
+            vectors = await self.embed_batch(texts, model)
+            if len(vectors) != len(texts):
+                raise RuntimeError(f"expected {len(texts)} embeddings, got {len(vectors)}")
+        except asyncio.CancelledError:
+            for waiters in batch.values():
+                for fut in waiters:
+                    fut.cancel()
+            raise
+        except Exception as e:
+            for waiters in batch.values():
+                for fut in waiters:
+                    if not fut.done():
+                        fut.set_exception(e)
+            return
+        for text, vec in zip(texts, vectors):
+            for fut in batch[text]:
+                if not fut.done():
+                    fut.set_result(vec)
+
+
+embedding_batcher = EmbeddingBatcher()
+
+
+async def embed_query(text: str, model: str = EMBED_MODEL) -> np.ndarray:
+    """Return the (read-only, float32) embedding for ``text``, cached."""
+    vec = (await embedding_cache.aget_many([text], model)).get(text)
+    if vec is not None:
+        return vec
+    # Embed the normalised text so every variant sharing a key gets the same vector
+    return await embedding_cache.aput(text, model, await embedding_batcher.embed(normalise_query(text), model))
+
+
+async def embed_queries(texts: List[str], model: str = EMBED_MODEL) -> List[np.ndarray]:
+    """Embed many queries at once: one cache round trip, and the misses share batched requests."""
+    cached = await embedding_cache.aget_many(list(texts), model)
+    missing = [t for t in dict.fromkeys(texts) if t not in cached]
+    if missing:
+        fresh = await asyncio.gather(*(embed_query(t, model) for t in missing))
+        cached.update(zip(missing, fresh))
+    return [cached[t] for t in texts]
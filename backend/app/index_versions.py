@@ -0,0 +1,74 @@
+"""On-disk layout for versioned ANN index artifacts.
+
+Each build is published as ``<root>/<version>/`` holding ``hnsw.idx``, its
+label table sidecars and a ``corpus.manifest.json``.  ``<root>/CURRENT``
+names the live version and is replaced atomically, so readers always see
+either the old or the new version, never a partial one.
+"""
+import json
+import os
+import tempfile
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+INDEX_FILE = "hnsw.idx"
+MANIFEST_FILE = "corpus.manifest.json"
+CURRENT_FILE = "CURRENT"
+
+
+def new_version() -> str:
+    """Sortable, unique-enough version name for a fresh build."""
+    return datetime.utcnow().strftime("%Y%m%dT%H%M%S%fZ")
+
+
+def version_dir(root: str, version: str) -> str:
+    return os.path.join(str(root), version)
+
+
+def index_path(root: str, version: str) -> str:
+    return os.path.join(version_dir(root, version), INDEX_FILE)
+
+
+def read_current(root: str) -> Optional[str]:
+    """Name of the live version, or None if nothing has been published."""
+    try:
+        with open(os.path.join(str(root), CURRENT_FILE), "r", encoding="utf-8") as fh:
+            version = fh.read().strip()
+    except FileNotFoundError:
+        return None
+    return version or None
+
+
+def write_current(root: str, version: str) -> None:
+    """Point ``CURRENT`` at ``version`` with an atomic rename."""
+    path = os.path.join(str(root), CURRENT_FILE)
+    # A temp file per writer, so concurrent publishers never share one
+    fd, tmp = tempfile.mkstemp(prefix=f"{CURRENT_FILE}.", suffix=".tmp", dir=str(root))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            fh.write(version)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def read_manifest(root: str, version: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(version_dir(root, version), MANIFEST_FILE), "r", encoding="utf-8") as fh:
+            manifest: Dict[str, Any] = json.load(fh)
+            return manifest
+    except FileNotFoundError:
+        return {}
+
+
+def write_manifest(root: str, version: str, **fields: Any) -> Dict[str, Any]:
+    manifest = {
+        "version": version,
+        "index": INDEX_FILE,
+        "generated": datetime.utcnow().isoformat() + "Z",
+        **fields,
+    }
+    with open(os.path.join(version_dir(root, version), MANIFEST_FILE), "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, indent=2)
+    return manifest
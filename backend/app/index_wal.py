@@ -0,0 +1,100 @@
+"""Append-only write-ahead log of page vectors for the live ANN index.
+
+Each record is ``<HiI`` (story id length, page number, dimension) followed by
+the UTF-8 story id and the little-endian float32 vector.  Every worker appends
+under an exclusive ``flock`` and tails the file from its own offset, so pages
+written through any worker reach every worker's index, and a restart replays
+the log on top of the last published version instead of rebuilding.
+"""
+import os
+import struct
+import threading
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows dev boxes: single-process only
+    fcntl = None  # type: ignore[assignment]
+
+HEADER = struct.Struct("<HiI")
+
+Record = Tuple[str, int, np.ndarray]
+
+
+def encode(records: Sequence[Record]) -> bytes:
+    out = bytearray()
+    for story_id, page_num, vec in records:
+        story = story_id.encode("utf-8")
+        data = np.ascontiguousarray(vec, dtype="<f4")
+        out += HEADER.pack(len(story), page_num, data.shape[0])
+        out += story
+        out += data.tobytes()
+    return bytes(out)
+
+
+def decode(buf: bytes) -> Tuple[List[Record], int]:
+    """Decode complete records; return them and the number of bytes consumed."""
+    records: List[Record] = []
+    pos = 0
+    while pos + HEADER.size <= len(buf):
+        story_len, page_num, dim = HEADER.unpack_from(buf, pos)
+        end = pos + HEADER.size + story_len + 4 * dim
+        if end > len(buf):
+            break  # a writer is mid-append; pick the rest up next time
+        story = buf[pos + HEADER.size: pos + HEADER.size + story_len].decode("utf-8")
+        vec = np.frombuffer(buf, dtype="<f4", count=dim, offset=pos + HEADER.size + story_len)
+        records.append((story, page_num, vec))
+        pos = end
+    return records, pos
+
+
+class WriteAheadLog:
+    """One log file plus this process's read offset into it."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offset = 0
+        self.records = 0
+        self._lock = threading.Lock()
+
+    def _read_new(self, fh) -> List[Record]:
+        fh.seek(self.offset)
+        records, used = decode(fh.read())
+        self.offset += used
+        self.records += len(records)
+        return records
+
+    def read_new(self) -> List[Record]:
+        """Records appended (by any process) since this process last looked."""
+        with self._lock:
+            if not os.path.exists(self.path):
+                return []
+            with open(self.path, "rb") as fh:
+                return self._read_new(fh)
+
+    def append(self, records: Sequence[Record]) -> List[Record]:
+        """
+        Durably append ``records``.
+
+        Returns records other processes appended since our last read, which
+        the caller must apply too; our own records are not re-read later.
+        """
+        payload = encode(records)
+        with self._lock:
+            with open(self.path, "a+b") as fh:
+                if fcntl is not None:
+                    fcntl.flock(fh, fcntl.LOCK_EX)
+                try:
+                    others = self._read_new(fh)
+                    fh.seek(0, os.SEEK_END)
+                    fh.write(payload)
+                    fh.flush()
+                    os.fsync(fh.fileno())
+                    self.offset = fh.tell()
+                    self.records += len(records)
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(fh, fcntl.LOCK_UN)
+        return others
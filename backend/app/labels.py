@@ -0,0 +1,145 @@
+"""Persistent label table for the HNSW index.
+
+Label ``i`` in the index is row ``i`` of an int32 ``(N, 2)`` array holding
+``(story_index, page_num)``; the few distinct story ids live in a JSON list
+beside it.  Labels are assigned densely in insertion order, so they are the
+same in every process, and the array is memory-mapped on load so resolving a
+hit is an O(1) lookup with no Python dicts rebuilt at startup.
+"""
+import json
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+UNKNOWN = ("unknown", 0)
+
+
+def label_paths(index_path: str) -> Tuple[str, str]:
+    """Return the ``(rows, stories)`` sidecar paths for an index file."""
+    base, _ = os.path.splitext(str(index_path))
+    return f"{base}.labels.npy", f"{base}.stories.json"
+
+
+class LabelTable:
+    """Dense label -> ``(story_id, page_num)`` table."""
+
+    def __init__(self, stories: Optional[List[str]] = None, rows: Optional[np.ndarray] = None):
+        self.stories: List[str] = list(stories or [])
+        self._rows = rows if rows is not None else np.empty((0, 2), dtype=np.int32)
+        self._size = len(self._rows)
+        # Forward maps are only needed when assigning labels (ingest), built lazily
+        self._story_index: Optional[Dict[str, int]] = None
+        self._labels: Optional[Dict[Tuple[int, int], int]] = None
+        # Per-story label bitmaps for filtered search, dropped whenever labels are added
+        self._story_masks: Dict[int, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return self._size
+
+    @classmethod
+    def for_pages(cls, pages: Sequence[Tuple[str, int]]) -> "LabelTable":
+        """Build a table whose label ``i`` is ``pages[i]``."""
+        table = cls()
+        for story_id, page_num in pages:
+            table.label_for(story_id, page_num)
+        return table
+
+    @classmethod
+    def load(cls, index_path: str, mmap: bool = True) -> "LabelTable":
+        rows_path, stories_path = label_paths(index_path)
+        with open(stories_path, "r", encoding="utf-8") as fh:
+            stories = json.load(fh)
+        rows = np.load(rows_path, mmap_mode="r" if mmap else None)
+        return cls(stories, rows)
+
+    @classmethod
+    def load_or_empty(cls, index_path: str) -> "LabelTable":
+        rows_path, stories_path = label_paths(index_path)
+        if os.path.exists(rows_path) and os.path.exists(stories_path):
+            return cls.load(index_path)
+        return cls()
+
+    def save(self, index_path: str) -> None:
+        rows_path, stories_path = label_paths(index_path)
+        # Write to temp files and rename so readers never see a half-written table
+        tmp_rows = f"{rows_path}.tmp"
+        with open(tmp_rows, "wb") as fh:
+            np.save(fh, np.ascontiguousarray(self._rows[: self._size], dtype=np.int32))
+        os.replace(tmp_rows, rows_path)
+        tmp_stories = f"{stories_path}.tmp"
+        with open(tmp_stories, "w", encoding="utf-8") as fh:
+            json.dump(self.stories, fh)
+        os.replace(tmp_stories, stories_path)
+
+    def rows(self) -> np.ndarray:
+        """The ``(N, 2)`` int32 ``(story_index, page_num)`` array, one row per label."""
+        return self._rows[: self._size]
+
+    def lookup(self, label: int) -> Tuple[str, int]:
+        """Resolve one label; unknown labels map to ``("unknown", 0)``."""
+        if not 0 <= label < self._size:
+            return UNKNOWN
+        story_idx, page_num = self._rows[label]
+        return self.stories[int(story_idx)], int(page_num)
+
+    def lookup_many(self, labels: Sequence[int]) -> List[Tuple[str, int]]:
+        return [self.lookup(int(label)) for label in labels]
+
+    def mask(self, story_id: Optional[str] = None, page_from: Optional[int] = None, page_to: Optional[int] = None) -> np.ndarray:
+        """Boolean array over labels selecting pages of ``story_id`` within ``[page_from, page_to]``."""
+        rows = self._rows[: self._size]
+        if story_id is None:
+            mask = np.ones(self._size, dtype=bool)
+        else:
+            try:
+                story_idx = self.stories.index(story_id)
+            except ValueError:
+                return np.zeros(self._size, dtype=bool)
+            bitmap = self._story_masks.get(story_idx)
+            if bitmap is None:
+                bitmap = self._story_masks[story_idx] = np.asarray(rows[:, 0] == story_idx)
+            mask = bitmap.copy()
+        if page_from is not None:
+            mask &= rows[:, 1] >= page_from
+        if page_to is not None:
+            mask &= rows[:, 1] <= page_to
+        return mask
+
+    def get(self, story_id: str, page_num: int) -> Optional[int]:
+        """Existing label for a page, or None."""
+        story_index, labels = self._forward()
+        story_idx = story_index.get(story_id)
+        if story_idx is None:
+            return None
+        return labels.get((story_idx, page_num))
+
+    def label_for(self, story_id: str, page_num: int) -> int:
+        """Existing label for a page, assigning the next free one if new."""
+        story_index, labels = self._forward()
+        story_idx = story_index.get(story_id)
+        if story_idx is None:
+            story_idx = story_index[story_id] = len(self.stories)
+            self.stories.append(story_id)
+        label = labels.get((story_idx, page_num))
+        if label is None:
+            self._append(story_idx, page_num)
+            label = labels[(story_idx, page_num)] = self._size - 1
+        return label
+
+    def _forward(self) -> Tuple[Dict[str, int], Dict[Tuple[int, int], int]]:
+        if self._story_index is None or self._labels is None:
+            self._story_index = {s: i for i, s in enumerate(self.stories)}
+            rows = np.asarray(self._rows[: self._size]).tolist()
+            self._labels = {(s, p): i for i, (s, p) in enumerate(rows)}
+        return self._story_index, self._labels
+
+    def _append(self, story_idx: int, page_num: int) -> None:
+        if self._size == len(self._rows) or not self._rows.flags.writeable:
+            # Grow geometrically (and leave any read-only memory map behind)
+            grown = np.empty((max(16, 2 * self._size), 2), dtype=np.int32)
+            grown[: self._size] = self._rows[: self._size]
+            self._rows = grown
+        self._rows[self._size] = (story_idx, page_num)
+        self._size += 1
+        self._story_masks.clear()
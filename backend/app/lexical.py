@@ -0,0 +1,218 @@
+"""In-process BM25 inverted index over page text.
+
+Postings are stored term-major in CSR form: ``offsets[t]:offsets[t+1]``
+slices ``doc_ids``/``tfs`` for term ``t``.  Document ``i`` is label ``i`` of
+a ``LabelTable`` (so story/page filters reuse its masks), and the whole index
+is one ``.npz`` of arrays plus a JSON vocabulary, written by
+``scripts/seed.py``.
+
+``fuse`` merges ranked lists by reciprocal rank fusion for hybrid search.
+"""
+import json
+import logging
+import os
+import re
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    from labels import LabelTable
+except ImportError:  # imported as backend.app.lexical by scripts/seed.py
+    from .labels import LabelTable
+
+LEXICAL_PATH = os.getenv("LEXICAL_PATH", "/data/bm25.npz")
+BM25_K1 = 1.2
+BM25_B = 0.75
+# RRF constant from Cormack et al.; larger values flatten the rank curve
+RRF_K = 60
+# Each side of a hybrid query contributes this many times k candidates
+HYBRID_DEPTH = int(os.getenv("HYBRID_DEPTH", "4"))
+PAGE_TEXT_CQL = "SELECT story_id, page_num, html FROM pages"
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_TOKEN_RE = re.compile(r"[^\W_]+(?:'[^\W_]+)*")
+
+logger = logging.getLogger("lexical")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens with markup stripped; apostrophes stay inside words."""
+    return _TOKEN_RE.findall(_TAG_RE.sub(" ", text or "").lower())
+
+
+def vocab_path(path: str) -> str:
+    base, _ = os.path.splitext(str(path))
+    return f"{base}.vocab.json"
+
+
+class BM25Index:
+    """Term-major postings with per-document lengths and page labels."""
+
+    def __init__(
+        self,
+        vocab: Dict[str, int],
+        offsets: np.ndarray,
+        doc_ids: np.ndarray,
+        tfs: np.ndarray,
+        doc_len: np.ndarray,
+        labels: LabelTable,
+    ):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.labels = labels
+        n = len(doc_len)
+        self.avgdl = float(doc_len.mean()) if n else 0.0
+        df = np.diff(offsets).astype(np.float32)
+        self.idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+    def __len__(self) -> int:
+        return len(self.doc_len)
+
+    @classmethod
+    def build(cls, pages: Iterable[Tuple[str, int, str]]) -> "BM25Index":
+        """Index ``(story_id, page_num, text)`` triples; document i is the i-th page."""
+        labels = LabelTable()
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        lengths: List[int] = []
+        for story_id, page_num, text in pages:
+            doc = labels.label_for(story_id, page_num)
+            terms = tokenize(text)
+            if doc < len(lengths):
+                raise ValueError(f"duplicate page {story_id}/{page_num}")
+            lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                postings.setdefault(term, []).append((doc, tf))
+        vocab = {term: i for i, term in enumerate(sorted(postings))}
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        for term, i in vocab.items():
+            offsets[i + 1] = len(postings[term])
+        np.cumsum(offsets, out=offsets)
+        doc_ids = np.empty(offsets[-1], dtype=np.int32)
+        tfs = np.empty(offsets[-1], dtype=np.int32)
+        for term, i in vocab.items():
+            plist = postings[term]
+            doc_ids[offsets[i]:offsets[i + 1]] = [d for d, _ in plist]
+            tfs[offsets[i]:offsets[i + 1]] = [tf for _, tf in plist]
+        return cls(vocab, offsets, doc_ids, tfs, np.asarray(lengths, dtype=np.int32), labels)
+
+    @classmethod
+    def load(cls, path: str = LEXICAL_PATH) -> "BM25Index":
+        with np.load(path) as arrays:
+            fields = {name: arrays[name] for name in ("offsets", "doc_ids", "tfs", "doc_len", "pages")}
+        with open(vocab_path(path), "r", encoding="utf-8") as fh:
+            meta = json.load(fh)
+        vocab = {term: i for i, term in enumerate(meta["terms"])}
+        labels = LabelTable(meta["stories"], fields.pop("pages"))
+        return cls(vocab, labels=labels, **fields)
+
+    def save(self, path: str = LEXICAL_PATH) -> None:
+        # Temp file + rename, so a running API never loads a half-written index
+        tmp = f"{path}.tmp.npz"
+        np.savez(
+            tmp,
+            offsets=self.offsets,
+            doc_ids=self.doc_ids,
+            tfs=self.tfs,
+            doc_len=self.doc_len,
+            pages=np.asarray(self.labels.rows(), dtype=np.int32),
+        )
+        os.replace(tmp, path)
+        terms = sorted(self.vocab, key=self.vocab.__getitem__)
+        tmp_vocab = f"{vocab_path(path)}.tmp"
+        with open(tmp_vocab, "w", encoding="utf-8") as fh:
+            json.dump({"terms": terms, "stories": self.labels.stories}, fh)
+        os.replace(tmp_vocab, vocab_path(path))
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every document for ``query`` (repeated terms count once)."""
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term in set(tokenize(query)):
+            t = self.vocab.get(term)
+            if t is None:
+                continue
+            lo, hi = self.offsets[t], self.offsets[t + 1]
+            docs, tf = self.doc_ids[lo:hi], self.tfs[lo:hi].astype(np.float32)
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len[docs] / self.avgdl)
+            scores[docs] += self.idf[t] * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores
+
+    def search(
+        self,
+        query: str,
+        k: int,
+        story_id: Optional[str] = None,
+        page_from: Optional[int] = None,
+        page_to: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """Top-k pages by BM25, highest first; pages matching no term are never returned."""
+        scores = self.scores(query)
+        if story_id is not None or page_from is not None or page_to is not None:
+            scores[~self.labels.mask(story_id, page_from, page_to)] = 0.0
+        hits = np.flatnonzero(scores > 0)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return [
+            {"story_id": sid, "page_num": pn, "score": float(scores[doc])}
+            for doc, (sid, pn) in zip(hits.tolist(), self.labels.lookup_many(hits.tolist()))
+        ]
+
+
+def fuse(rankings: Sequence[Sequence[Dict[str, Any]]], k: int, rrf_k: int = RRF_K) -> List[Dict[str, Any]]:
+    """Reciprocal rank fusion: each page scores ``sum(1 / (rrf_k + rank))`` over the lists."""
+    fused: Dict[Tuple[str, int], float] = {}
+    for ranking in rankings:
+        for rank, hit in enumerate(ranking, start=1):
+            key = (hit["story_id"], hit["page_num"])
+            fused[key] = fused.get(key, 0.0) + 1.0 / (rrf_k + rank)
+    top = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+    return [{"story_id": sid, "page_num": pn, "score": score} for (sid, pn), score in top]
+
+
+# ── Process-wide index ──────────────────────────────────
+_index: Optional[BM25Index] = None
+_index_lock = threading.Lock()
+
+
+def load_index(session_factory: Optional[Callable[[], Any]] = None) -> BM25Index:
+    """Load the seeded index, or build one from Cassandra page text."""
+    if os.path.exists(LEXICAL_PATH) and os.path.exists(vocab_path(LEXICAL_PATH)):
+        index = BM25Index.load(LEXICAL_PATH)
+        logger.info(f"Loaded BM25 index over {len(index)} pages from {LEXICAL_PATH}")
+        return index
+    if session_factory is not None:
+        try:
+            rows = session_factory().execute(PAGE_TEXT_CQL)
+            index = BM25Index.build((r.story_id, r.page_num, r.html or "") for r in rows)
+            logger.info(f"Built BM25 index over {len(index)} pages from Cassandra")
+            return index
+        except Exception as e:
+            logger.warning(f"BM25 build from Cassandra failed: {e}")
+    logger.warning("No page text available; lexical search will return no results")
+    return BM25Index.build([])
+
+
+def get_index(session_factory: Optional[Callable[[], Any]] = None) -> BM25Index:
+    """Return the resident index, loading it on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = load_index(session_factory)
+    return _index
+
+
+def is_loaded() -> bool:
+    return _index is not None
+
+
+def reset_index() -> None:
+    global _index
+    with _index_lock:
+        _index = None
@@ -1,5 +1,7 @@
 import os
+import asyncio
 import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Depends, Request, Query
 
 # Optional dependencies: dotenv, cassandra, numpy, openai
@@ -10,14 +12,9 @@ except ImportError:
     def load_dotenv():
         return None
 try:
-    from cassandra.cluster import Cluster
-except ImportError:
-    Cluster = None
-try:
-    import heapq, numpy as np
+    import numpy as np
 except ImportError:
-    # fallback stubs if numpy not installed; minimal stubs for import only
-    heapq = None
+    # fallback stub if numpy not installed; minimal stub for import only
     np = None
 try:
     from cassandra import util as cass_util  # provides Vector in driver ≥ 3.29
@@ -40,14 +37,22 @@ except ImportError:
     openai.error = types.SimpleNamespace(RateLimitError=Exception)
     # allow setting api_key attribute
     openai.api_key = None
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Dict, Any, Optional, Union
 from datetime import datetime
-import math
 import time
 # HTTP responses and auth
 from fastapi.responses import StreamingResponse
-from cache import cache_get, cache_set
+import cache
+from cache import acache_get, acache_set
+import vector_store
+import lexical
+from embeddings import embed_query
+from context import build_prompt, pack_context
+from chat import complete, stream_answer
+from answer_cache import get_cache as get_answer_cache, page_ids
+from retrieval import PAGE_TTL, public_hits, retrieve, retrieve_many, page_cache_key, page_record, page_tag, write_through_page
+from db import EMBED_DIM, get_cassandra_session, prepared, prepare_all, execute_async, pack_embedding, shutdown as db_shutdown
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import jwt
 import httpx
@@ -100,6 +105,10 @@ except ImportError:
 SEARCH_LATENCY = Summary('search_request_latency_seconds', 'Latency of /search')
 # Counter to track total hits by engine label
 SEARCH_COUNT = Counter('search_request_total', 'Total /search requests', labelnames=['engine'])
+# Semantic answer cache outcomes for /chat and /chat/stream
+ANSWER_CACHE_COUNT = Counter('chat_answer_cache_total', 'Chat answer cache lookups', labelnames=['result'])
+# Page writes (in any worker) invalidate answers built from the page
+cache.add_tag_listener(get_answer_cache().invalidate_tags)
 
 load_dotenv()
 if hasattr(openai, 'api_key'):
@@ -116,13 +125,45 @@ def _rate_limit_key(request):
         token_prefix = token[:40]
     return f"{ip}:{token_prefix}"
 limiter = Limiter(key_func=_rate_limit_key)
-app = FastAPI()
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
 # Initialize logger for API
 logger = logging.getLogger("api")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One Cassandra session and prepared statements for the life of the worker
+    try:
+        prepare_all(get_cassandra_session())
+    except Exception as e:
+        logger.warning(f"Cassandra unavailable at startup: {e}")
+    # Load page vectors once so the first search does not pay for the scan
+    search_enabled = os.getenv("SEARCH_ENABLED", "false").lower() == "true"
+    if search_enabled:
+        await asyncio.to_thread(vector_store.get_store, get_cassandra_session)
+        await asyncio.to_thread(lexical.get_index, get_cassandra_session)
+        # Pick up index versions published by scripts/seed.py without a restart
+        try:
+            import ann_hnsw
+            ann_hnsw.start_watcher()
+        except ImportError as e:
+            logger.warning(f"HNSW unavailable: {e}")
+    # Drop L1 entries that other workers invalidate
+    cache.start_invalidation_listener()
+    yield
+    await cache.stop_invalidation_listener()
+    if search_enabled:
+        try:
+            import ann_hnsw
+            ann_hnsw.stop_watcher()
+        except ImportError:
+            pass
+    await cache.close_async()
+    db_shutdown()
+
+app = FastAPI(lifespan=lifespan)
+app.state.limiter = limiter
+app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     # Log entry and exit of each route
@@ -137,6 +178,20 @@ async def log_requests(request: Request, call_next):
         pass
     return response
 
+async def embed_or_429(text: str):
+    """Cached query embedding; rate limits that survive the retries become a 429."""
+    try:
+        return await embed_query(text)
+    except openai.error.RateLimitError:
+        raise HTTPException(status_code=429, detail="Rate limit exceeded")
+
+async def retrieve_or_429(q: str, k: int, **options):
+    """Shared retrieval pipeline; rate limits that survive the retries become a 429."""
+    try:
+        return await retrieve(q, k, **options)
+    except openai.error.RateLimitError:
+        raise HTTPException(status_code=429, detail="Rate limit exceeded")
+
 @app.get("/health")
 async def health():
     return {"status": "ok"}
@@ -150,11 +205,7 @@ async def search_native_test(q: str = Query("door"), k: int = Query(5)):
     start_time = time.time()
     
     # Generate embedding
-    resp = openai.Embedding.create(
-        model="text-embedding-3-small",
-        input=q
-    )
-    q_vec = resp["data"][0]["embedding"]
+    q_vec = await embed_or_429(q)
     
     # Using Native ANN with HNSW
     import numpy as np
@@ -162,11 +213,8 @@ async def search_native_test(q: str = Query("door"), k: int = Query(5)):
     q_np = np.asarray(q_vec, dtype=np.float32)
     
     try:
-        hits = ann_hnsw.query(q_np, k)
-        results = []
-        for int_id, dist in hits:
-            story_id, page_num = ann_hnsw.unpack_id(int_id)
-            results.append({"story_id": story_id, "page_num": page_num, "score": 1 - dist})
+        hits = await asyncio.to_thread(ann_hnsw.search, q_np, k)
+        results = [{"story_id": sid, "page_num": pn, "score": 1 - dist} for sid, pn, dist in hits]
     except Exception as e:
         # Fallback: return error information if HNSW index not available
         return {
@@ -177,38 +225,30 @@ async def search_native_test(q: str = Query("door"), k: int = Query(5)):
     latency = time.time() - start_time
     return {"query": q, "results": results, "latency_seconds": latency}
 
-def get_cassandra_session():
-    cass_host = os.getenv("CASS_HOST", "localhost")
-    cass_keyspace = os.getenv("CASS_KEYSPACE", "gibsey")
-    cluster = Cluster([cass_host])
-    return cluster.connect(cass_keyspace)
-
 @app.get("/pages/{story_id}/{page_num}", dependencies=[Depends(verify_token)])
 async def read_page(story_id: str, page_num: int):
     # Attempt to fetch from cache
-    cache_key = f"{story_id}:{page_num}"
-    if (c := cache_get("page", cache_key)):
+    cache_key = page_cache_key(story_id, page_num)
+    if (c := await acache_get("page", cache_key)):
         return {**c, "cached": True}
     # Fetch from database
     session = get_cassandra_session()
-    query = "SELECT * FROM pages WHERE story_id = ? AND page_num = ?"
-    prepared = session.prepare(query)
-    result = session.execute(prepared, (story_id, page_num))
-    row = result.one()
+    stmt = prepared("page_by_id", session)
+    rows = await execute_async(session, stmt, (story_id, page_num))
+    row = rows[0] if rows else None
     if not row:
         raise HTTPException(status_code=404, detail="Page not found")
-    row_dict = dict(row._asdict())
+    row_dict = page_record(row)
     # Store in cache
-    cache_set("page", cache_key, row_dict)
+    await acache_set("page", cache_key, row_dict, PAGE_TTL, tags=[page_tag(story_id, page_num)])
     return row_dict
 
 @app.get("/stories/{story_id}")
 async def read_story(story_id: str):
     session = get_cassandra_session()
-    query = "SELECT * FROM stories WHERE story_id = ?"
-    prepared = session.prepare(query)
-    result = session.execute(prepared, (story_id,))
-    row = result.one()
+    stmt = prepared("story_by_id", session)
+    rows = await execute_async(session, stmt, (story_id,))
+    row = rows[0] if rows else None
     if not row:
         raise HTTPException(status_code=404, detail="Story not found")
     return dict(row._asdict())
@@ -216,10 +256,9 @@ async def read_story(story_id: str):
 @app.get("/bots/{bot_id}")
 async def read_bot(bot_id: str):
     session = get_cassandra_session()
-    query = "SELECT * FROM bots WHERE bot_id = ?"
-    prepared = session.prepare(query)
-    result = session.execute(prepared, (bot_id,))
-    row = result.one()
+    stmt = prepared("bot_by_id", session)
+    rows = await execute_async(session, stmt, (bot_id,))
+    row = rows[0] if rows else None
     if not row:
         raise HTTPException(status_code=404, detail="Bot not found")
     return dict(row._asdict())
@@ -227,22 +266,51 @@ async def read_bot(bot_id: str):
 @app.get("/vault/{user_id}")
 async def read_vault(user_id: str):
     session = get_cassandra_session()
-    query = "SELECT * FROM vault WHERE user_id = ?"
-    prepared = session.prepare(query)
-    results = session.execute(prepared, (user_id,))
-    return [dict(row._asdict()) for row in results]
+    stmt = prepared("vault_by_user", session)
+    rows = await execute_async(session, stmt, (user_id,))
+    return [dict(row._asdict()) for row in rows]
+
+@app.post("/admin/reload-index", dependencies=[Depends(verify_token)])
+async def reload_index(version: Optional[str] = Query(None)):
+    """Load an HNSW index version (default: the published CURRENT) and swap it in."""
+    import ann_hnsw
+    previous = ann_hnsw.current_version()
+    try:
+        handle = await asyncio.to_thread(ann_hnsw.reload, version)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Index reload failed: {e}")
+    # A new corpus version may change any page an answer was built from
+    get_answer_cache().clear()
+    return {"status": "reloaded", "version": handle.version, "previous": previous}
 
 class PageIn(BaseModel):
     story_id: str
     page_num: int
-    embedding: List[float]
+    # Every page vector has the index's dimension
+    embedding: List[float] = Field(..., min_length=EMBED_DIM, max_length=EMBED_DIM)
+
+async def index_pages(records):
+    """Feed written pages to the live HNSW index (write-ahead logged) and apply them now."""
+    try:
+        import ann_hnsw
+        await asyncio.to_thread(ann_hnsw.ingest, records)
+        # Not left for the next tick: rankings cached after this must see the page
+        await asyncio.to_thread(ann_hnsw.flush)
+    except Exception as e:
+        # The row is already in Cassandra; the next rebuild will pick it up
+        logger.warning(f"HNSW ingest failed: {e}")
 
 @app.post("/pages")
 async def create_page(page: PageIn):
     session = get_cassandra_session()
-    query = "INSERT INTO pages (story_id, page_num, embedding) VALUES (?, ?, ?)"
-    prepared = session.prepare(query)
-    session.execute(prepared, (page.story_id, page.page_num, page.embedding))
+    stmt = prepared("insert_page", session)
+    await execute_async(session, stmt, (page.story_id, page.page_num, pack_embedding(page.embedding)))
+    vector_store.upsert_if_loaded(page.story_id, page.page_num, page.embedding)
+    # Indexes first, so no ranking cached after the invalidation misses the page
+    await index_pages([(page.story_id, page.page_num, page.embedding)])
+    # The insert sets only the embedding, so cache the row as stored; the tag
+    # invalidation also drops cached chat answers built from the page, in every worker
+    await write_through_page(page.story_id, page.page_num)
     return {"status": "created", "resource": "page", "id": {"story_id": page.story_id, "page_num": page.page_num}}
 
 class StoryIn(BaseModel):
@@ -251,9 +319,8 @@ class StoryIn(BaseModel):
 @app.post("/stories")
 async def create_story(item: StoryIn):
     session = get_cassandra_session()
-    query = "INSERT INTO stories (story_id) VALUES (?)"
-    prepared = session.prepare(query)
-    session.execute(prepared, (item.story_id,))
+    stmt = prepared("insert_story", session)
+    await execute_async(session, stmt, (item.story_id,))
     return {"status": "created", "resource": "story", "story_id": item.story_id}
 
 class BotIn(BaseModel):
@@ -262,9 +329,8 @@ class BotIn(BaseModel):
 @app.post("/bots")
 async def create_bot(item: BotIn):
     session = get_cassandra_session()
-    query = "INSERT INTO bots (bot_id) VALUES (?)"
-    prepared = session.prepare(query)
-    session.execute(prepared, (item.bot_id,))
+    stmt = prepared("insert_bot", session)
+    await execute_async(session, stmt, (item.bot_id,))
     return {"status": "created", "resource": "bot", "bot_id": item.bot_id}
 
 class VaultIn(BaseModel):
@@ -274,9 +340,8 @@ class VaultIn(BaseModel):
 @app.post("/vault")
 async def create_vault(entry: VaultIn):
     session = get_cassandra_session()
-    query = "INSERT INTO vault (user_id, ts) VALUES (?, ?)"
-    prepared = session.prepare(query)
-    session.execute(prepared, (entry.user_id, entry.ts))
+    stmt = prepared("insert_vault", session)
+    await execute_async(session, stmt, (entry.user_id, entry.ts))
     return {"status": "created", "resource": "vault", "user_id": entry.user_id, "ts": entry.ts.isoformat()}
 
 class SearchRequest(BaseModel):
@@ -286,40 +351,13 @@ class SearchRequest(BaseModel):
 @app.post("/search", dependencies=[Depends(verify_token)])
 @limiter.limit("5/minute")
 async def search(req: SearchRequest, request: Request):
-    # Check for cache hit
-    cache_key = f"{req.q.lower()}:{req.k}"
-    if (c := cache_get("search", cache_key)):
-        return {"query": req.q, "results": c, "cached": True}
     if os.getenv("SEARCH_ENABLED", "false").lower() != "true":
         raise HTTPException(status_code=404, detail="Search disabled")
-    # Generate query embedding with retry/backoff
-    max_attempts = 3
-    delay = 1
-    for attempt in range(max_attempts):
-        try:
-            resp = openai.Embedding.create(model='text-embedding-3-small', input=req.q)
-            break
-        except openai.error.RateLimitError:
-            if attempt == max_attempts - 1:
-                raise HTTPException(status_code=429, detail="Rate limit exceeded")
-            time.sleep(delay)
-            delay *= 2
-    q_vec = resp['data'][0]['embedding']
-    # Fetch all pages
-    session = get_cassandra_session()
-    rows = session.execute("SELECT page_num, html, embedding FROM pages")
-    norm_q = math.sqrt(sum(x*x for x in q_vec))
-    results: list[dict] = []
-    for r in rows:
-        vec = r.embedding
-        dot = sum(a*b for a, b in zip(q_vec, vec))
-        norm_r = math.sqrt(sum(x*x for x in vec))
-        score = (dot/(norm_q*norm_r)) if norm_q and norm_r else 0.0
-        results.append({"page_num": r.page_num, "html": r.html, "score": score})
-    results.sort(key=lambda x: x["score"], reverse=True)
-    # Cache results
-    cache_set("search", cache_key, results)
-    return {"query": req.q, "results": results}
+    # Ranking is cached by the pipeline; html comes from the page cache
+    retrieved = await retrieve_or_429(req.q, req.k, with_html=True)
+    if retrieved.cached:
+        return {"query": req.q, "results": public_hits(retrieved.hits), "cached": True}
+    return {"query": req.q, "results": public_hits(retrieved.hits)}
 
 @app.get("/search", dependencies=[Depends(verify_token)])
 @limiter.limit("5/minute")
@@ -329,57 +367,77 @@ async def search_pages(
     k: int = Query(5, ge=1),
     engine: str = Query("native"),
     ef: int = Query(64, ge=1),      # HNSW search parameter
-    M: int = Query(8, ge=1)         # HNSW construction parameter (placeholder)
+    M: int = Query(8, ge=1),        # HNSW construction parameter (placeholder)
+    story_id: Optional[str] = Query(None, max_length=128),
+    page_from: Optional[int] = Query(None, ge=1),
+    page_to: Optional[int] = Query(None, ge=1),
+    prefix_dim: Optional[int] = Query(None, ge=1),  # Matryoshka first pass, e.g. 256
+    mode: str = Query("vector", pattern="^(lexical|vector|hybrid)$"),
 ):
-    """Return k most similar pages. engine=native|python"""
+    """Return k most similar pages. engine=native|python
+
+    ``mode=lexical`` ranks by BM25 over page text and never calls the
+    embedding API; ``mode=hybrid`` fuses the BM25 and vector rankings by
+    reciprocal rank.
+
+    ``story_id`` and ``page_from``/``page_to`` scope the search; the filter is
+    applied during the ANN walk (or before ranking on the exact engine).
+    ``prefix_dim`` shortlists on a truncated embedding and re-ranks the
+    candidates at full dimension.
+    """
     # start timer for Prometheus metrics
     start_t = time.perf_counter()
-    resp = openai.Embedding.create(
-        model="text-embedding-3-small",
-        input=q
-    )
-    q_vec = resp["data"][0]["embedding"]
+    filters = {"story_id": story_id, "page_from": page_from, "page_to": page_to, "prefix_dim": prefix_dim}
+    if prefix_dim is not None:
+        allowed_dims = vector_store.PREFIX_DIMS
+        if engine == "native":
+            try:
+                import ann_hnsw
+                allowed_dims = ann_hnsw.PREFIX_DIMS
+            except ImportError:
+                # No hnswlib: retrieval falls back to the exact engine
+                pass
+        if prefix_dim not in allowed_dims:
+            raise HTTPException(status_code=422, detail=f"prefix_dim must be one of {list(allowed_dims)}")
+    retrieved = await retrieve_or_429(q, k, engine=engine, mode=mode, ef=ef, **filters)
+    # record metrics
+    SEARCH_COUNT.labels(engine="lexical" if mode == "lexical" else engine).inc()
+    SEARCH_LATENCY.observe(time.perf_counter() - start_t)
+    return {"query": q, "results": retrieved.hits, "mode": mode}
 
-    # Native ANN with HNSW
-    if engine == "native":
-        import numpy as np
-        import ann_hnsw
-        # adjust HNSW search ef parameter at runtime
-        try:
-            ann_hnsw.idx.set_ef(ef)
-        except Exception:
-            pass
-        q_np = np.asarray(q_vec, dtype=np.float32)
-        try:
-            hits = ann_hnsw.query(q_np, k)
-            results = []
-            for int_id, dist in hits:
-                story_id, page_num = ann_hnsw.unpack_id(int_id)
-                results.append({"story_id": story_id, "page_num": page_num, "score": 1 - dist})
-            # record metrics
-            SEARCH_COUNT.labels(engine=engine).inc()
-            SEARCH_LATENCY.observe(time.perf_counter() - start_t)
-            return {"query": q, "results": results}
-        except Exception as e:
-            # Fall back to NumPy cosine search if HNSW fails
-            return {"query": q, "results": [], "error": f"HNSW search failed: {str(e)}", "engine": "native_failed"}
-
-    # --- NumPy cosine fallback ---
-    import numpy as np
-    session = get_cassandra_session()
-    rows = session.execute("SELECT story_id, page_num, embedding FROM pages")
-    q_np = np.asarray(q_vec, dtype=np.float32)
-    q_np /= np.linalg.norm(q_np) + 1e-9
-    scored = []
-    for r in rows:
-        v = np.asarray(r.embedding, dtype=np.float32)
-        score = float(np.dot(q_np, v) / (np.linalg.norm(v) + 1e-9))
-        scored.append((score, r.story_id, r.page_num))
-    top = heapq.nlargest(k, scored, key=lambda x: x[0])
-    # record metrics for fallback
-    SEARCH_COUNT.labels(engine=engine).inc()
+class BatchQuery(BaseModel):
+    q: str = Field(..., min_length=1, max_length=512)
+    k: int = Field(5, ge=1)
+    ef: int = Field(64, ge=1)
+
+class BatchSearchRequest(BaseModel):
+    queries: List[BatchQuery] = Field(..., min_length=1, max_length=64)
+    engine: str = "native"
+
+@app.post("/search/batch", dependencies=[Depends(verify_token)])
+@limiter.limit("5/minute")
+async def search_batch(req: BatchSearchRequest, request: Request):
+    """Answer many queries in one call: one batched embedding, one ANN/matrix pass."""
+    start_t = time.perf_counter()
+    texts = [item.q for item in req.queries]
+    ks = [item.k for item in req.queries]
+    try:
+        ranked = await retrieve_many(texts, ks, engine=req.engine, ef=max(item.ef for item in req.queries))
+    except openai.error.RateLimitError:
+        raise HTTPException(status_code=429, detail="Rate limit exceeded")
+
+    SEARCH_COUNT.labels(engine=req.engine).inc()
     SEARCH_LATENCY.observe(time.perf_counter() - start_t)
-    return {"query": q, "results": [{"story_id": sid, "page_num": pn, "score": s} for s, sid, pn in top]}
+    return {"results": [{"query": q, "results": hits} for q, hits in zip(texts, ranked)]}
+
+async def cached_answer(q: str, context_pages):
+    """Query vector, context ids and a cached answer for a near-identical question, if any."""
+    # Already embedded (and cached) by the retrieval call
+    q_vec = await embed_or_429(q)
+    pages = page_ids(context_pages)
+    answer = get_answer_cache().get(q_vec, pages)
+    ANSWER_CACHE_COUNT.labels(result="miss" if answer is None else "hit").inc()
+    return q_vec, pages, answer
 
 class ChatRequest(BaseModel):
     q: str
@@ -390,52 +448,19 @@ class ChatRequest(BaseModel):
 async def chat(req: ChatRequest, request: Request):
     if os.getenv("SEARCH_ENABLED", "false").lower() != "true":
         raise HTTPException(status_code=404, detail="Chat disabled")
-    # Retrieve top context pages
-    # Create direct search rather than calling the endpoint
-    # Generate query embedding with retry/backoff
-    max_attempts = 3
-    delay = 1
-    for attempt in range(max_attempts):
-        try:
-            # Legacy v0.28.1 API
-            resp = openai.Embedding.create(
-                model='text-embedding-3-small', input=req.q
-            )
-            break
-        except openai.error.RateLimitError:
-            if attempt == max_attempts - 1:
-                raise HTTPException(status_code=429, detail="Rate limit exceeded")
-            time.sleep(delay)
-            delay *= 2
-    # Extract embedding from legacy response
-    q_vec = resp['data'][0]['embedding']
-    # Fetch all pages
-    session = get_cassandra_session()
-    rows = session.execute("SELECT page_num, html, embedding FROM pages")
-    norm_q = math.sqrt(sum(x*x for x in q_vec))
-    results = []
-    for r in rows:
-        vec = r.embedding
-        dot = sum(a*b for a,b in zip(q_vec, vec))
-        norm_r = math.sqrt(sum(x*x for x in vec))
-        score = (dot/(norm_q*norm_r)) if norm_q and norm_r else 0.0
-        results.append({"page_num": r.page_num, "html": r.html, "score": score})
-    results.sort(key=lambda x: x["score"], reverse=True)
-    context_pages = results[:req.k]
+    # Top context pages from the shared retrieval pipeline (html for the top-k only)
+    context_pages = (await retrieve_or_429(req.q, req.k, with_html=True)).hits
     
-    # Build prompt with context
-    docs = "\n".join([f"Page {p['page_num']}: {p['html']}" for p in context_pages])
-    prompt = f"Answer question: {req.q}\n\nContext:\n{docs}"
-    # Non-streaming chat completion for easy consumption
-    resp = openai.ChatCompletion.create(
-        model='gpt-4o',
-        messages=[
-            {'role':'system', 'content':'You are a helpful assistant.'},
-            {'role':'user', 'content': prompt}
-        ]
-    )
-    answer = resp.choices[0].message.content
-    return {"answer": answer, "source": context_pages}
+    # Build prompt from as many pages as fit the token budget (counts stored at ingest)
+    context_pages, _ = pack_context(req.q, context_pages)
+    prompt = build_prompt(req.q, context_pages)
+    q_vec, pages, answer = await cached_answer(req.q, context_pages)
+    if answer is not None:
+        return {"answer": answer, "source": public_hits(context_pages), "cached": True}
+    # Async completion; the worker keeps serving while it runs
+    answer = await complete(prompt)
+    get_answer_cache().put(q_vec, pages, answer)
+    return {"answer": answer, "source": public_hits(context_pages)}
 
 @app.post("/chat/stream", dependencies=[Depends(verify_token)])
 @limiter.limit("3/minute")
@@ -444,67 +469,19 @@ async def chat_stream(req: ChatRequest, request: Request):
     if os.getenv("SEARCH_ENABLED", "false").lower() != "true":
         raise HTTPException(status_code=404, detail="Chat disabled")
     
-    # Create direct search rather than calling the endpoint
-    # Generate query embedding with retry/backoff
-    max_attempts = 3
-    delay = 1
-    for attempt in range(max_attempts):
-        try:
-            # Legacy v0.28.1 API
-            resp = openai.Embedding.create(
-                model='text-embedding-3-small', input=req.q
-            )
-            break
-        except openai.error.RateLimitError:
-            if attempt == max_attempts - 1:
-                raise HTTPException(status_code=429, detail="Rate limit exceeded")
-            time.sleep(delay)
-            delay *= 2
-    # Extract embedding from legacy response
-    q_vec = resp['data'][0]['embedding']
-    # Fetch all pages
-    session = get_cassandra_session()
-    rows = session.execute("SELECT page_num, html, embedding FROM pages")
-    norm_q = math.sqrt(sum(x*x for x in q_vec))
-    results = []
-    for r in rows:
-        vec = r.embedding
-        dot = sum(a*b for a,b in zip(q_vec, vec))
-        norm_r = math.sqrt(sum(x*x for x in vec))
-        score = (dot/(norm_q*norm_r)) if norm_q and norm_r else 0.0
-        results.append({"page_num": r.page_num, "html": r.html, "score": score})
-    results.sort(key=lambda x: x["score"], reverse=True)
-    context_pages = results[:req.k]
-    
-    # Build prompt with context
-    docs = "\n".join([f"Page {p['page_num']}: {p['html']}" for p in context_pages])
-    prompt = f"Answer question: {req.q}\n\nContext:\n{docs}"
+    # Top context pages from the shared retrieval pipeline (html for the top-k only)
+    context_pages = (await retrieve_or_429(req.q, req.k, with_html=True)).hits
     
-    async def event_generator():
-        # First yield the source documents
-        yield f"data: {{'event': 'sources', 'data': {str(context_pages)}}}\n\n"
-        
-        # Stream the chat completion
-        response = openai.ChatCompletion.create(
-            model='gpt-4o',
-            messages=[
-                {'role':'system', 'content':'You are a helpful assistant.'},
-                {'role':'user', 'content': prompt}
-            ],
-            stream=True  # Enable streaming
-        )
-        
-        collected_messages = []
-        # Iterate through the stream of events
-        for chunk in response:
-            if hasattr(chunk.choices[0], 'delta') and hasattr(chunk.choices[0].delta, 'content'):
-                content = chunk.choices[0].delta.content
-                if content:
-                    collected_messages.append(content)
-                    yield f"data: {{'event': 'token', 'data': {repr(content)}}}\n\n"
-        
-        # Send the complete message at the end
-        full_response = ''.join(collected_messages)
-        yield f"data: {{'event': 'complete', 'data': {repr(full_response)}}}\n\n"
+    # Build prompt from as many pages as fit the token budget (counts stored at ingest)
+    context_pages, _ = pack_context(req.q, context_pages)
+    prompt = build_prompt(req.q, context_pages)
+    q_vec, pages, answer = await cached_answer(req.q, context_pages)
     
-    return StreamingResponse(event_generator(), media_type="text/event-stream") 
\ No newline at end of file
+    # JSON SSE frames from the async completion stream (or the cached answer), coalesced;
+    # stops if the client leaves, and only a finished answer is cached
+    frames = stream_answer(
+        prompt, public_hits(context_pages), request, answer=answer,
+        on_complete=lambda text: get_answer_cache().put(q_vec, pages, text),
+    )
+    return StreamingResponse(frames, media_type="text/event-stream")
+ 
\ No newline at end of file
@@ -0,0 +1,232 @@
+"""
+Retrieval pipeline shared by the search and chat endpoints.
+
+One call embeds the query (cached, batched), ranks pages with the requested
+engine (HNSW, falling back to the exact resident matrix, optionally fused
+with BM25), caches the ranking, and hydrates html for only the top-k pages:
+page cache first, then the resident store, then one Cassandra ``IN`` query
+per story for whatever is still missing.
+"""
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+import lexical
+import vector_store
+from cache import acache_set, cache_get_many, cache_get_or_compute, cache_invalidate_tags, cache_set_many
+from db import execute_async, get_cassandra_session, prepared
+from embeddings import embed_queries, embed_query, normalise_query
+
+DEFAULT_ENGINE = os.getenv("RETRIEVAL_ENGINE", "native")
+# Rankings (ids and scores, no html) are cached briefly; page html separately
+RESULT_NAMESPACE = "retrieval"
+RESULT_TTL = int(os.getenv("RETRIEVAL_RESULT_TTL", "300"))
+PAGE_NAMESPACE = "page"
+# Safe to raise: writes refresh the page's entry and drop rankings that used it
+PAGE_TTL = int(os.getenv("PAGE_CACHE_TTL", "3600"))
+# Set on hydrated hits for context.pack_context; never returned to clients
+INTERNAL_FIELDS = ("tokens", "paragraph_tokens")
+
+logger = logging.getLogger("retrieval")
+
+
+class Retrieved(NamedTuple):
+    hits: List[Dict[str, Any]]
+    cached: bool = False
+
+
+def page_cache_key(story_id: str, page_num: int) -> str:
+    return f"{story_id}:{page_num}"
+
+
+def page_tag(story_id: str, page_num: int) -> str:
+    """Cache tag on every entry built from this page (its record, rankings that include it)."""
+    return f"page:{story_id}:{page_num}"
+
+
+def _ranking_tags(ranked: Sequence[Dict[str, Any]]) -> List[str]:
+    return [page_tag(hit["story_id"], hit["page_num"]) for hit in ranked]
+
+
+def _set_tokens(hit: Dict[str, Any], token_count: Optional[int], paragraph_tokens: Optional[List[int]]) -> None:
+    # Counts stored at ingest, for context.pack_context; absent on older pages
+    if token_count is not None:
+        hit["tokens"] = token_count
+        hit["paragraph_tokens"] = list(paragraph_tokens or [])
+
+
+def public_hits(hits: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Copies of ``hits`` without the internal context-packing fields, for responses."""
+    return [{key: value for key, value in hit.items() if key not in INTERNAL_FIELDS} for hit in hits]
+
+
+def page_record(row: Any) -> Dict[str, Any]:
+    """JSON-safe dict of a pages row, as stored under the ``page`` cache namespace."""
+    record = dict(row._asdict())
+    if isinstance(record.get("embedding"), np.ndarray):
+        record["embedding"] = record["embedding"].tolist()
+    return record
+
+
+async def get_store() -> vector_store.VectorStore:
+    """Resident vector store; a first load runs off the event loop."""
+    if vector_store.is_loaded():
+        return vector_store.get_store()
+    return await asyncio.to_thread(vector_store.get_store, get_cassandra_session)
+
+
+async def get_lexical_index() -> lexical.BM25Index:
+    """Resident BM25 index; a first load (or Cassandra build) runs off the event loop."""
+    if lexical.is_loaded():
+        return lexical.get_index()
+    return await asyncio.to_thread(lexical.get_index, get_cassandra_session)
+
+
+def _ann_hits(hits: Sequence[Tuple[str, int, float]]) -> List[Dict[str, Any]]:
+    return [{"story_id": sid, "page_num": pn, "score": 1 - dist} for sid, pn, dist in hits]
+
+
+async def _rank_vector(q_vec: Any, k: int, engine: str, ef: Optional[int], filters: Dict[str, Any]) -> List[Dict[str, Any]]:
+    if engine == "native":
+        try:
+            import ann_hnsw
+            # Off the loop: the walk releases the GIL and may wait on an index write
+            hits = await asyncio.to_thread(ann_hnsw.search, np.asarray(q_vec, dtype=np.float32), k, ef=ef, **filters)
+            return _ann_hits(hits)
+        except Exception as e:
+            logger.warning(f"HNSW search failed, using exact engine: {e}")
+    ranked: List[Dict[str, Any]] = (await get_store()).search(q_vec, k, **filters)
+    return ranked
+
+
+async def retrieve(
+    q: str,
+    k: int,
+    engine: str = DEFAULT_ENGINE,
+    mode: str = "vector",
+    ef: Optional[int] = None,
+    with_html: bool = False,
+    story_id: Optional[str] = None,
+    page_from: Optional[int] = None,
+    page_to: Optional[int] = None,
+    prefix_dim: Optional[int] = None,
+) -> Retrieved:
+    """
+    Top-k pages for ``q``; ``mode`` is ``vector``, ``lexical`` or ``hybrid``.
+
+    Embedding rate limits propagate as ``openai.error.RateLimitError``.
+    """
+    scope = {"story_id": story_id, "page_from": page_from, "page_to": page_to}
+    key = json.dumps([normalise_query(q), k, engine, mode, ef, prefix_dim, scope], sort_keys=True)
+
+    async def rank() -> List[Dict[str, Any]]:
+        # Hybrid fuses deeper lists from both sides than the k it returns
+        depth = k * lexical.HYBRID_DEPTH if mode == "hybrid" else k
+        lexical_hits: List[Dict[str, Any]] = []
+        if mode != "vector":
+            lexical_hits = (await get_lexical_index()).search(q, depth, **scope)
+        if mode == "lexical":
+            return lexical_hits
+        q_vec = await embed_query(q)
+        ranked = await _rank_vector(q_vec, depth, engine, ef, {**scope, "prefix_dim": prefix_dim})
+        if mode != "vector":
+            ranked = lexical.fuse([lexical_hits, ranked], k)
+        return ranked
+
+    # One ranking per key at a time, across workers; hot keys refresh before they expire
+    ranked, cached = await cache_get_or_compute(RESULT_NAMESPACE, key, rank, expires=RESULT_TTL, tags=_ranking_tags)
+    if with_html:
+        ranked = await hydrate(ranked)
+    return Retrieved(ranked, cached)
+
+
+async def retrieve_many(texts: Sequence[str], ks: Sequence[int], engine: str = DEFAULT_ENGINE, ef: Optional[int] = None) -> List[List[Dict[str, Any]]]:
+    """Rank several queries with one batched embedding and one ANN/matrix pass."""
+    q_vecs = np.vstack(await embed_queries(list(texts)))
+    if engine == "native":
+        try:
+            import ann_hnsw
+            # One multi-row knn_query: widest k across the batch, trimmed per query
+            rows = await asyncio.to_thread(ann_hnsw.search_many, q_vecs, max(ks), ef=max(ef or 0, max(ks)))
+            return [_ann_hits(hits[:k]) for hits, k in zip(rows, ks)]
+        except Exception as e:
+            logger.warning(f"HNSW batch search failed, using exact engine: {e}")
+    ranked: List[List[Dict[str, Any]]] = (await get_store()).search_many(q_vecs, list(ks))
+    return ranked
+
+
+async def write_through_page(story_id: str, page_num: int) -> Optional[Dict[str, Any]]:
+    """
+    After a page write: drop every cached entry built from the old page (its
+    record, rankings that included it; in every worker) and cache the row as
+    now stored.  Returns the cached record, or None if the page is not found.
+    """
+    await cache_invalidate_tags([page_tag(story_id, page_num)])
+    session = get_cassandra_session()
+    rows = await execute_async(session, prepared("page_by_id", session), (story_id, page_num))
+    if not rows:
+        return None
+    record = page_record(rows[0])
+    await acache_set(PAGE_NAMESPACE, page_cache_key(story_id, page_num), record, PAGE_TTL, tags=[page_tag(story_id, page_num)])
+    return record
+
+
+async def _fetch_story_pages(session: Any, story_id: str, page_nums: List[int]) -> List[Any]:
+    stmt = prepared("pages_by_story", session)
+    rows: List[Any] = await execute_async(session, stmt, (story_id, page_nums))
+    return rows
+
+
+async def hydrate(hits: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Copies of ``hits`` with ``html`` (and stored token counts), reading only
+    the pages that were ranked.
+    """
+    out = [dict(hit) for hit in hits]
+    missing: Dict[str, List[Dict[str, Any]]] = {}
+    store = vector_store.get_store() if vector_store.is_loaded() else None
+    # Every cached page record in one round trip
+    records = await cache_get_many(PAGE_NAMESPACE, [page_cache_key(h["story_id"], h["page_num"]) for h in out if h.get("html") is None])
+    for hit in out:
+        if hit.get("html") is not None:
+            continue
+        record = records.get(page_cache_key(hit["story_id"], hit["page_num"]))
+        html = record.get("html") if record else None
+        if html is not None:
+            _set_tokens(hit, record.get("token_count"), record.get("paragraph_tokens"))
+        elif store is not None:
+            html = store.html_for(hit["story_id"], hit["page_num"])
+            _set_tokens(hit, *(store.tokens_for(hit["story_id"], hit["page_num"]) or (None, None)))
+        hit["html"] = html
+        if html is None:
+            missing.setdefault(hit["story_id"], []).append(hit)
+    if missing:
+        try:
+            session = get_cassandra_session()
+            fetched = await asyncio.gather(
+                *(_fetch_story_pages(session, sid, [h["page_num"] for h in group]) for sid, group in missing.items())
+            )
+        except Exception as e:
+            logger.warning(f"Page hydration failed: {e}")
+            return out
+        by_page = {}
+        for rows in fetched:
+            for row in rows:
+                record = page_record(row)
+                by_page[(record["story_id"], record["page_num"])] = record
+        await cache_set_many(
+            PAGE_NAMESPACE,
+            {page_cache_key(*pid): record for pid, record in by_page.items()},
+            expires=PAGE_TTL,
+            tags={page_cache_key(*pid): [page_tag(*pid)] for pid in by_page},
+        )
+        for group in missing.values():
+            for hit in group:
+                record = by_page.get((hit["story_id"], hit["page_num"]), {})
+                hit["html"] = record.get("html")
+                _set_tokens(hit, record.get("token_count"), record.get("paragraph_tokens"))
+    return out
@@ -0,0 +1,475 @@
+"""Resident exact-search vector store.
+
+Every page embedding lives in one contiguous, L2-normalised float32 matrix
+with a parallel array of ``(story_id, page_num)`` ids.  A query is a single
+BLAS mat-vec followed by an ``argpartition`` top-k, instead of a full
+``SELECT ... FROM pages`` scan scored in Python on every request.
+
+With ``VECTOR_STORE_QUANT=int8`` the store keeps per-dimension int8 codes
+resident instead (a quarter of the float32 footprint), scores every row with
+an integer dot product and re-ranks a shortlist against the full-precision
+rows, which are spilled to a memory-mapped file.
+
+Searches may also ask for a Matryoshka first pass (``prefix_dim``): rows are
+scored on the re-normalised leading 256/512 components, and only the
+candidate shortlist is re-scored on all 1536.
+"""
+import os
+import logging
+import tempfile
+import threading
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+DIM = 1536
+# seed.py caches the corpus embeddings here (one story, pages numbered from 1)
+VECTORS_PATH = os.getenv("VECTORS_PATH", "/data/vectors.npy")
+VECTORS_STORY_ID = os.getenv("VECTORS_STORY_ID", "entrance")
+# embedding_blob is decoded by db.page_row_factory; the list column covers rows not yet backfilled
+PAGE_SCAN_CQL = "SELECT story_id, page_num, html, embedding, embedding_blob, token_count, paragraph_tokens FROM pages"
+# Keyspaces that have not added the token count columns yet
+BLOB_PAGE_SCAN_CQL = "SELECT story_id, page_num, html, embedding, embedding_blob FROM pages"
+# Keyspaces that have not run the embedding_blob migration yet
+LEGACY_PAGE_SCAN_CQL = "SELECT story_id, page_num, html, embedding FROM pages"
+# "int8" selects QuantizedVectorStore for the exact engine
+VECTOR_STORE_QUANT = os.getenv("VECTOR_STORE_QUANT", "")
+# Shortlist re-ranked in float32: max(RERANK_MIN, RERANK_FACTOR * k) rows
+RERANK_FACTOR = int(os.getenv("VECTOR_STORE_RERANK_FACTOR", "8"))
+RERANK_MIN = int(os.getenv("VECTOR_STORE_RERANK_MIN", "64"))
+# Matryoshka prefix widths a search may ask for (each copy is built on first use)
+PREFIX_DIMS = tuple(int(d) for d in os.getenv("VECTOR_PREFIX_DIMS", "256,512").split(",") if d)
+# Rows scored per integer block, bounding the int32 temporaries
+QUANT_BLOCK_ROWS = 4096
+
+logger = logging.getLogger("vector_store")
+
+
+def _normalise(mat: np.ndarray) -> np.ndarray:
+    """Return a C-contiguous float32 copy of ``mat`` with unit-length rows."""
+    mat = np.ascontiguousarray(mat, dtype=np.float32)
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(mat / norms, dtype=np.float32)
+
+
+def recall_at_k(exact: Sequence[Dict[str, Any]], approx: Sequence[Dict[str, Any]]) -> float:
+    """Fraction of the exact top-k pages that the approximate top-k also returned."""
+    if not exact:
+        return 1.0
+    want = {(h["story_id"], h["page_num"]) for h in exact}
+    return len(want & {(h["story_id"], h["page_num"]) for h in approx}) / len(want)
+
+
+def truncate(vecs: Any, dim: int) -> np.ndarray:
+    """Matryoshka prefix of each row: the first ``dim`` components, re-normalised."""
+    mat = np.asarray(vecs, dtype=np.float32)
+    return _normalise(mat.reshape(-1, mat.shape[-1])[:, :dim])
+
+
+def _rerank(matrix: np.ndarray, q: np.ndarray, approx: np.ndarray, ks: List[int]) -> np.ndarray:
+    """Exact scores for each row's approximate shortlist, ``-inf`` everywhere else."""
+    n = approx.shape[1]
+    scores = np.full(approx.shape, -np.inf, dtype=np.float32)
+    for i, (q_row, k) in enumerate(zip(q, ks)):
+        m = min(n, max(RERANK_MIN, RERANK_FACTOR * k))
+        shortlist = np.argpartition(-approx[i], m - 1)[:m] if m < n else np.arange(n)
+        shortlist.sort()  # sequential reads (and memory-map pages) in row order
+        scores[i, shortlist] = matrix[shortlist] @ q_row
+    return scores
+
+
+class _State(NamedTuple):
+    """Everything a query reads, published together so it is never out of step."""
+    ids: List[Tuple[str, int]]
+    matrix: np.ndarray
+    html: List[Optional[str]]
+    rows: Dict[Tuple[str, int], int]
+    stories: np.ndarray
+    pages: np.ndarray
+    # prefix width -> truncated, re-normalised copy of ``matrix``
+    prefixes: Dict[int, np.ndarray]
+    codes: Optional[np.ndarray] = None
+
+
+class VectorStore:
+    """Pre-normalised embedding matrix with parallel page ids (and html)."""
+
+    def __init__(
+        self,
+        ids: List[Tuple[str, int]],
+        matrix: np.ndarray,
+        html: Optional[List[Optional[str]]] = None,
+        tokens: Optional[Dict[Tuple[str, int], Tuple[int, Optional[List[int]]]]] = None,
+    ):
+        self._lock = threading.Lock()
+        # (story_id, page_num) -> (token_count, paragraph_tokens) stored at ingest
+        self._tokens = dict(tokens or {})
+        matrix = np.asarray(matrix, dtype=np.float32).reshape(len(ids), -1) if ids else np.empty((0, DIM), dtype=np.float32)
+        self._publish(list(ids), _normalise(matrix), list(html) if html is not None else [None] * len(ids))
+
+    def _publish(self, ids, matrix, html, codes=None) -> None:
+        # Swap everything as one tuple so readers never see ids and rows out of step
+        self._state = _State(
+            ids, matrix, html, {pid: row for row, pid in enumerate(ids)},
+            # Column views of the ids for vectorised story/page filters
+            np.array([sid for sid, _ in ids], dtype=object),
+            np.array([pn for _, pn in ids], dtype=np.int64),
+            {},
+            codes,
+        )
+
+    def mask(self, story_id: Optional[str] = None, page_from: Optional[int] = None, page_to: Optional[int] = None) -> Optional[np.ndarray]:
+        """Row mask for a story/page-range filter, or None when unfiltered."""
+        return self._mask(self._state, story_id, page_from, page_to)
+
+    @staticmethod
+    def _mask(state: _State, story_id: Optional[str] = None, page_from: Optional[int] = None, page_to: Optional[int] = None) -> Optional[np.ndarray]:
+        if story_id is None and page_from is None and page_to is None:
+            return None
+        stories, pages = state.stories, state.pages
+        mask = np.ones(len(pages), dtype=bool)
+        if story_id is not None:
+            mask &= stories == story_id
+        if page_from is not None:
+            mask &= pages >= page_from
+        if page_to is not None:
+            mask &= pages <= page_to
+        return mask
+
+    def __len__(self) -> int:
+        return len(self._state[0])
+
+    @property
+    def dim(self) -> int:
+        return self._state[1].shape[1]
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Any]) -> "VectorStore":
+        """Build from Cassandra rows exposing ``story_id, page_num, html, embedding``."""
+        ids: List[Tuple[str, int]] = []
+        vecs: List[Any] = []
+        html: List[Optional[str]] = []
+        tokens: Dict[Tuple[str, int], Tuple[int, Optional[List[int]]]] = {}
+        for r in rows:
+            if r.embedding is None:
+                continue
+            ids.append((r.story_id, r.page_num))
+            vecs.append(r.embedding)
+            html.append(getattr(r, "html", None))
+            if getattr(r, "token_count", None) is not None:
+                tokens[(r.story_id, r.page_num)] = (r.token_count, r.paragraph_tokens)
+        matrix = np.asarray(vecs, dtype=np.float32) if vecs else np.empty((0, DIM), dtype=np.float32)
+        return cls(ids, matrix, html, tokens)
+
+    @classmethod
+    def from_npy(cls, path: str = VECTORS_PATH, story_id: str = VECTORS_STORY_ID) -> "VectorStore":
+        """Build from the ``vectors.npy`` cache written by ``scripts/seed.py``."""
+        matrix = np.load(path)
+        ids = [(story_id, i) for i in range(1, matrix.shape[0] + 1)]
+        return cls(ids, matrix)
+
+    def search(self, q_vec: Any, k: int, with_html: bool = False, prefix_dim: Optional[int] = None, **filters: Any) -> List[Dict[str, Any]]:
+        """Return the ``k`` best pages by cosine similarity, highest first.
+
+        ``filters`` (``story_id``, ``page_from``, ``page_to``) restrict the
+        candidate rows before ranking.  ``prefix_dim`` shortlists on that
+        many leading dimensions before the full-width re-rank.
+        """
+        return self.search_many(np.asarray(q_vec, dtype=np.float32).reshape(1, -1), [k], with_html, prefix_dim, **filters)[0]
+
+    def search_many(
+        self,
+        q_vecs: Any,
+        ks: List[int],
+        with_html: bool = False,
+        prefix_dim: Optional[int] = None,
+        **filters: Any,
+    ) -> List[List[Dict[str, Any]]]:
+        """Rank several queries with one matrix-matrix product; ``ks[i]`` is row i's k."""
+        state = self._state
+        ids, matrix, html = state.ids, state.matrix, state.html
+        mask = self._mask(state, **filters)
+        q = np.asarray(q_vecs, dtype=np.float32)
+        if len(ids) == 0:
+            return [[] for _ in ks]
+        q = q / (np.linalg.norm(q, axis=1, keepdims=True) + 1e-9)
+        scores = self._scores(state, q, ks, mask, prefix_dim)
+        allowed = len(ids)
+        if mask is not None:
+            scores[:, ~mask] = -np.inf
+            allowed = int(mask.sum())
+        return [self._top_k(ids, html, row, min(k, allowed), with_html) for row, k in zip(scores, ks)]
+
+    def _scores(
+        self,
+        state: _State,
+        q: np.ndarray,
+        ks: List[int],
+        mask: Optional[np.ndarray] = None,
+        prefix_dim: Optional[int] = None,
+    ) -> np.ndarray:
+        """Cosine scores of every row for each (unit-length) query row; masked rows are dropped afterwards."""
+        if not prefix_dim or prefix_dim >= state.matrix.shape[1]:
+            scores: np.ndarray = q @ state.matrix.T
+            return scores
+        approx = truncate(q, prefix_dim) @ self._prefix(state, prefix_dim).T
+        if mask is not None:
+            approx[:, ~mask] = -np.inf
+        return _rerank(state.matrix, q, approx, ks)
+
+    @staticmethod
+    def _prefix(state: _State, dim: int) -> np.ndarray:
+        reduced = state.prefixes.get(dim)
+        if reduced is None:
+            # Racing builders produce identical arrays; last write wins harmlessly
+            reduced = state.prefixes[dim] = truncate(state.matrix, dim)
+        return reduced
+
+    @staticmethod
+    def _top_k(ids, html, scores: np.ndarray, k: int, with_html: bool) -> List[Dict[str, Any]]:
+        n = len(ids)
+        k = min(k, n)
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k] if k < n else np.arange(n)
+        top = top[np.argsort(-scores[top])]
+        results = []
+        for row in top.tolist():
+            story_id, page_num = ids[row]
+            hit: Dict[str, Any] = {"story_id": story_id, "page_num": page_num, "score": float(scores[row])}
+            if with_html:
+                hit["html"] = html[row]
+            results.append(hit)
+        return results
+
+    def html_for(self, story_id: str, page_num: int) -> Optional[str]:
+        """Resident html for one page, if the store was loaded with it."""
+        state = self._state
+        row = state.rows.get((story_id, page_num))
+        return state.html[row] if row is not None else None
+
+    def tokens_for(self, story_id: str, page_num: int) -> Optional[Tuple[int, Optional[List[int]]]]:
+        """Stored ``(token_count, paragraph_tokens)`` for one page, if known."""
+        return self._tokens.get((story_id, page_num))
+
+    def upsert(self, story_id: str, page_num: int, embedding: Any, html: Optional[str] = None) -> None:
+        """Insert or replace one page; existing html is kept when ``html`` is None."""
+        vec = _normalise(np.asarray(embedding, dtype=np.float32).reshape(1, -1))
+        with self._lock:
+            state = self._state
+            ids, texts = state.ids, state.html
+            row = state.rows.get((story_id, page_num))
+            if row is None:
+                row = len(ids)
+                ids = ids + [(story_id, page_num)]
+                texts = texts + [html]
+            elif html is not None:
+                texts = list(texts)
+                texts[row] = html
+                # Counts were for the old text
+                self._tokens.pop((story_id, page_num), None)
+            matrix, codes = self._set_row(state, row, vec)
+            self._publish(ids, matrix, texts, codes)
+
+    def _set_row(self, state: _State, row: int, vec: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Matrix (and codes) with ``row`` set to ``vec``; ``row`` may be one past the end."""
+        if row == len(state.ids):
+            return (np.concatenate([state.matrix, vec]) if row else vec), None
+        matrix = state.matrix.copy()
+        matrix[row] = vec[0]
+        return matrix, None
+
+
+class Int8Quantizer:
+    """Per-dimension affine int8 codec: ``x[d] ~= offset[d] + scale[d] * code[d]``."""
+
+    def __init__(self, offset: np.ndarray, scale: np.ndarray):
+        self.offset = np.asarray(offset, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float32)
+
+    @classmethod
+    def fit(cls, matrix: np.ndarray) -> "Int8Quantizer":
+        """Map each dimension's observed ``[min, max]`` onto ``[-127, 127]``."""
+        lo, hi = matrix.min(axis=0), matrix.max(axis=0)
+        scale = (hi - lo) / 254.0
+        scale[scale == 0] = 1.0
+        return cls((hi + lo) / 2.0, scale)
+
+    def encode(self, matrix: np.ndarray) -> np.ndarray:
+        # Values outside the fitted range (later upserts) saturate
+        codes = np.rint((np.asarray(matrix, dtype=np.float32) - self.offset) / self.scale)
+        encoded: np.ndarray = np.clip(codes, -127, 127).astype(np.int8)
+        return encoded
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        decoded: np.ndarray = self.offset + self.scale * codes.astype(np.float32)
+        return decoded
+
+
+class _Spill:
+    """
+    Float32 rows in an anonymous memory-mapped file; pages load on demand.
+    Appended rows are written past what readers can see, and the file grows
+    geometrically without copying (earlier mappings stay valid for in-flight
+    readers).
+    """
+
+    def __init__(self, matrix: np.ndarray):
+        rows, self.dim = matrix.shape
+        fd, path = tempfile.mkstemp(prefix="vectors-", suffix=".f32")
+        self._fh = os.fdopen(fd, "r+b")
+        self.capacity = 0
+        self._grow(max(rows, 1))
+        self._map[:rows] = matrix
+        # The mapping outlives the name, so nothing is left behind on disk
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def _grow(self, capacity: int) -> None:
+        self._fh.truncate(capacity * self.dim * 4)
+        self._map = np.memmap(self._fh, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+        self.capacity = capacity
+
+    def rows(self, n: int) -> np.ndarray:
+        return self._map[:n]
+
+    def write(self, row: int, vec: np.ndarray) -> None:
+        if row >= self.capacity:
+            self._grow(max(row + 1, 2 * self.capacity))
+        self._map[row] = vec
+
+
+class QuantizedVectorStore(VectorStore):
+    """
+    ``VectorStore`` scanning int8 codes, with a float32 re-rank of the shortlist.
+
+    The query is folded into the per-dimension scales and itself quantized to
+    int8, so the full scan is an integer dot product; the constant offset term
+    does not change the order and is only added back for the shortlist cut.
+    """
+
+    _quantizer: Optional[Int8Quantizer] = None
+    _spill: Optional["_Spill"] = None
+    # Codes with spare rows at the end; the published state holds a view of the first n
+    _codes: Optional[np.ndarray] = None
+
+    def _publish(self, ids, matrix, html, codes=None) -> None:
+        if codes is None:
+            # Full build: fit the codec, encode and spill every row
+            if self._quantizer is None and len(ids):
+                self._quantizer = Int8Quantizer.fit(matrix)
+            if self._quantizer is not None:
+                self._codes = self._quantizer.encode(matrix)
+            else:
+                self._codes = np.empty(matrix.shape, dtype=np.int8)
+            self._spill = _Spill(matrix)
+            matrix, codes = self._spill.rows(len(ids)), self._codes
+        super()._publish(ids, matrix, html, codes)
+
+    def _set_row(self, state: _State, row: int, vec: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        # Encode only this row; an append is O(d), written where no published state looks yet
+        if self._quantizer is None or self._spill is None or self._codes is None:
+            # Empty store: the first page is a full build that fits the codec
+            return super()._set_row(state, row, vec)
+        n = max(len(state.ids), row + 1)
+        if row < len(state.ids):
+            # Searches may be reading this row: update fresh copies, published by the swap
+            self._spill = _Spill(self._spill.rows(n))
+            self._codes = self._codes[:n].copy()
+        self._spill.write(row, vec[0])
+        if row >= len(self._codes):
+            grown = np.empty((max(row + 1, 2 * len(self._codes)), self._codes.shape[1]), dtype=np.int8)
+            grown[:len(self._codes)] = self._codes
+            self._codes = grown
+        self._codes[row] = self._quantizer.encode(vec)[0]
+        return self._spill.rows(n), self._codes[:n]
+
+    def _scores(
+        self,
+        state: _State,
+        q: np.ndarray,
+        ks: List[int],
+        mask: Optional[np.ndarray] = None,
+        prefix_dim: Optional[int] = None,
+    ) -> np.ndarray:
+        # The int8 scan already is the cheap first pass, so prefix_dim is not used here
+        quant, codes = self._quantizer, state.codes
+        if quant is None or codes is None:
+            # Nothing fitted yet (empty store): plain float32 scores
+            return super()._scores(state, q, ks, mask, prefix_dim)
+        n = len(codes)
+        approx = np.empty((len(q), n), dtype=np.float32)
+        for i, q_row in enumerate(q):
+            weights = q_row * quant.scale
+            step = float(np.abs(weights).max()) / 127.0 or 1.0
+            w_int = np.rint(weights / step).astype(np.int32)
+            for start in range(0, n, QUANT_BLOCK_ROWS):
+                block = codes[start:start + QUANT_BLOCK_ROWS]
+                approx[i, start:start + len(block)] = block.astype(np.int32) @ w_int
+            approx[i] = approx[i] * step + float(q_row @ quant.offset)
+        if mask is not None:
+            approx[:, ~mask] = -np.inf
+        return _rerank(state.matrix, q, approx, ks)
+
+    @property
+    def nbytes(self) -> int:
+        """Resident bytes of the scan path (the int8 codes)."""
+        codes = self._state.codes
+        return codes.nbytes if codes is not None else 0
+
+
+# ── Process-wide store ──────────────────────────────────
+_store: Optional[VectorStore] = None
+_store_lock = threading.Lock()
+
+
+def load_store(session_factory: Optional[Callable[[], Any]] = None) -> VectorStore:
+    """Load from Cassandra, falling back to ``VECTORS_PATH`` when unavailable."""
+    store_cls = QuantizedVectorStore if VECTOR_STORE_QUANT == "int8" else VectorStore
+    if session_factory is not None:
+        for cql in (PAGE_SCAN_CQL, BLOB_PAGE_SCAN_CQL, LEGACY_PAGE_SCAN_CQL):
+            try:
+                store = store_cls.from_rows(session_factory().execute(cql))
+            except Exception as e:
+                logger.warning(f"Vector load from Cassandra failed: {e}")
+                continue
+            if len(store):
+                logger.info(f"Loaded {len(store)} page vectors from Cassandra")
+                return store
+            break
+    if os.path.exists(VECTORS_PATH):
+        store = store_cls.from_npy(VECTORS_PATH)
+        logger.info(f"Loaded {len(store)} page vectors from {VECTORS_PATH}")
+        return store
+    logger.warning("No page vectors available; exact search will return no results")
+    return store_cls([], np.empty((0, DIM), dtype=np.float32))
+
+
+def get_store(session_factory: Optional[Callable[[], Any]] = None) -> VectorStore:
+    """Return the resident store, loading it on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = load_store(session_factory)
+    return _store
+
+
+def is_loaded() -> bool:
+    return _store is not None
+
+
+def reset_store() -> None:
+    """Drop the resident store so the next ``get_store`` reloads it."""
+    global _store
+    with _store_lock:
+        _store = None
+
+
+def upsert_if_loaded(story_id: str, page_num: int, embedding: Any, html: Optional[str] = None) -> None:
+    """Keep an already-loaded store in step with a page write."""
+    if _store is not None:
+        _store.upsert(story_id, page_num, embedding, html)
@@ -0,0 +1,245 @@
+"""
+Tests for the versioned HNSW index wrapper.
+"""
+import os
+import time
+
+import numpy as np
+import pytest
+
+import ann_hnsw
+import index_versions
+from index_wal import WriteAheadLog
+
+
+@pytest.fixture
+def index_dir(tmp_path, monkeypatch):
+    """Point the wrapper at an empty artifact directory with no live index."""
+    monkeypatch.setattr(ann_hnsw, "HNSW_DIR", str(tmp_path))
+    monkeypatch.setattr(ann_hnsw, "LEGACY_PATH", str(tmp_path / "missing.idx"))
+    monkeypatch.setattr(ann_hnsw, "_current", None)
+    yield tmp_path
+    ann_hnsw.stop_watcher()
+
+def _vectors(n, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, ann_hnsw.DIM)).astype(np.float32)
+
+def _add_pages(story_id, vectors):
+    for page_num, vec in enumerate(vectors, start=1):
+        ann_hnsw.add(vec, ann_hnsw.pack_id(story_id, page_num))
+
+def test_publish_and_reload_resolves_labels(index_dir):
+    """A published version reloads with the same labels in a fresh handle."""
+    vecs = _vectors(10)
+    _add_pages("entrance", vecs)
+    version = ann_hnsw.publish()
+    assert index_versions.read_current(str(index_dir)) == version
+    assert index_versions.read_manifest(str(index_dir), version)["count"] == 10
+
+    ann_hnsw.reload()
+    assert ann_hnsw.current_version() == version
+    story_id, page_num, dist = ann_hnsw.search(vecs[3], k=1)[0]
+    assert (story_id, page_num) == ("entrance", 4)
+    assert dist < 1e-4
+
+def test_swap_keeps_pinned_version_alive(index_dir):
+    """In-flight queries finish on the old version; it is freed afterwards."""
+    _add_pages("entrance", _vectors(5))
+    first = ann_hnsw.publish()
+    _add_pages("book2", _vectors(5, seed=1))
+    second = ann_hnsw.publish()
+    ann_hnsw.reload(first)
+
+    with ann_hnsw.acquire() as pinned:
+        ann_hnsw.reload(second)
+        assert ann_hnsw.current_version() == second
+        # Old version is retired but still usable while pinned
+        assert pinned.version == first
+        assert pinned.index is not None
+        assert pinned.index.get_current_count() == 5
+    assert pinned.index is None
+
+def test_watcher_picks_up_new_version(index_dir):
+    """The background watcher swaps in a version published by another process."""
+    _add_pages("entrance", _vectors(3))
+    version = ann_hnsw.publish()
+    ann_hnsw._current.version = None  # as if this worker had not seen it yet
+    ann_hnsw.start_watcher(interval=0.01)
+    deadline = time.time() + 2
+    while ann_hnsw.current_version() != version and time.time() < deadline:
+        time.sleep(0.01)
+    assert ann_hnsw.current_version() == version
+
+def test_reload_unknown_version_keeps_live_index(index_dir):
+    """A failed load leaves the live version in place."""
+    _add_pages("entrance", _vectors(3))
+    version = ann_hnsw.publish()
+    with pytest.raises(Exception):
+        ann_hnsw.reload("does-not-exist")
+    assert ann_hnsw.current_version() == version
+
+def test_ingest_grows_capacity_and_replaces(index_dir, monkeypatch):
+    """Batched ingest resizes past the initial capacity and updates pages in place."""
+    monkeypatch.setattr(ann_hnsw, "INITIAL_CAPACITY", 4)
+    monkeypatch.setattr(ann_hnsw, "INGEST_BATCH", 1000)
+    vecs = _vectors(10)
+    ann_hnsw.ingest([("entrance", n, v) for n, v in enumerate(vecs, start=1)])
+    ann_hnsw.flush()
+    with ann_hnsw.acquire() as h:
+        assert h.index.get_current_count() == 10
+        assert h.index.get_max_elements() >= 10
+
+    replacement = _vectors(1, seed=5)[0]
+    ann_hnsw.ingest([("entrance", 2, replacement)])
+    ann_hnsw.flush()
+    with ann_hnsw.acquire() as h:
+        assert h.index.get_current_count() == 10
+    assert ann_hnsw.search(replacement, k=1)[0][:2] == ("entrance", 2)
+
+def test_wal_replay_after_crash(index_dir, monkeypatch):
+    """Pages logged after the last publish survive a restart without a rebuild."""
+    monkeypatch.setattr(ann_hnsw, "INGEST_BATCH", 1000)
+    vecs = _vectors(6)
+    ann_hnsw.ingest([("entrance", n, v) for n, v in enumerate(vecs[:3], start=1)])
+    version = ann_hnsw.publish()
+    ann_hnsw.ingest([("book2", n, v) for n, v in enumerate(vecs[3:], start=1)])
+    # "Crash": drop the in-memory index without flushing or publishing
+    monkeypatch.setattr(ann_hnsw, "_current", None)
+    assert ann_hnsw.search(vecs[4], k=1)[0][:2] == ("book2", 2)
+    assert ann_hnsw.current_version() == version
+
+def test_flush_applies_other_workers_writes(index_dir, monkeypatch):
+    """Records another process appends to the log reach this worker on flush."""
+    monkeypatch.setattr(ann_hnsw, "INGEST_BATCH", 1000)
+    vecs = _vectors(2)
+    ann_hnsw.ingest([("entrance", 1, vecs[0])])
+    ann_hnsw.flush()
+    with ann_hnsw.acquire() as h:
+        other = WriteAheadLog(h.wal.path)
+    other.append([("book2", 7, vecs[1])])
+    ann_hnsw.flush()
+    assert ann_hnsw.search(vecs[1], k=1)[0][:2] == ("book2", 7)
+
+def test_publish_includes_other_workers_logged_pages(index_dir, monkeypatch):
+    """Records another process logged but this one never flushed are in the new version."""
+    monkeypatch.setattr(ann_hnsw, "INGEST_BATCH", 1000)
+    vecs = _vectors(2)
+    ann_hnsw.ingest([("entrance", 1, vecs[0])])
+    with ann_hnsw.acquire() as h:
+        WriteAheadLog(h.wal.path).append([("book2", 7, vecs[1])])
+    version = ann_hnsw.publish()
+    monkeypatch.setattr(ann_hnsw, "_current", None)
+    assert ann_hnsw.search(vecs[1], k=1)[0][:2] == ("book2", 7)
+    assert ann_hnsw.current_version() == version
+
+def test_reload_carries_unflushed_pages(index_dir, monkeypatch):
+    """Pages queued on the old version are applied to the one swapped in."""
+    monkeypatch.setattr(ann_hnsw, "INGEST_BATCH", 1000)
+    vecs = _vectors(3)
+    _add_pages("entrance", vecs[:2])
+    first = ann_hnsw.publish()
+    second = ann_hnsw.publish()
+    index_versions.write_current(str(index_dir), first)
+    ann_hnsw.reload(first)
+    ann_hnsw.ingest([("book2", 1, vecs[2])])
+    ann_hnsw.reload(second)
+    ann_hnsw.flush()
+    assert ann_hnsw.search(vecs[2], k=1)[0][:2] == ("book2", 1)
+
+def test_pages_logged_after_a_publish_survive_reload_and_restart(index_dir, monkeypatch):
+    """A page logged on a version another worker just checkpointed outlives this worker."""
+    monkeypatch.setattr(ann_hnsw, "INGEST_BATCH", 1000)
+    vecs = _vectors(3)
+    _add_pages("entrance", vecs[:2])
+    first = ann_hnsw.publish()
+    worker = ann_hnsw._current
+    # Another worker checkpoints the first version's log as a new one
+    monkeypatch.setattr(ann_hnsw, "_current", ann_hnsw.load_handle(first))
+    second = ann_hnsw.publish()
+    monkeypatch.setattr(ann_hnsw, "_current", worker)
+    # Logged against the first version just after that snapshot, before this worker noticed
+    page = ("book2", 1, vecs[2])
+    with worker.lock:
+        worker.wal.append([page])
+        worker.pending.append(page)
+    ann_hnsw.reload(second)
+    with ann_hnsw.acquire() as h:
+        assert [r[:2] for r in WriteAheadLog(h.wal.path).read_new()] == [("book2", 1)]
+    # Restart: snapshot plus both logs
+    monkeypatch.setattr(ann_hnsw, "_current", None)
+    assert ann_hnsw.search(vecs[2], k=1)[0][:2] == ("book2", 1)
+    assert ann_hnsw.current_version() == second
+
+def test_ingest_rechecks_the_published_version_under_the_lock(index_dir, monkeypatch):
+    """A publish landing between the version check and the append moves the append to the new log."""
+    monkeypatch.setattr(ann_hnsw, "INGEST_BATCH", 1000)
+    vecs = _vectors(3)
+    _add_pages("entrance", vecs[:2])
+    first = ann_hnsw.publish()
+    second = ann_hnsw.publish()
+    index_versions.write_current(str(index_dir), first)
+    ann_hnsw.reload(first)
+    seen = iter([first])
+    monkeypatch.setattr(index_versions, "read_current", lambda root: next(seen, second))
+    ann_hnsw.ingest([("book2", 1, vecs[2])])
+    assert ann_hnsw.current_version() == second
+    logs = {v: WriteAheadLog(os.path.join(index_versions.version_dir(str(index_dir), v), ann_hnsw.WAL_FILE)) for v in (first, second)}
+    assert logs[first].read_new() == []
+    assert [r[:2] for r in logs[second].read_new()] == [("book2", 1)]
+
+def test_queries_do_not_wait_on_writers(index_dir):
+    """A publish or ingest holding the writer lock (e.g. in save_index) leaves queries running."""
+    import threading
+    vecs = _vectors(4)
+    _add_pages("entrance", vecs)
+    held, release = threading.Event(), threading.Event()
+
+    def writer():
+        with ann_hnsw.acquire() as h, h.lock:
+            held.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    held.wait(5)
+    try:
+        assert ann_hnsw.search(vecs[1], k=1)[0][:2] == ("entrance", 2)
+    finally:
+        release.set()
+        thread.join()
+
+def test_search_many_one_row_per_query(index_dir):
+    """A multi-row query returns one ranked list per input row, in order."""
+    vecs = _vectors(8)
+    _add_pages("entrance", vecs)
+    rows = ann_hnsw.search_many(vecs[[5, 0, 2]], k=2)
+    assert [row[0][:2] for row in rows] == [("entrance", 6), ("entrance", 1), ("entrance", 3)]
+    assert all(len(row) == 2 for row in rows)
+
+def test_filtered_search_stays_in_scope(index_dir):
+    """Story and page filters apply inside the walk; only matching pages come back."""
+    vecs = _vectors(40, seed=3)
+    _add_pages("a", vecs[:20])
+    _add_pages("b", vecs[20:])
+    hits = ann_hnsw.search(vecs[0], k=5, story_id="b")
+    assert len(hits) == 5 and all(sid == "b" for sid, _, _ in hits)
+    hits = ann_hnsw.search(vecs[0], k=10, story_id="a", page_from=3, page_to=5)
+    assert sorted(pn for _, pn, _ in hits) == [3, 4, 5]
+    assert ann_hnsw.search(vecs[0], k=3, story_id="nope") == []
+    # Exact match inside the range still ranks first
+    assert ann_hnsw.search(vecs[24], k=1, story_id="b", page_from=2)[0][:2] == ("b", 5)
+
+def test_prefix_graph_search_and_publish(index_dir):
+    """The prefix graph tracks every insert, is published, and re-ranks at full width."""
+    vecs = _vectors(30, seed=5)
+    _add_pages("entrance", vecs)
+    version = ann_hnsw.publish()
+    base = index_versions.index_path(str(index_dir), version)[: -len(".idx")]
+    for dim in ann_hnsw.PREFIX_DIMS:
+        assert (index_dir / version / f"{os.path.basename(base)}.p{dim}.idx").exists()
+    ann_hnsw.reload(version)
+    dim = ann_hnsw.PREFIX_DIMS[0]
+    hits = ann_hnsw.search(vecs[7], k=3, prefix_dim=dim)
+    assert hits[0][:2] == ("entrance", 8)
+    assert abs(hits[0][2]) < 1e-5  # full-width distance after the re-rank
+    assert ann_hnsw.search(vecs[7], k=2, prefix_dim=dim, page_from=20)[0][1] >= 20
@@ -0,0 +1,53 @@
+"""
+Tests for the semantic answer cache used by /chat.
+"""
+import numpy as np
+
+from app.answer_cache import AnswerCache, page_ids
+
+PAGES = page_ids([{"story_id": "s", "page_num": 1}, {"story_id": "s", "page_num": 2}])
+
+
+def _vec(*head):
+    vec = np.zeros(8, dtype=np.float32)
+    vec[:len(head)] = head
+    return vec
+
+
+def test_near_paraphrase_with_same_context_hits():
+    cache = AnswerCache(maxsize=4, threshold=0.95, ttl=60)
+    cache.put(_vec(1.0, 0.1), PAGES, "answer")
+    assert cache.get(_vec(1.0, 0.12), PAGES) == "answer"
+    # Different question, or same question over different pages, misses
+    assert cache.get(_vec(0.1, 1.0), PAGES) is None
+    assert cache.get(_vec(1.0, 0.1), PAGES[:1]) is None
+
+
+def test_page_write_invalidates_and_ring_evicts():
+    cache = AnswerCache(maxsize=2, threshold=0.95, ttl=60)
+    cache.put(_vec(1.0), PAGES, "a")
+    cache.put(_vec(0.0, 1.0), (("t", 9),), "b")
+    assert cache.invalidate_page("s", 2) == 1
+    assert cache.get(_vec(1.0), PAGES) is None
+    cache.put(_vec(0.0, 0.0, 1.0), PAGES, "c")
+    cache.put(_vec(0.0, 0.0, 0.0, 1.0), PAGES, "d")
+    # "b" was the oldest slot
+    assert cache.get(_vec(0.0, 1.0), (("t", 9),)) is None
+    assert len(cache) == 2
+
+
+def test_expired_entries_miss():
+    cache = AnswerCache(maxsize=2, threshold=0.9, ttl=-1)
+    cache.put(_vec(1.0), PAGES, "a")
+    assert cache.get(_vec(1.0), PAGES) is None
+    assert len(cache) == 0
+
+
+def test_page_invalidated_in_another_worker_drops_answers(monkeypatch):
+    import json
+    import cache as shared_cache
+    answers = AnswerCache(maxsize=4, threshold=0.95, ttl=60)
+    answers.put(_vec(1.0), PAGES, "a")
+    monkeypatch.setattr(shared_cache, "_tag_listeners", [answers.invalidate_tags])
+    shared_cache._apply_invalidation(json.dumps({"from": "other", "tags": ["page:s:1"]}))
+    assert answers.get(_vec(1.0), PAGES) is None
@@ -0,0 +1,63 @@
+"""
+Tests for the verified-token cache in auth.verify_token.
+"""
+import asyncio
+import time
+
+import jwt
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+
+import auth
+
+
+@pytest.fixture(autouse=True)
+def dev_mode(monkeypatch):
+    monkeypatch.setattr(auth, "ENV", "dev")
+    auth._verified.clear()
+    yield
+    auth._verified.clear()
+
+
+def _bearer(exp_in=300, scope="gibsey.search"):
+    payload = {"sub": "pytest", "exp": int(time.time()) + exp_in, "scope": scope}
+    return HTTPAuthorizationCredentials(scheme="Bearer", credentials=jwt.encode(payload, auth.DEV_JWT_SECRET, algorithm="HS256"))
+
+
+def test_token_is_verified_once_then_served_from_cache(monkeypatch):
+    calls = []
+    decode = jwt.decode
+    monkeypatch.setattr(auth.jwt, "decode", lambda *a, **kw: calls.append(1) or decode(*a, **kw))
+    creds = _bearer()
+    first = asyncio.run(auth.verify_token(creds))
+    first["sub"] = "mutated"
+    second = asyncio.run(auth.verify_token(creds))
+    assert second["sub"] == "pytest"
+    assert len(calls) == 1
+    # Stored under a hash, never the token itself
+    assert creds.credentials not in str(auth._verified._entries)
+
+
+def test_cached_claims_never_outlive_the_token():
+    creds = _bearer(exp_in=2)
+    claims = asyncio.run(auth.verify_token(creds))
+    _, expires_at = auth._verified._entries[auth.VerifiedTokens.key(creds.credentials)]
+    assert expires_at <= claims["exp"] + 0.01
+
+
+def test_cache_is_bounded_by_entries():
+    tokens = auth.VerifiedTokens(maxsize=2, ttl=60)
+    claims = {"exp": time.time() + 60}
+    for key in ("a", "b", "c"):
+        tokens.put(key, claims)
+    assert len(tokens) == 2
+    assert tokens.get("a") is None and tokens.get("c") == claims
+
+
+def test_scopes_are_checked_on_cache_hits():
+    creds = _bearer(scope="other")
+    for _ in range(2):
+        with pytest.raises(HTTPException) as exc:
+            asyncio.run(auth.verify_token(creds))
+        assert exc.value.status_code == 403
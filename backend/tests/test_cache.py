@@ -3,8 +3,11 @@ Tests for the caching module.
 """
 import os
 import time
+import asyncio
+import numpy as np
 import pytest
-from app.cache import cache_get, cache_set, cache_clear
+from app import cache as cache_module
+from app.cache import L1Cache, L1Limits, cache_get, cache_get_many, cache_set, cache_set_many, cache_clear
 
 @pytest.fixture(autouse=True)
 def clear_cache():
@@ -63,4 +66,267 @@ def test_cache_clear():
     
     # Clear all
     cache_clear()
-    assert cache_get("ns2", "key1") is None
\ No newline at end of file
+    assert cache_get("ns2", "key1") is None
+def test_l1_evicts_least_recently_used_by_entries_and_bytes():
+    """Each namespace is bounded separately; a read refreshes recency."""
+    l1 = L1Cache({"small": L1Limits(2, 100, 60), "tiny": L1Limits(10, 10, 60)})
+    l1.set("small", "a", 1, 60, 1)
+    l1.set("small", "b", 2, 60, 1)
+    assert l1.get("small", "a") == 1
+    l1.set("small", "c", 3, 60, 1)
+    assert l1.get("small", "b") is None
+    assert l1.get("small", "a") == 1 and l1.get("small", "c") == 3
+    l1.set("tiny", "x", "x", 60, 6)
+    l1.set("tiny", "y", "y", 60, 6)
+    assert l1.get("tiny", "x") is None
+    assert l1.size("tiny") == (1, 6)
+    # Larger than the whole namespace budget: not cached at all
+    l1.set("tiny", "z", "z", 60, 11)
+    assert l1.get("tiny", "z") is None
+
+
+def test_l1_oversized_write_drops_the_previous_value():
+    l1 = L1Cache({"tiny": L1Limits(10, 10, 60)})
+    l1.set("tiny", "k", "old", 60, 3)
+    l1.set("tiny", "k", "new", 60, 11)
+    assert l1.get("tiny", "k") is None
+    assert l1.size("tiny") == (0, 0)
+
+
+def test_l1_sweep_drops_expired_entries():
+    l1 = L1Cache({})
+    l1.set("ns", "old", 1, -1, 5)
+    l1.set("ns", "new", 2, 60, 5)
+    assert l1.sweep() == 1
+    assert l1.size("ns") == (1, 5)
+
+
+class FakeAsyncRedis:
+    """Records round trips; stands in for the pooled redis.asyncio client."""
+
+    def __init__(self):
+        self.data = {}
+        self.round_trips = 0
+        self.published = []
+
+    def _get(self, key):
+        return self.data.get(key)
+
+    def _setex(self, key, ttl, value):
+        self.data[key] = value.encode() if isinstance(value, str) else value
+
+    def _incr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) + 1
+        return self.data[key]
+
+    def _sadd(self, key, *members):
+        self.data.setdefault(key, set()).update(m.encode() if isinstance(m, str) else m for m in members)
+
+    def _zadd(self, key, mapping):
+        self.data.setdefault(key, {}).update({m.encode() if isinstance(m, str) else m: score for m, score in mapping.items()})
+
+    def _zremrangebyscore(self, key, low, high):
+        members = self.data.get(key, {})
+        for member in [m for m, score in members.items() if score <= high]:
+            del members[member]
+
+    def _zrange(self, key, start, end):
+        return list(self.data.get(key, {}))
+
+    def _expire(self, key, ttl):
+        pass
+
+    async def mget(self, keys):
+        self.round_trips += 1
+        return [self.data.get(k) for k in keys]
+
+    async def publish(self, channel, message):
+        self.published.append((channel, message))
+
+    async def delete(self, *keys):
+        self.round_trips += 1
+        for key in keys:
+            self.data.pop(key.decode() if isinstance(key, bytes) else key, None)
+
+    def pipeline(self, transaction=True):
+        redis_ = self
+
+        class Pipe:
+            def __init__(self):
+                self.ops = []
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc):
+                return False
+
+            def __getattr__(self, name):
+                return lambda *args: self.ops.append((getattr(redis_, "_" + name), args))
+
+            async def execute(self):
+                redis_.round_trips += 1
+                return [op(*args) for op, args in self.ops]
+
+        return Pipe()
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    fake = FakeAsyncRedis()
+    monkeypatch.setattr(cache_module, "_HAVE_REDIS", True)
+    monkeypatch.setattr(cache_module, "_get_aredis", lambda: fake)
+    monkeypatch.setattr(cache_module, "_generations", {})
+    return fake
+
+
+def test_many_keys_share_one_round_trip(fake_redis):
+    fake = fake_redis
+
+    async def run():
+        # Resolve the namespace generation up front; it is re-read only every CACHE_GEN_REFRESH_SECONDS
+        await cache_module._ageneration("page")
+        fake.round_trips = 0
+        await cache_set_many("page", {"s:1": {"html": "a"}, "s:2": {"html": "b"}})
+        cache_module._l1.clear()
+        got = await cache_get_many("page", ["s:1", "s:2", "s:3"])
+        # Now served from L1 without touching Redis
+        again = await cache_get_many("page", ["s:1", "s:2"])
+        return got, again
+
+    got, again = asyncio.run(run())
+    assert got == {"s:1": {"html": "a"}, "s:2": {"html": "b"}}
+    assert again == got
+    assert fake.round_trips == 2
+
+
+def test_codecs_round_trip_and_read_legacy_json(monkeypatch):
+    """Each entry records its codec; headerless JSON from before codecs still decodes."""
+    from app.cache import decode_value, encode_value
+    record = {"story_id": "s", "page_num": 1, "html": "<p>door</p>" * 400}
+    blob = encode_value(record)
+    assert blob[:1] == b"\x00" and blob[2:3] == b"z"
+    assert len(blob) < len(record["html"]) / 4
+    assert decode_value(blob) == record
+    vec = np.arange(4, dtype=np.float32)
+    blob = encode_value(vec)
+    assert blob[1:3] == b"fn" and len(blob) == 3 + 16
+    assert decode_value(blob).tolist() == [0.0, 1.0, 2.0, 3.0]
+    assert decode_value(b'{"a": 1}') == {"a": 1}
+    # Switching the default codec leaves existing entries readable
+    monkeypatch.setattr(cache_module, "CACHE_CODEC", "json")
+    assert decode_value(encode_value({"b": [1, 2]})) == {"b": [1, 2]}
+    assert decode_value(encode_value([np.float32(0.5)])) == [0.5]
+
+
+def test_concurrent_misses_compute_once():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"hits": [1, 2]}
+
+    async def run():
+        return await asyncio.gather(*(cache_module.cache_get_or_compute("flight", "q", compute, expires=60) for _ in range(5)))
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert {tuple(v["hits"]) for v, _ in results} == {(1, 2)}
+    assert asyncio.run(cache_module.cache_get_or_compute("flight", "q", compute, expires=60)) == ({"hits": [1, 2]}, True)
+
+
+def test_expired_entry_is_served_stale_and_refreshed_once():
+    cache_set("flight", "hot", {"v": "old", "d": 0.1, "x": time.time() - 1}, expires=60)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return "new"
+
+    async def run():
+        first = await cache_module.cache_get_or_compute("flight", "hot", compute, expires=60)
+        second = await cache_module.cache_get_or_compute("flight", "hot", compute, expires=60)
+        await asyncio.sleep(0.01)
+        return first, second, await cache_module.cache_get_or_compute("flight", "hot", compute, expires=60)
+
+    first, second, third = asyncio.run(run())
+    assert first == ("old", True) and second == ("old", True)
+    assert third == ("new", True)
+    assert len(calls) == 1
+
+
+def test_lease_holder_elsewhere_is_waited_on(monkeypatch, fake_redis):
+    """Another worker holds the lease: poll for its result instead of computing."""
+    fake = fake_redis
+
+    async def set_(key, value, nx=False, px=None):
+        # Lease taken by another worker, whose result lands shortly
+        cache_set("flight", "leased", {"v": "theirs", "d": 0.1, "x": time.time() + 60})
+        return None
+
+    fake.set = set_
+
+    async def compute():
+        raise AssertionError("should not compute")
+
+    assert asyncio.run(cache_module.cache_get_or_compute("flight", "leased", compute, expires=60)) == ("theirs", False)
+
+
+def test_namespace_clear_bumps_generation(fake_redis):
+    """Clearing a namespace moves it to fresh keys; nothing is scanned or deleted."""
+    async def run():
+        await cache_set_many("search", {"q": [1]})
+        old_keys = set(fake_redis.data)
+        # Another worker bumps the generation
+        fake_redis._incr("cache:gen:search")
+        cache_module._generations["search"] = (0, 0.0)
+        return old_keys, await cache_get_many("search", ["q"])
+
+    old_keys, after = asyncio.run(run())
+    assert "search:g0:q" in old_keys
+    assert after == {}
+    assert "search:g0:q" in fake_redis.data
+    assert cache_module._l1.get("search", "q") is None
+
+
+def test_invalidate_tags_drops_tagged_entries_only(fake_redis):
+    async def run():
+        await cache_set_many("page", {"s:1": {"html": "a"}, "s:2": {"html": "b"}}, tags={"s:1": ["page:s:1"], "s:2": ["page:s:2"]})
+        await cache_module.acache_set("retrieval", "door", [{"page_num": 1}, {"page_num": 3}], tags=["page:s:1", "page:s:3"])
+        await cache_module.acache_set("retrieval", "key", [{"page_num": 2}], tags=["page:s:2"])
+        removed = await cache_module.cache_invalidate_tags(["page:s:1"])
+        return removed, await cache_get_many("page", ["s:1", "s:2"]), await cache_get_many("retrieval", ["door", "key"])
+
+    removed, pages, rankings = asyncio.run(run())
+    assert removed == 2
+    assert pages == {"s:2": {"html": "b"}}
+    assert list(rankings) == ["key"]
+    assert "cache:tag:page:s:1" not in fake_redis.data
+    assert len(fake_redis.published) == 1
+
+
+def test_tag_sets_drop_expired_members_on_write(fake_redis):
+    async def run():
+        await cache_module.acache_set("retrieval", "old", [1], expires=-1, tags=["page:s:1"])
+        await cache_module.acache_set("retrieval", "new", [2], expires=60, tags=["page:s:1"])
+
+    asyncio.run(run())
+    assert list(fake_redis.data["cache:tag:page:s:1"]) == [b"retrieval:g0:new"]
+
+
+def test_invalidations_from_other_workers_reach_l1():
+    import json
+    cache_module._mem_set("page", "s:1", {"html": "a"}, tags=["page:s:1"])
+    cache_module._mem_set("page", "s:2", {"html": "b"})
+    cache_module._mem_set("retrieval", "door", [1])
+    cache_module._mem_set("search", "q", [2])
+    # Our own messages were applied before publishing
+    cache_module._apply_invalidation(json.dumps({"from": cache_module._WORKER_ID, "namespace": "search"}))
+    assert cache_get("search", "q") == [2]
+    cache_module._apply_invalidation(json.dumps({"from": "other", "tags": ["page:s:1"], "keys": ["retrieval:g0:door"]}))
+    assert cache_get("page", "s:1") is None and cache_get("retrieval", "door") is None
+    assert cache_get("page", "s:2") == {"html": "b"}
+    cache_module._apply_invalidation(json.dumps({"from": "other", "namespace": "page"}))
+    assert cache_get("page", "s:2") is None
+    assert cache_get("search", "q") == [2]
@@ -0,0 +1,75 @@
+"""
+Tests for the async chat stream: coalescing, JSON SSE frames and cancellation.
+"""
+import asyncio
+import json
+
+import numpy as np
+
+from app import chat
+
+
+async def _deltas(items, delay=0.0, closed=None):
+    try:
+        for item in items:
+            if delay:
+                await asyncio.sleep(delay)
+            yield item
+    finally:
+        if closed is not None:
+            closed.append(True)
+
+
+async def _collect(agen):
+    return [item async for item in agen]
+
+
+def test_coalesce_by_size_then_flushes_tail():
+    pieces = asyncio.run(_collect(chat.coalesce(_deltas(["ab", "cd", "ef", "g"]), window_ms=10_000, max_chars=4)))
+    assert pieces == ["abcd", "efg"]
+
+
+def test_coalesce_by_time_window():
+    pieces = asyncio.run(_collect(chat.coalesce(_deltas(["a", "b", "c"], delay=0.03), window_ms=10, max_chars=100)))
+    assert "".join(pieces) == "abc"
+    assert len(pieces) == 3
+
+
+def test_sse_frames_are_json():
+    frame = chat.sse("token", "it's \"quoted\"\n")
+    assert frame.startswith("data: ") and frame.endswith("\n\n")
+    assert json.loads(frame[6:]) == {"event": "token", "data": "it's \"quoted\"\n"}
+    assert json.loads(chat.sse("sources", [{"score": np.float32(0.5)}])[6:])["data"] == [{"score": 0.5}]
+
+
+def test_disconnect_closes_upstream(monkeypatch):
+    closed = []
+    monkeypatch.setattr(chat, "stream_completion", lambda prompt: _deltas(["x" * 100] * 5, closed=closed))
+
+    class Request:
+        calls = 0
+
+        async def is_disconnected(self):
+            self.calls += 1
+            return self.calls > 1
+
+    frames = asyncio.run(_collect(chat.stream_answer("p", [], Request())))
+    events = [json.loads(f[6:])["event"] for f in frames]
+    assert events == ["sources", "token"]
+    assert closed == [True]
+
+
+def test_closing_mid_window_stops_a_slow_upstream():
+    """A window flush leaves __anext__ running; closing then must not hit the running generator."""
+    closed = []
+
+    async def run():
+        pieces = chat.coalesce(_deltas(["a", "b", "c"], delay=0.05, closed=closed), window_ms=10, max_chars=100)
+        first = await pieces.__anext__()
+        # The next delta is still being awaited when the client goes away
+        await asyncio.sleep(0.02)
+        await pieces.aclose()
+        return first
+
+    assert asyncio.run(run()) == "a"
+    assert closed == [True]
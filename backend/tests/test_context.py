@@ -0,0 +1,35 @@
+"""
+Tests for token-budgeted chat context packing.
+"""
+from app.context import PAGE_OVERHEAD_TOKENS, build_prompt, pack_context, split_paragraphs
+
+
+def _page(num, html, tokens=None, paragraph_tokens=None):
+    page = {"story_id": "s", "page_num": num, "score": 1.0, "html": html}
+    if tokens is not None:
+        page["tokens"] = tokens
+        page["paragraph_tokens"] = paragraph_tokens or []
+    return page
+
+
+def test_packs_greedily_by_stored_counts():
+    """Pages that do not fit are skipped; a smaller later page still goes in."""
+    pages = [_page(1, "a", 50), _page(2, "b", 100), _page(3, "c", 30)]
+    packed, used = pack_context("q", pages, budget=100 + 2 * PAGE_OVERHEAD_TOKENS, trim=False)
+    assert [p["page_num"] for p in packed] == [1, 3]
+    assert used == 80 + 2 * PAGE_OVERHEAD_TOKENS
+
+
+def test_missing_counts_use_length_estimate():
+    packed, _ = pack_context("q", [_page(1, "x" * 4000)], budget=500, trim=False)
+    assert packed == []
+
+
+def test_trim_keeps_best_paragraphs_in_page_order():
+    html = "The vault is cold.\n\nNothing here.\n\nMariner opens the vault."
+    assert len(split_paragraphs(html)) == 3
+    page = _page(1, html, 300, [100, 100, 100])
+    packed, used = pack_context("vault mariner", [page], budget=200 + PAGE_OVERHEAD_TOKENS, trim=True)
+    assert packed[0]["html"] == "The vault is cold.\n\nMariner opens the vault."
+    assert packed[0]["trimmed"] and used == 200 + PAGE_OVERHEAD_TOKENS
+    assert "Mariner opens" in build_prompt("q", packed)
@@ -0,0 +1,151 @@
+"""
+Tests for the shared Cassandra session and prepared-statement registry.
+"""
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+import db
+
+
+class FakeSession:
+    def __init__(self):
+        self.prepared = []
+        self.closed = False
+
+    def prepare(self, query):
+        self.prepared.append(query)
+        return f"prepared:{query}"
+
+    def shutdown(self):
+        self.closed = True
+
+
+@pytest.fixture
+def session(monkeypatch):
+    """Install a fake shared session and reset the registry around each test."""
+    fake = FakeSession()
+    db.shutdown()
+    monkeypatch.setattr(db, "_session", fake)
+    yield fake
+    db.shutdown()
+
+def test_get_session_is_shared(session):
+    """Handlers reuse the process-wide session instead of reconnecting."""
+    assert db.get_cassandra_session() is session
+    assert db.get_cassandra_session() is session
+
+def test_prepared_once_per_name(session):
+    """Statements are prepared on first lookup and served from the registry after."""
+    first = db.prepared("page_by_id")
+    again = db.prepared("page_by_id")
+    assert first is again
+    assert session.prepared == [db.STATEMENTS["page_by_id"]]
+
+def test_prepare_all_and_shutdown(session):
+    """Startup prepares the whole registry; shutdown closes and forgets it."""
+    db.prepare_all()
+    assert len(session.prepared) == len(db.STATEMENTS)
+    db.shutdown()
+    assert session.closed
+    assert db._prepared == {}
+    assert db._session is None
+
+def test_unknown_statement(session):
+    """Looking up an unregistered name fails loudly."""
+    with pytest.raises(KeyError):
+        db.prepared("nope")
+
+
+class ThreadedFuture:
+    """ResponseFuture stand-in that delivers pages from a driver-like thread."""
+
+    def __init__(self, pages=None, error=None):
+        self._pages = list(pages or [[]])
+        self._error = error
+        self.has_more_pages = len(self._pages) > 1
+
+    def _deliver(self):
+        if self._error is not None:
+            self._errback(self._error)
+            return
+        page = self._pages.pop(0)
+        self.has_more_pages = len(self._pages) > 0
+        self._callback(page)
+
+    def add_callbacks(self, callback, errback):
+        self._callback, self._errback = callback, errback
+        threading.Timer(0.01, self._deliver).start()
+
+    def start_fetching_next_page(self):
+        threading.Timer(0.01, self._deliver).start()
+
+
+class AsyncSession:
+    def __init__(self, future):
+        self.future = future
+        self.calls = []
+
+    def execute_async(self, query, params=None):
+        self.calls.append((query, params))
+        return self.future
+
+def test_execute_async_collects_all_pages():
+    """Every page of a paged result is gathered before the await returns."""
+    session = AsyncSession(ThreadedFuture(pages=[[1, 2], [3], [4]]))
+    rows = asyncio.run(db.execute_async(session, "stmt", ("a",)))
+    assert rows == [1, 2, 3, 4]
+    assert session.calls == [("stmt", ("a",))]
+
+def test_execute_async_raises_driver_error():
+    """Driver errors surface as exceptions at the await."""
+    session = AsyncSession(ThreadedFuture(error=RuntimeError("timeout")))
+    with pytest.raises(RuntimeError, match="timeout"):
+        asyncio.run(db.execute_async(session, "stmt"))
+
+def test_execute_async_does_not_block_loop():
+    """Other coroutines keep running while a query is in flight."""
+    async def scenario():
+        ticks = []
+        async def ticker():
+            for _ in range(3):
+                ticks.append(1)
+                await asyncio.sleep(0)
+        session = AsyncSession(ThreadedFuture(pages=[["row"]]))
+        rows, _ = await asyncio.gather(db.execute_async(session, "stmt"), ticker())
+        return rows, ticks
+    rows, ticks = asyncio.run(scenario())
+    assert rows == ["row"]
+    assert len(ticks) == 3
+
+
+def test_embedding_blob_round_trip():
+    """Packed float32 is exact; float16 blobs are marked and widened."""
+    vec = np.random.default_rng(0).normal(size=db.EMBED_DIM).astype(np.float32)
+    blob = db.pack_embedding(vec)
+    assert len(blob) == 4 * db.EMBED_DIM
+    assert np.array_equal(db.unpack_embedding(blob), vec)
+    half = db.unpack_embedding(db.pack_embedding(vec, "float16"))
+    assert half.dtype == np.float32
+    assert np.allclose(half, vec, atol=1e-2)
+    # A float32 vector of half the width is the same size as a float16 one
+    short = vec[: db.EMBED_DIM // 2]
+    assert np.array_equal(db.unpack_embedding(db.pack_embedding(short)), short)
+
+
+def test_page_row_factory_prefers_blob():
+    """The blob replaces ``embedding``; rows without one keep the legacy list."""
+    blob = db.pack_embedding([1.0, 2.0, 3.0])
+    rows = db.page_row_factory(
+        ["story_id", "page_num", "embedding", "embedding_blob"],
+        [("s", 1, None, blob), ("s", 2, [4.0, 5.0, 6.0], None)],
+    )
+    assert rows[0]._fields == ("story_id", "page_num", "embedding")
+    assert rows[0].embedding.tolist() == [1.0, 2.0, 3.0]
+    assert rows[1].embedding == [4.0, 5.0, 6.0]
+    # Selecting only the blob still surfaces it as ``embedding``
+    only = db.page_row_factory(["embedding_blob", "page_num"], [(blob, 1)])
+    assert only[0].embedding.tolist() == [1.0, 2.0, 3.0] and only[0].page_num == 1
+    # Other tables are untouched
+    assert db.page_row_factory(["bot_id"], [("b",)])[0].bot_id == "b"
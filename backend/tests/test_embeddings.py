@@ -0,0 +1,109 @@
+"""
+Tests for the query-embedding cache.
+"""
+import asyncio
+
+import numpy as np
+import pytest
+import openai
+
+import embeddings
+from cache import cache_clear
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    """Count embedding calls and return a vector derived from the input length."""
+    calls = []
+    def create(model, input):
+        calls.extend(input)
+        return {"data": [{"index": i, "embedding": [float(len(t))] * 4} for i, t in enumerate(input)]}
+    monkeypatch.setattr(openai.Embedding, "create", create)
+    embeddings.embedding_cache.clear()
+    cache_clear("embed")
+    yield calls
+    embeddings.embedding_cache.clear()
+    cache_clear("embed")
+
+def test_normalised_queries_share_one_call(fake_openai):
+    """Case and whitespace variants of a query are embedded once."""
+    first = asyncio.run(embeddings.embed_query("The  Door"))
+    second = asyncio.run(embeddings.embed_query(" the door "))
+    assert fake_openai == ["the door"]
+    assert first.dtype == np.float32
+    assert np.array_equal(first, second)
+
+def test_model_is_part_of_key(fake_openai):
+    """The same text under another model is a separate entry."""
+    asyncio.run(embeddings.embed_query("door"))
+    asyncio.run(embeddings.embed_query("door", model="other-model"))
+    assert len(fake_openai) == 2
+
+def test_vectors_live_once_in_the_shared_cache(fake_openai):
+    """Vectors are kept as float32 bytes in the ``embed`` namespace only, read back read-only."""
+    import cache
+    store = embeddings.EmbeddingCache()
+    asyncio.run(store.aput("a", "m", [1.0, 2.0]))
+    asyncio.run(store.aput("a", "m", [1.0, 2.0]))
+    assert cache._l1.size("embed") == (1, 8)
+    vec = asyncio.run(store.aget_many(["a", "b"], "m"))
+    assert list(vec) == ["a"]
+    assert vec["a"].dtype == np.float32 and vec["a"].tolist() == [1.0, 2.0]
+    assert not vec["a"].flags.writeable
+
+def test_rate_limit_retries_then_raises(monkeypatch):
+    """Rate limits are retried with backoff and re-raised when they persist."""
+    attempts = []
+    def create(model, input):
+        attempts.append(input)
+        raise openai.error.RateLimitError("slow down")
+    async def no_sleep(_):
+        return None
+    monkeypatch.setattr(openai.Embedding, "create", create)
+    monkeypatch.setattr(embeddings.asyncio, "sleep", no_sleep)
+    embeddings.embedding_cache.clear()
+    with pytest.raises(openai.error.RateLimitError):
+        asyncio.run(embeddings.embed_query("uncached query"))
+    assert len(attempts) == embeddings.EMBED_MAX_ATTEMPTS
+
+
+class StubEmbedder:
+    """Local batch embedder recording each batch it is sent."""
+
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+
+    async def __call__(self, texts, model):
+        self.batches.append(list(texts))
+        await asyncio.sleep(0)
+        if self.fail:
+            raise RuntimeError("provider down")
+        return [[float(len(t)), float(ord(t[0]))] for t in texts]
+
+def test_batcher_coalesces_concurrent_requests():
+    """Concurrent embeds within the window go out as one batch, in order."""
+    stub = StubEmbedder()
+    batcher = embeddings.EmbeddingBatcher(stub, window_ms=5, max_batch=64)
+    async def scenario():
+        return await asyncio.gather(*(batcher.embed(t) for t in ["a", "bb", "a", "ccc"]))
+    vecs = asyncio.run(scenario())
+    assert stub.batches == [["a", "bb", "ccc"]]
+    assert vecs == [[1.0, 97.0], [2.0, 98.0], [1.0, 97.0], [3.0, 99.0]]
+
+def test_batcher_flushes_at_max_batch():
+    """A full batch is sent immediately rather than waiting for the window."""
+    stub = StubEmbedder()
+    batcher = embeddings.EmbeddingBatcher(stub, window_ms=10_000, max_batch=2)
+    async def scenario():
+        return await asyncio.wait_for(asyncio.gather(batcher.embed("a"), batcher.embed("b")), 1)
+    assert len(asyncio.run(scenario())) == 2
+    assert stub.batches == [["a", "b"]]
+
+def test_batcher_propagates_errors_to_all_waiters():
+    """A failed batch fails every request that was waiting on it."""
+    batcher = embeddings.EmbeddingBatcher(StubEmbedder(fail=True), window_ms=1)
+    async def scenario():
+        return await asyncio.gather(batcher.embed("a"), batcher.embed("b"), return_exceptions=True)
+    results = asyncio.run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in results)
@@ -0,0 +1,48 @@
+"""
+Tests for the persistent HNSW label table.
+"""
+import numpy as np
+from app.labels import LabelTable, label_paths
+
+
+def test_labels_are_dense_and_stable():
+    """Labels are assigned in insertion order and reused for known pages."""
+    table = LabelTable()
+    assert table.label_for("entrance", 1) == 0
+    assert table.label_for("entrance", 2) == 1
+    assert table.label_for("book2", 1) == 2
+    assert table.label_for("entrance", 1) == 0
+    assert len(table) == 3
+    assert table.lookup(2) == ("book2", 1)
+    assert table.lookup(99) == ("unknown", 0)
+    assert table.lookup(-1) == ("unknown", 0)
+
+def test_round_trip_is_memory_mapped(tmp_path):
+    """A saved table reloads as a memory map with identical lookups."""
+    index_path = tmp_path / "hnsw.idx"
+    pages = [("entrance", n) for n in range(1, 701)] + [("book2", 5)]
+    LabelTable.for_pages(pages).save(str(index_path))
+    rows_path, stories_path = label_paths(str(index_path))
+    assert rows_path.endswith("hnsw.labels.npy") and stories_path.endswith("hnsw.stories.json")
+
+    loaded = LabelTable.load(str(index_path))
+    assert isinstance(loaded._rows, np.memmap)
+    assert loaded.lookup_many([0, 699, 700]) == [("entrance", 1), ("entrance", 700), ("book2", 5)]
+    # New pages append after the existing labels without touching the map on disk
+    assert loaded.get("book2", 5) == 700
+    assert loaded.label_for("book3", 1) == 701
+    assert LabelTable.load(str(index_path)).lookup(701) == ("unknown", 0)
+
+def test_missing_files_give_empty_table(tmp_path):
+    """No sidecar files on disk means an empty table."""
+    assert len(LabelTable.load_or_empty(str(tmp_path / "hnsw.idx"))) == 0
+
+def test_mask_selects_story_and_range():
+    table = LabelTable.for_pages([("a", 1), ("b", 1), ("a", 2), ("a", 3)])
+    assert table.mask("a").tolist() == [True, False, True, True]
+    assert table.mask("a", page_from=2, page_to=2).tolist() == [False, False, True, False]
+    assert table.mask(page_to=1).tolist() == [True, True, False, False]
+    assert not table.mask("zzz").any()
+    # The cached story bitmap is refreshed after new labels
+    table.label_for("a", 4)
+    assert table.mask("a").tolist() == [True, False, True, True, True]
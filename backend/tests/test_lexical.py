@@ -0,0 +1,45 @@
+"""
+Tests for the BM25 inverted index and reciprocal rank fusion.
+"""
+from app.lexical import BM25Index, fuse, tokenize
+
+
+def _index():
+    return BM25Index.build([
+        ("s", 1, "<p>Phillip Mariner walks the vault.</p>"),
+        ("s", 2, "The vault is quiet. The vault is cold."),
+        ("t", 1, "Nobody here is named after a sailor."),
+        ("t", 2, "Mariner's log: Phillip again"),
+    ])
+
+
+def test_tokenize_strips_markup_and_keeps_apostrophes():
+    assert tokenize("<b>Mariner's</b> LOG, again!") == ["mariner's", "log", "again"]
+
+
+def test_bm25_ranks_rare_terms_and_term_frequency():
+    """Rarer query terms dominate, repeated terms raise a page, non-matches are dropped."""
+    index = _index()
+    hits = index.search("phillip", 5)
+    assert {(h["story_id"], h["page_num"]) for h in hits} == {("s", 1), ("t", 2)}
+    assert index.search("vault", 5)[0]["page_num"] == 2
+    assert index.search("unheard-of", 5) == []
+    # Filters reuse the label masks
+    assert [(h["story_id"], h["page_num"]) for h in index.search("phillip", 5, story_id="t")] == [("t", 2)]
+
+
+def test_save_load_round_trip(tmp_path):
+    index = _index()
+    path = str(tmp_path / "bm25.npz")
+    index.save(path)
+    loaded = BM25Index.load(path)
+    assert loaded.search("vault phillip", 3) == index.search("vault phillip", 3)
+
+
+def test_rrf_rewards_agreement():
+    """A page ranked well by both lists beats one ranked first by only one."""
+    lexical = [{"story_id": "s", "page_num": 1}, {"story_id": "s", "page_num": 2}]
+    vector = [{"story_id": "s", "page_num": 3}, {"story_id": "s", "page_num": 2}]
+    fused = fuse([lexical, vector], k=2)
+    assert [h["page_num"] for h in fused] == [2, 1]
+    assert abs(fused[0]["score"] - 2 / 62) < 1e-9
@@ -0,0 +1,82 @@
+"""
+Tests for the shared retrieval pipeline's page hydration.
+"""
+import asyncio
+from collections import namedtuple
+
+import numpy as np
+
+from app import retrieval
+
+Row = namedtuple("Row", "story_id page_num html embedding")
+
+
+def test_page_record_is_json_safe():
+    record = retrieval.page_record(Row("s", 1, "<p>x</p>", np.ones(2, dtype=np.float32)))
+    assert record["embedding"] == [1.0, 1.0]
+
+
+def test_hydrate_reads_cache_then_one_query_per_story(monkeypatch):
+    """Cached pages skip Cassandra; the rest are fetched per story and cached."""
+    cache = {"page:s:1": {"html": "cached"}}
+    queries = []
+
+    async def fake_execute(session, stmt, params):
+        queries.append(params)
+        sid, nums = params
+        return [Row(sid, n, f"{sid}-{n}", None) for n in nums]
+
+    stored_tags = {}
+
+    async def get_many(ns, keys):
+        return {key: cache[f"{ns}:{key}"] for key in keys if f"{ns}:{key}" in cache}
+
+    async def set_many(ns, items, expires=None, tags=None):
+        cache.update({f"{ns}:{key}": value for key, value in items.items()})
+        stored_tags.update(tags or {})
+
+    monkeypatch.setattr(retrieval, "cache_get_many", get_many)
+    monkeypatch.setattr(retrieval, "cache_set_many", set_many)
+    monkeypatch.setattr(retrieval.vector_store, "is_loaded", lambda: False)
+    monkeypatch.setattr(retrieval, "get_cassandra_session", lambda: object())
+    monkeypatch.setattr(retrieval, "prepared", lambda name, session: name)
+    monkeypatch.setattr(retrieval, "execute_async", fake_execute)
+
+    hits = [{"story_id": "s", "page_num": n, "score": 1.0} for n in (1, 2, 3)]
+    hits.append({"story_id": "t", "page_num": 7, "score": 0.5})
+    out = asyncio.run(retrieval.hydrate(hits))
+
+    assert [h["html"] for h in out] == ["cached", "s-2", "s-3", "t-7"]
+    assert sorted(queries) == [("s", [2, 3]), ("t", [7])]
+    assert "page:t:7" in cache
+    assert stored_tags["t:7"] == ["page:t:7"]
+    assert "html" not in hits[0]
+
+
+def test_write_through_page_invalidates_then_caches_stored_row(monkeypatch):
+    calls = []
+
+    async def invalidate(tags):
+        calls.append(("invalidate", tags))
+
+    async def set_(ns, key, value, expires=None, tags=()):
+        calls.append(("set", ns, key, value["html"], tags))
+
+    async def fake_execute(session, stmt, params):
+        return [Row(*params, "<p>new</p>", None)]
+
+    monkeypatch.setattr(retrieval, "cache_invalidate_tags", invalidate)
+    monkeypatch.setattr(retrieval, "acache_set", set_)
+    monkeypatch.setattr(retrieval, "get_cassandra_session", lambda: object())
+    monkeypatch.setattr(retrieval, "prepared", lambda name, session: name)
+    monkeypatch.setattr(retrieval, "execute_async", fake_execute)
+
+    record = asyncio.run(retrieval.write_through_page("s", 4))
+    assert record["html"] == "<p>new</p>"
+    assert calls == [("invalidate", ["page:s:4"]), ("set", "page", "s:4", "<p>new</p>", ["page:s:4"])]
+
+
+def test_public_hits_drop_context_packing_fields():
+    hits = [{"story_id": "s", "page_num": 1, "html": "x", "tokens": 3, "paragraph_tokens": [3]}]
+    assert retrieval.public_hits(hits) == [{"story_id": "s", "page_num": 1, "html": "x"}]
+    assert "tokens" in hits[0]
@@ -32,8 +32,8 @@ def mock_openai_embedding():
 
 @pytest.fixture
 def mock_cassandra_session():
-    # Patch Cassandra session in main module
-    with patch('main.get_cassandra_session') as mock:
+    # Patch Cassandra session in main module and the retrieval pipeline
+    with patch('main.get_cassandra_session') as mock, patch('retrieval.get_cassandra_session', mock):
         session = MagicMock()
         
         # Mock rows without html field
@@ -62,6 +62,13 @@ def mock_cassandra_session():
                 return [mock_row1, mock_row2, mock_row3]
         
         session.execute = MagicMock(side_effect=mock_execute)
+        # Async driver API: a ResponseFuture that is already complete
+        def mock_execute_async(query, *args, **kwargs):
+            future = MagicMock()
+            future.has_more_pages = False
+            future.add_callbacks.side_effect = lambda callback, errback: callback(mock_execute(query, *args))
+            return future
+        session.execute_async = MagicMock(side_effect=mock_execute_async)
         
         # Mock the prepare method
         prepared = MagicMock()
@@ -0,0 +1,155 @@
+"""
+Tests for the resident vector store.
+"""
+from types import SimpleNamespace
+
+import numpy as np
+from app.vector_store import Int8Quantizer, QuantizedVectorStore, VectorStore, recall_at_k
+
+
+def _rows():
+    return [
+        SimpleNamespace(story_id="s", page_num=1, html="one", embedding=[1.0, 0.0, 0.0]),
+        SimpleNamespace(story_id="s", page_num=2, html="two", embedding=[0.0, 2.0, 0.0]),
+        SimpleNamespace(story_id="t", page_num=1, html="three", embedding=[1.0, 1.0, 0.0]),
+        SimpleNamespace(story_id="t", page_num=2, html=None, embedding=None),
+    ]
+
+def test_from_rows_normalises_and_skips_missing():
+    """Rows are unit length and pages without embeddings are dropped."""
+    store = VectorStore.from_rows(_rows())
+    assert len(store) == 3
+    assert store.dim == 3
+    norms = np.linalg.norm(store._state[1], axis=1)
+    assert np.allclose(norms, 1.0)
+
+def test_search_top_k_order():
+    """Search returns the k best pages, highest cosine first."""
+    store = VectorStore.from_rows(_rows())
+    hits = store.search([1.0, 0.1, 0.0], k=2)
+    assert [(h["story_id"], h["page_num"]) for h in hits] == [("s", 1), ("t", 1)]
+    assert hits[0]["score"] > hits[1]["score"]
+    assert "html" not in hits[0]
+    assert store.search([0.0, 1.0, 0.0], k=1, with_html=True)[0]["html"] == "two"
+    # k larger than the store returns everything
+    assert len(store.search([1.0, 0.0, 0.0], k=10)) == 3
+
+def test_search_matches_brute_force():
+    """Top-k agrees with a plain sorted cosine scan."""
+    rng = np.random.default_rng(0)
+    vecs = rng.normal(size=(200, 16)).astype(np.float32)
+    store = VectorStore([("s", i) for i in range(200)], vecs)
+    q = rng.normal(size=16).astype(np.float32)
+    expected = np.argsort(-(vecs @ q) / np.linalg.norm(vecs, axis=1))[:5]
+    assert [h["page_num"] for h in store.search(q, 5)] == expected.tolist()
+
+def test_upsert_replaces_and_appends():
+    """Upsert replaces an existing page in place and appends new ones."""
+    store = VectorStore.from_rows(_rows())
+    store.upsert("s", 1, [0.0, 0.0, 5.0])
+    assert len(store) == 3
+    top = store.search([0.0, 0.0, 1.0], k=1, with_html=True)[0]
+    assert (top["story_id"], top["page_num"], top["html"]) == ("s", 1, "one")
+    assert abs(top["score"] - 1.0) < 1e-5
+    store.upsert("u", 9, [0.0, -1.0, 0.0], html="new")
+    assert len(store) == 4
+    assert store.search([0.0, -1.0, 0.0], k=1, with_html=True)[0]["html"] == "new"
+
+def test_search_many_matches_single_queries():
+    """Batched search gives the same rankings as one search per query, with per-row k."""
+    rng = np.random.default_rng(1)
+    vecs = rng.normal(size=(50, 8)).astype(np.float32)
+    store = VectorStore([("s", i) for i in range(50)], vecs)
+    queries = rng.normal(size=(3, 8)).astype(np.float32)
+    batched = store.search_many(queries, [1, 4, 2])
+    assert [len(r) for r in batched] == [1, 4, 2]
+    for q, k, hits in zip(queries, [1, 4, 2], batched):
+        assert hits == store.search(q, k)
+
+def test_search_filters_story_and_page_range():
+    """Filters restrict candidates before ranking and shrink k to what is allowed."""
+    store = VectorStore.from_rows(_rows())
+    hits = store.search([1.0, 0.1, 0.0], k=5, story_id="s")
+    assert [(h["story_id"], h["page_num"]) for h in hits] == [("s", 1), ("s", 2)]
+    hits = store.search([1.0, 0.1, 0.0], k=5, page_from=2)
+    assert [(h["story_id"], h["page_num"]) for h in hits] == [("s", 2)]
+    assert store.search([1.0, 0.0, 0.0], k=5, story_id="t", page_to=1)[0]["page_num"] == 1
+    assert store.search([1.0, 0.0, 0.0], k=5, story_id="missing") == []
+
+def test_int8_quantizer_round_trip():
+    """Codes decode to within half a quantisation step per dimension."""
+    mat = np.random.default_rng(2).normal(size=(100, 16)).astype(np.float32)
+    quant = Int8Quantizer.fit(mat)
+    codes = quant.encode(mat)
+    assert codes.dtype == np.int8
+    assert np.all(np.abs(quant.decode(codes) - mat) <= quant.scale / 2 + 1e-6)
+
+def test_quantized_store_recall_and_footprint():
+    """The int8 store holds a quarter of the bytes and re-ranks to the exact top-k."""
+    rng = np.random.default_rng(3)
+    vecs = rng.normal(size=(500, 64)).astype(np.float32)
+    ids = [("s", i) for i in range(500)]
+    exact, quant = VectorStore(ids, vecs), QuantizedVectorStore(ids, vecs)
+    assert quant.nbytes * 4 == exact._state.matrix.nbytes
+    queries = vecs[:20] + rng.normal(size=(20, 64)).astype(np.float32)
+    recalls = [recall_at_k(exact.search(q, 10), quant.search(q, 10)) for q in queries]
+    assert np.mean(recalls) >= 0.95
+    # Re-ranked scores are the exact float32 cosines
+    top = quant.search(queries[0], 1)[0]
+    assert abs(top["score"] - exact.search(queries[0], 1)[0]["score"]) < 1e-5
+    # Filters and upserts behave as on the float32 store
+    assert all(h["page_num"] < 50 for h in quant.search(queries[0], 5, page_to=49))
+    quant.upsert("t", 1, queries[1] * 3)
+    assert quant.search(queries[1], 1)[0]["story_id"] == "t"
+
+def test_quantized_upsert_encodes_only_the_written_row():
+    """Updates and appends touch one row of the codes and the spilled matrix."""
+    rng = np.random.default_rng(4)
+    vecs = rng.normal(size=(50, 16)).astype(np.float32)
+    store = QuantizedVectorStore([("s", i) for i in range(50)], vecs)
+    encoded = []
+    encode = store._quantizer.encode
+    store._quantizer.encode = lambda m: encoded.append(len(m)) or encode(m)
+    store.upsert("s", 3, vecs[10])
+    for i in range(20):
+        store.upsert("t", i, vecs[i] * 2)
+    assert encoded == [1] * 21
+    assert len(store) == 70 and len(store._state.codes) == 70
+    assert store.search(vecs[10], 2)[0]["page_num"] in (3, 10)
+    assert store.search(vecs[7], 1)[0]["story_id"] in ("s", "t")
+    assert np.allclose(store._state.matrix[52], vecs[2] / np.linalg.norm(vecs[2]), atol=1e-6)
+
+def test_quantized_update_leaves_published_rows_alone():
+    """A search holding the old state never sees a row being rewritten."""
+    rng = np.random.default_rng(5)
+    vecs = rng.normal(size=(10, 16)).astype(np.float32)
+    store = QuantizedVectorStore([("s", i) for i in range(10)], vecs)
+    before = store._state
+    matrix, codes = before.matrix.copy(), before.codes.copy()
+    store.upsert("s", 3, vecs[7])
+    assert np.array_equal(before.matrix, matrix) and np.array_equal(before.codes, codes)
+    assert np.allclose(store._state.matrix[3], store._state.matrix[7])
+    store.upsert("t", 0, vecs[0])
+    assert np.array_equal(before.matrix, matrix[:10])
+
+def _matryoshka_like(rng, n, dim):
+    # Leading components carry most of the signal, as in truncatable embeddings
+    return (rng.normal(size=(n, dim)) * np.linspace(3.0, 0.1, dim)).astype(np.float32)
+
+def test_prefix_first_pass_reranks_at_full_dim():
+    """A prefix shortlist re-ranked at full width matches the exact engine."""
+    rng = np.random.default_rng(4)
+    vecs = _matryoshka_like(rng, 400, 64)
+    store = VectorStore([("s", i) for i in range(400)], vecs)
+    queries = vecs[:20] + 0.3 * _matryoshka_like(rng, 20, 64)
+    recalls = []
+    for q in queries:
+        exact, fast = store.search(q, 5), store.search(q, 5, prefix_dim=16)
+        recalls.append(recall_at_k(exact, fast))
+        # Re-ranked scores are full-dimension cosines
+        v = vecs[fast[0]["page_num"]]
+        assert abs(fast[0]["score"] - v @ q / np.linalg.norm(v) / np.linalg.norm(q)) < 1e-5
+    assert np.mean(recalls) >= 0.9
+    # The prefix copy is built once per published state
+    assert set(store._state.prefixes) == {16}
+    assert all(h["page_num"] >= 200 for h in store.search(queries[0], 3, prefix_dim=16, page_from=200))
@@ -16,10 +16,19 @@ Steps
 2. Embed each page via OpenAI `text-embedding-3-small`.
    • Results are cached in ``data/vectors.npy`` to avoid re‑billing.
 3. Insert missing rows into Cassandra keyspace ``gibsey`` table
-   ``pages``, storing the embedding in the native 1536‑d vector column.
-4. Build a cosine HNSW index with *hnswlib* and write to
-   ``data/hnsw.idx``.
-5. Drop a SHA‑256 manifest ``data/corpus.manifest.json`` with
+   ``pages``, storing the embedding as packed float32 in ``embedding_blob``
+   and the page's chat-model token counts (``token_count``, per-paragraph
+   ``paragraph_tokens``) for token-budgeted prompts.
+4. Build a cosine HNSW index with *hnswlib* and publish it as a new
+   version ``data/hnsw/<version>/`` (``hnsw.idx``, its label table
+   ``hnsw.labels.npy`` / ``hnsw.stories.json`` and a
+   ``corpus.manifest.json``), plus reduced Matryoshka graphs over the
+   leading ``PREFIX_DIMS`` components (``hnsw.p256.idx``), then flip
+   ``data/hnsw/CURRENT`` to it.
+   Running API workers hot-swap to the new version without a restart.
+5. Build a BM25 inverted index over the page text (``data/bm25.npz``
+   postings + ``data/bm25.vocab.json``) for lexical/hybrid search.
+6. Drop a SHA‑256 manifest ``data/corpus.manifest.json`` with
    counts + file hashes so subsequent runs can validate quickly.
 
 Environment
@@ -63,6 +72,24 @@ try:
     from cassandra.query import BatchStatement  # type: ignore
 except Exception:
     BatchStatement = None  # type: ignore
+try:
+    from backend.app.labels import LabelTable  # type: ignore
+    from backend.app import index_versions  # type: ignore
+except ImportError:  # pragma: no cover
+    LabelTable = None  # type: ignore
+    index_versions = None  # type: ignore
+try:
+    from backend.app.lexical import BM25Index  # type: ignore
+except ImportError:  # pragma: no cover
+    BM25Index = None  # type: ignore
+try:
+    from backend.app.db import ensure_embedding_blob, ensure_token_counts, pack_embedding  # type: ignore
+except ImportError:  # pragma: no cover
+    ensure_embedding_blob = ensure_token_counts = pack_embedding = None  # type: ignore
+try:
+    from backend.app.context import page_token_counts  # type: ignore
+except ImportError:  # pragma: no cover
+    page_token_counts = None  # type: ignore
 
 # ---------------------------------------------------------------------------
 # Constants & Paths
@@ -71,11 +98,14 @@ ROOT = Path(__file__).resolve().parents[1]
 DATA_DIR = ROOT / "data"
 CORPUS_TXT = DATA_DIR / "cleaned_normalised.txt"
 VEC_NPY = DATA_DIR / "vectors.npy"
-HNSW_IDX = DATA_DIR / "hnsw.idx"
+HNSW_DIR = DATA_DIR / "hnsw"
 MANIFEST = DATA_DIR / "corpus.manifest.json"
+BM25_NPZ = DATA_DIR / "bm25.npz"
 EXPECTED_COUNT = 710
 EMBED_MODEL = "text-embedding-3-small"
 DIM = 1536
+# Truncated-embedding graphs built next to the full one (first-pass search)
+PREFIX_DIMS = tuple(int(d) for d in os.getenv("HNSW_PREFIX_DIMS", "256").split(",") if d)
 BATCH = 20  # embed batch size – tweak to stay under rate limits
 
 STORY_ID = "entrance"  # single story – can extend later
@@ -137,10 +167,16 @@ def connect_cassandra() -> "Cluster":  # type: ignore[name-defined]
             page_num int,
             html text,
             embedding vector<float, 1536>,
+            embedding_blob blob,
+            token_count int,
+            paragraph_tokens list<int>,
             PRIMARY KEY (story_id, page_num)
         );
         """
     )
+    if ensure_embedding_blob is not None:
+        ensure_embedding_blob(sess)
+        ensure_token_counts(sess)
     return sess
 
 
@@ -178,13 +214,61 @@ def embed_batch(texts: List[str]) -> List[List[float]]:
 # ---------------------------------------------------------------------------
 
 
-def build_hnsw(vectors: "np.ndarray") -> None:  # type: ignore[name-defined]
+def current_index() -> Optional[Path]:
+    """Index file of the published CURRENT version, if any."""
+    if index_versions is None:
+        return None
+    version = index_versions.read_current(str(HNSW_DIR))
+    if not version:
+        return None
+    path = Path(index_versions.index_path(str(HNSW_DIR), version))
+    return path if path.exists() else None
+
+
+def build_hnsw(vectors: "np.ndarray") -> Path:  # type: ignore[name-defined]
     if hnswlib is None:
         raise RuntimeError("hnswlib not installed – cannot build index")
+    if LabelTable is None or index_versions is None:
+        raise RuntimeError("backend.app not importable – cannot write index artifacts")
+    # Label i is page i+1 of STORY_ID, the same scheme ann_hnsw.pack_id assigns
+    labels = LabelTable.for_pages([(STORY_ID, n) for n in range(1, len(vectors) + 1)])
     idx = hnswlib.Index(space="cosine", dim=DIM)
     idx.init_index(max_elements=len(vectors), ef_construction=200, M=16)
-    idx.add_items(vectors, list(range(len(vectors))))
-    idx.save_index(str(HNSW_IDX))
+    idx.add_items(vectors, np.arange(len(vectors)))
+    # Publish as a new version; CURRENT flips only once every file is written
+    version = index_versions.new_version()
+    out = Path(index_versions.version_dir(str(HNSW_DIR), version))
+    out.mkdir(parents=True, exist_ok=True)
+    index_file = out / index_versions.INDEX_FILE
+    idx.save_index(str(index_file))
+    for dim in PREFIX_DIMS:
+        # Re-normalised prefix; a 256-d graph builds several times faster than 1536-d
+        reduced = vectors[:, :dim] / (np.linalg.norm(vectors[:, :dim], axis=1, keepdims=True) + 1e-9)
+        pidx = hnswlib.Index(space="cosine", dim=dim)
+        pidx.init_index(max_elements=len(vectors), ef_construction=200, M=16)
+        pidx.add_items(reduced, np.arange(len(vectors)))
+        pidx.save_index(str(out / f"{index_file.stem}.p{dim}{index_file.suffix}"))
+    labels.save(str(index_file))
+    index_versions.write_manifest(
+        str(HNSW_DIR),
+        version,
+        count=len(vectors),
+        dim=DIM,
+        stories=labels.stories,
+        prefix_dims=list(PREFIX_DIMS),
+        txt_sha=sha256(CORPUS_TXT) if CORPUS_TXT.exists() else None,
+        vec_sha=sha256(VEC_NPY) if VEC_NPY.exists() else None,
+    )
+    index_versions.write_current(str(HNSW_DIR), version)
+    return index_file
+
+
+def build_bm25(pages: List[str]) -> Path:
+    if BM25Index is None:
+        raise RuntimeError("backend.app not importable – cannot write lexical index")
+    index = BM25Index.build((STORY_ID, n, text) for n, text in enumerate(pages, start=1))
+    index.save(str(BM25_NPZ))
+    return BM25_NPZ
 
 
 # ---------------------------------------------------------------------------
@@ -196,10 +280,11 @@ def write_manifest(page_ct: int) -> None:
     manifest = {
         "pages": page_ct,
         "vectors": str(VEC_NPY),
-        "index": str(HNSW_IDX),
+        "index": str(current_index()),
         "txt_sha": sha256(CORPUS_TXT) if CORPUS_TXT.exists() else None,
         "vec_sha": sha256(VEC_NPY) if VEC_NPY.exists() else None,
-        "idx_mtime": HNSW_IDX.stat().st_mtime if HNSW_IDX.exists() else None,
+        "index_version": index_versions.read_current(str(HNSW_DIR)) if index_versions else None,
+        "lexical": str(BM25_NPZ) if BM25_NPZ.exists() else None,
         "generated": datetime.utcnow().isoformat() + "Z",
     }
     MANIFEST.write_text(json.dumps(manifest, indent=2))
@@ -230,7 +315,7 @@ def main() -> None:
         sys.exit(1)
 
     # Fast‑path idempotence check
-    up_to_date = VEC_NPY.exists() and HNSW_IDX.exists()
+    up_to_date = VEC_NPY.exists() and current_index() is not None
     if not args.force and up_to_date:
         try:
             vecs = np.load(VEC_NPY) if np is not None else None  # type: ignore[arg-type]
@@ -295,14 +380,16 @@ def main() -> None:
     existing = count_pages(sess)
     if existing < EXPECTED_COUNT:
         insert_stmt = sess.prepare(
-            "INSERT INTO pages (story_id, page_num, html, embedding) VALUES (?, ?, ?, ?)"
+            "INSERT INTO pages (story_id, page_num, html, embedding_blob, token_count, paragraph_tokens)"
+            " VALUES (?, ?, ?, ?, ?, ?)"
         )
         print(f"Inserting {EXPECTED_COUNT - existing} rows into Cassandra …")
         batch = BatchStatement()
         for idx, page in tqdm(list(enumerate(pages, start=1))):
             if idx <= existing:
                 continue  # already present
-            batch.add(insert_stmt, (STORY_ID, idx, page, vectors[idx - 1].tolist()))
+            token_count, paragraph_tokens = page_token_counts(page)
+            batch.add(insert_stmt, (STORY_ID, idx, page, pack_embedding(vectors[idx - 1]), token_count, paragraph_tokens))
             # Flush every 50 to avoid huge batch
             if idx % 50 == 0:
                 sess.execute(batch)
@@ -315,8 +402,12 @@ def main() -> None:
 
     # Build HNSW
     print("Building HNSW index …")
-    build_hnsw(vectors)
-    print(f"Index written → {HNSW_IDX}")
+    index_file = build_hnsw(vectors)
+    print(f"Index published → {index_file}")
+
+    # Lexical index over the same pages (labels match the HNSW ones)
+    build_bm25(pages)
+    print(f"BM25 index written → {BM25_NPZ}")
 
     write_manifest(len(pages))
     print("✔ seed complete in %.1fs" % (time.time() - start))
@@ -15,9 +15,14 @@ def stub_db(monkeypatch):
         def __init__(self):
             self._data = {'story_id': 'entrance', 'page_num': 1, 'html': 'dummy', 'embedding': [0]*1536}
         def _asdict(self): return self._data
+    class DummyFuture:
+        has_more_pages = False
+        def __init__(self, rows): self._rows = rows
+        def add_callbacks(self, callback, errback): callback(self._rows)
     class DummySession:
         def prepare(self, q): return q
         def execute(self, *args, **kwargs): return [DummyRow()]
+        def execute_async(self, *args, **kwargs): return DummyFuture([DummyRow()])
     monkeypatch.setattr('backend.app.main.get_cassandra_session', lambda: DummySession())
 
 @pytest.fixture(autouse=True)
@@ -29,7 +29,7 @@ def load_queries() -> list[str]:
 
 client = TestClient(app)
 
-@pytest.mark.skipif(not Path("data/hnsw.idx").exists(), reason="Run `make seed` before running latency tests")
+@pytest.mark.skipif(not Path("data/hnsw/CURRENT").exists(), reason="Run `make seed` before running latency tests")
 def test_search_latency_p95():
     queries = load_queries()
     latencies = []